@@ -0,0 +1,4 @@
+"""
+Benchmark suite for the backend hot paths
+Run with `python -m benchmarks.run` from the backend directory
+"""
@@ -0,0 +1,84 @@
+"""
+Batch evaluation benchmark
+The same queries as N /api/chat/message calls and as one /api/chat/batch run
+"""
+import asyncio
+import json
+import tempfile
+import time
+import uuid
+from typing import Any, Dict
+
+import httpx
+
+from benchmarks.bench_chat_load import rag_workflow_payload, start_api
+from benchmarks.mock_servers import mock_openai_server
+
+
+async def _compare(base_url: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    user_id = str(uuid.uuid4())
+    questions = [f"Question number {i}" for i in range(requests)]
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        workflow = await client.post("/api/workflows/", json=rag_workflow_payload(user_id))
+        workflow_id = workflow.json()["id"]
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(question: str) -> int:
+            async with semaphore:
+                response = await client.post("/api/chat/message", json={
+                    "workflow_id": workflow_id,
+                    "user_id": user_id,
+                    "message": question,
+                })
+                return response.status_code
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(one(q) for q in questions))
+        single_s = time.perf_counter() - started
+
+        # Different wording, so neither run is served from the other's retrieval cache
+        body = "\n".join(json.dumps({"query": f"{q}?"}) for q in questions).encode()
+        started = time.perf_counter()
+        response = await client.post(
+            f"/api/chat/batch/{workflow_id}",
+            params={"concurrency": concurrency},
+            files={"file": ("queries.jsonl", body)},
+        )
+        batch_s = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"Batch evaluation failed with {response.status_code}: {response.text[:200]}")
+        records = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        summary = next((record for record in records if record.get("summary")), None)
+        if summary is None:
+            raise RuntimeError("Batch evaluation ended without a summary line")
+
+    return {
+        "single_calls": {
+            "errors": sum(status != 200 for status in statuses),
+            "duration_s": round(single_s, 3),
+            "queries_per_s": round(requests / single_s, 2),
+        },
+        "batch": {
+            "errors": summary["errors"],
+            "duration_s": round(batch_s, 3),
+            "queries_per_s": round(requests / batch_s, 2),
+            "latency_p50_ms": summary["latency_p50_ms"],
+        },
+        "speedup": round(single_s / batch_s, 2),
+    }
+
+
+def run(requests: int = 200, concurrency: int = 20, llm_latency_ms: float = 50.0,
+        embedding_latency_ms: float = 10.0) -> Dict[str, Any]:
+    with mock_openai_server(embedding_latency_ms=embedding_latency_ms, chat_latency_ms=llm_latency_ms), \
+            tempfile.TemporaryDirectory() as tmp:
+        # The single calls leave the loop lagging; shedding the batch right after them
+        # would measure the load shedder, not batch throughput
+        process, base_url = start_api(tmp, {"LOAD_SHED_ROUTES": ""})
+        try:
+            result = asyncio.run(_compare(base_url, requests, concurrency))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    return {f"batch_eval[queries={requests},concurrency={concurrency}]": result}
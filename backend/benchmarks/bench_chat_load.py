@@ -0,0 +1,105 @@
+"""
+End-to-end chat load test
+Starts the API in a uvicorn subprocess and drives /api/chat/message concurrently
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, Tuple
+
+import httpx
+
+from benchmarks.common import BACKEND_DIR, summarize
+from benchmarks.mock_servers import free_port, mock_openai_server
+
+
+def start_api(tmp: str, extra_env: Dict[str, str] = None) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}",
+        "CHROMA_PATH": os.path.join(tmp, "chroma_db"),
+    })
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("API server did not start")
+
+
+def rag_workflow_payload(user_id: str) -> Dict[str, Any]:
+    node_types = ["userQuery", "knowledgeBase", "llmEngine", "output"]
+    return {
+        "name": "Load test workflow",
+        "user_id": user_id,
+        "is_valid": True,
+        "nodes": [
+            {"node_id": f"n{i}", "node_type": t, "position_x": i * 200.0, "position_y": 0.0, "config": {}}
+            for i, t in enumerate(node_types)
+        ],
+        "edges": [
+            {"edge_id": f"e{i}", "source_node_id": f"n{i}", "target_node_id": f"n{i + 1}"}
+            for i in range(len(node_types) - 1)
+        ],
+    }
+
+
+async def _drive(base_url: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    user_id = str(uuid.uuid4())
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        workflow = await client.post("/api/workflows/", json=rag_workflow_payload(user_id))
+        workflow_id = workflow.json()["id"]
+
+        semaphore = asyncio.Semaphore(concurrency)
+        samples = []
+        errors = 0
+
+        async def one(i: int):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/api/chat/message", json={
+                    "workflow_id": workflow_id,
+                    "user_id": user_id,
+                    "message": f"Question number {i}",
+                })
+                samples.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    result = summarize(samples)
+    result["errors"] = errors
+    result["requests_per_s"] = round(requests / elapsed, 2)
+    return result
+
+
+def run(requests: int = 200, concurrency: int = 20, llm_latency_ms: float = 50.0,
+        embedding_latency_ms: float = 10.0) -> Dict[str, Any]:
+    with mock_openai_server(embedding_latency_ms=embedding_latency_ms, chat_latency_ms=llm_latency_ms), \
+            tempfile.TemporaryDirectory() as tmp:
+        process, base_url = start_api(tmp)
+        try:
+            result = asyncio.run(_drive(base_url, requests, concurrency))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    return {f"chat_message[concurrency={concurrency}]": result}
@@ -0,0 +1,52 @@
+"""
+DocumentProcessor benchmarks
+Text extraction and chunking on synthetic PDFs
+"""
+import os
+import random
+import tempfile
+from typing import Any, Dict, List
+
+import fitz  # PyMuPDF
+
+from benchmarks.common import measure
+from services.document_processor import DocumentProcessor
+
+WORDS = (
+    "workflow retrieval embedding vector query document context model answer "
+    "pipeline latency throughput index chunk overlap token prompt cache shard"
+).split()
+
+
+def synthetic_text(words: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def synthetic_pdf(path: str, pages: int, words_per_page: int = 400) -> str:
+    """Write a PDF with `pages` pages of generated text"""
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), synthetic_text(words_per_page, page_number), fontsize=9)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def run(page_counts: List[int] = (1, 10, 100), repeat: int = 5) -> Dict[str, Any]:
+    processor = DocumentProcessor()
+    results: Dict[str, Any] = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in page_counts:
+            path = synthetic_pdf(os.path.join(tmp, f"synthetic_{pages}.pdf"), pages)
+            text = processor.extract_text(path)
+            results[f"extract_text[pages={pages}]"] = measure(
+                lambda: processor.extract_text(path), repeat=repeat, items=pages
+            )
+            results[f"chunk_text[chars={len(text)}]"] = measure(
+                lambda: processor.chunk_text(text), repeat=repeat
+            )
+
+    return results
@@ -0,0 +1,52 @@
+"""
+WorkflowExecutor benchmarks
+Full RAG workflow execution against the mock OpenAI server
+"""
+import asyncio
+import tempfile
+import uuid
+from types import SimpleNamespace
+from typing import Any, Dict
+
+from benchmarks.common import measure_async
+from benchmarks.mock_servers import mock_openai_server
+from benchmarks.bench_document_processor import synthetic_text
+from services.document_processor import DocumentProcessor
+from services.vector_store import VectorStore
+from services.workflow_executor import WorkflowExecutor
+
+
+def rag_workflow() -> SimpleNamespace:
+    """In-memory stand-in for a userQuery -> knowledgeBase -> llmEngine -> output workflow"""
+    node_types = ["userQuery", "knowledgeBase", "llmEngine", "output"]
+    nodes = [
+        SimpleNamespace(node_id=f"n{i}", node_type=node_type, config={})
+        for i, node_type in enumerate(node_types)
+    ]
+    edges = [
+        SimpleNamespace(source_node_id=f"n{i}", target_node_id=f"n{i + 1}")
+        for i in range(len(nodes) - 1)
+    ]
+    return SimpleNamespace(id=uuid.uuid4(), nodes=nodes, edges=edges)
+
+
+async def _bench(repeat: int, corpus_chunks: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        executor = WorkflowExecutor(vector_store=VectorStore(path=tmp))
+
+        chunks = DocumentProcessor().chunk_text(synthetic_text(corpus_chunks * 150))[:corpus_chunks]
+        embeddings = await executor.vector_store.create_embeddings(chunks)
+        await executor.vector_store.store_embeddings("bench-doc", chunks, embeddings)
+
+        workflow = rag_workflow()
+        return await measure_async(
+            lambda: executor.execute(workflow, "How does retrieval latency affect answers?"),
+            repeat=repeat,
+        )
+
+
+def run(repeat: int = 20, corpus_chunks: int = 200, llm_latency_ms: float = 0.0,
+        embedding_latency_ms: float = 0.0) -> Dict[str, Any]:
+    with mock_openai_server(embedding_latency_ms=embedding_latency_ms, chat_latency_ms=llm_latency_ms):
+        timing = asyncio.run(_bench(repeat, corpus_chunks))
+    return {f"executor.execute[rag,chunks={corpus_chunks}]": timing}
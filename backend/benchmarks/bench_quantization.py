@@ -0,0 +1,91 @@
+"""
+Quantization benchmarks
+Recall@k, query latency and memory per vector for int8 and product quantization
+"""
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.common import summarize
+from services.quantization import QuantizedCollection
+
+ADD_BATCH = 5000
+
+
+def clustered_vectors(count: int, dim: int, seed: int, clusters: int = 64) -> np.ndarray:
+    """Unit vectors around a few topics, closer to real embeddings than pure noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    truth = []
+    for query in queries:
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        truth.append(set(np.argpartition(distances, k)[:k].tolist()))
+    return truth
+
+
+def _bench_mode(mode: str, vectors: np.ndarray, queries: np.ndarray, truth: List[set], k: int,
+                rerank_factor: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        collection = QuantizedCollection(
+            tmp, "bench", mode, train_size=min(len(vectors), 10_000), rerank_factor=rerank_factor
+        )
+        started = time.perf_counter()
+        for start in range(0, len(vectors), ADD_BATCH):
+            batch = vectors[start:start + ADD_BATCH]
+            ids = [str(start + i) for i in range(len(batch))]
+            collection.add(
+                ids=ids,
+                embeddings=batch,
+                documents=ids,
+                metadatas=[{"document_id": "bench", "chunk_index": start + i} for i in range(len(batch))]
+            )
+        build_s = time.perf_counter() - started
+
+        samples, hits = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            result = collection.query(query_embeddings=[query], n_results=k)
+            samples.append((time.perf_counter() - started) * 1000)
+            hits += len(expected & {int(i) for i in result["ids"][0]})
+
+        return {
+            "build_s": round(build_s, 3),
+            "bytes_per_vector": round(collection.memory_bytes() / len(vectors), 2),
+            "float32_bytes_per_vector": vectors.shape[1] * 4,
+            f"recall@{k}": round(hits / (k * len(queries)), 4),
+            "search": summarize(samples),
+        }
+
+
+def run(sizes: List[int] = (20_000,), dim: int = 1536, queries: int = 50, k: int = 10,
+        rerank_factor: int = 10) -> Dict[str, Any]:
+    """Compare quantized search against exact brute force on the same vectors"""
+    results: Dict[str, Any] = {}
+    for size in sizes:
+        # Queries come from the same distribution but are not in the index
+        data = clustered_vectors(size + queries, dim, seed=size)
+        vectors, query_vectors = data[:size], data[size:]
+        truth = exact_top_k(vectors, query_vectors, k)
+
+        exact_samples = []
+        for query in query_vectors:
+            started = time.perf_counter()
+            np.argpartition(((vectors - query) ** 2).sum(axis=1), k)[:k]
+            exact_samples.append((time.perf_counter() - started) * 1000)
+        results[f"quantization[exact,n={size},dim={dim}]"] = {
+            "bytes_per_vector": dim * 4,
+            f"recall@{k}": 1.0,
+            "search": summarize(exact_samples),
+        }
+        for mode in ("int8", "pq"):
+            results[f"quantization[{mode},n={size},dim={dim}]"] = _bench_mode(
+                mode, vectors, query_vectors, truth, k, rerank_factor
+            )
+    return results
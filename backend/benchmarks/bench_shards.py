@@ -0,0 +1,66 @@
+"""
+Sharded vector store benchmarks
+Scatter-gather search latency over shard server processes, and with one shard stalled
+"""
+import asyncio
+import os
+import signal
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks.bench_vector_store import ADD_BATCH, random_vectors
+from benchmarks.common import measure_async, summarize
+from benchmarks.mock_servers import free_port
+from services.vector_shards import ShardedVectorStore, start_shard_servers, wait_for_shards
+
+
+async def _search_samples(store: ShardedVectorStore, query_vectors: List[List[float]]) -> List[float]:
+    samples = []
+    for vector in query_vectors:
+        timing = await measure_async(lambda: store.search_by_embedding(vector, n_results=5), repeat=1, warmup=0)
+        samples.append(timing["mean_ms"])
+    return samples
+
+
+async def _bench_shards(spec: str, size: int, dim: int, queries: int, deadline_ms: float, processes) -> Dict[str, Any]:
+    store = ShardedVectorStore.from_config(spec, deadline_ms=deadline_ms)
+    vectors = random_vectors(size, dim, seed=size)
+    for start in range(0, size, ADD_BATCH):
+        batch = vectors[start:start + ADD_BATCH]
+        # One document per 100 chunks, spread over the shards by document id
+        for offset in range(0, len(batch), 100):
+            chunk = batch[offset:offset + 100]
+            texts = [f"chunk {start + offset + i}" for i in range(len(chunk))]
+            await store.store_embeddings(f"doc-{start + offset}", texts, chunk.tolist())
+
+    query_vectors = random_vectors(queries, dim, seed=size + 1).tolist()
+    result = {"search": summarize(await _search_samples(store, query_vectors))}
+
+    if len(processes) > 1 and hasattr(signal, "SIGSTOP"):
+        # A frozen shard process: searches should return partial results at the deadline
+        os.kill(processes[0].pid, signal.SIGSTOP)
+        try:
+            stalled = await _search_samples(store, query_vectors[:20])
+        finally:
+            os.kill(processes[0].pid, signal.SIGCONT)
+        result["search_one_shard_stalled"] = summarize(stalled)
+        result["partial_searches"] = store.partial_searches
+    return result
+
+
+def run(sizes: List[int] = (10_000,), dim: int = 384, shard_counts: List[int] = (1, 2, 4), queries: int = 100, deadline_ms: float = 250) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for size in sizes:
+        for count in shard_counts:
+            with tempfile.TemporaryDirectory() as tmp:
+                processes, spec = start_shard_servers(count, tmp, free_port())
+                try:
+                    wait_for_shards(spec)
+                    results[f"vector_shards[n={size},dim={dim},shards={count}]"] = asyncio.run(
+                        _bench_shards(spec, size, dim, queries, deadline_ms, processes)
+                    )
+                finally:
+                    for process in processes:
+                        process.terminate()
+                        process.wait()
+    return results
@@ -0,0 +1,94 @@
+"""
+SQLite concurrency benchmarks
+Concurrent chat writes and history reads under the default and the production SQLite profile
+"""
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import summarize
+from database import Base, ChatHistory, Workflow, create_db_engine
+from services.chat_recorder import ChatRecorder
+from services.db_writer import WriteQueue
+
+
+async def _workload(profile: str, directory: str, writers: int, readers: int, duration_s: float) -> Dict[str, Any]:
+    engine = create_db_engine(f"sqlite:///{os.path.join(directory, profile + '.sqlite')}", sqlite_profile=profile)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = factory()
+    workflow = Workflow(user_id=uuid.uuid4(), name="bench")
+    db.add(workflow)
+    db.commit()
+    workflow_id = workflow.id
+    db.close()
+
+    # Rows are written through on the request path (CHAT_WRITE_BEHIND=false), the case
+    # where concurrent requests contend for the database lock
+    writer = WriteQueue(enabled=profile == "production", session_factory=factory)
+    writer.start()
+    recorder = ChatRecorder(session_factory=factory, writer=writer)
+    write_ms: List[float] = []
+    read_ms: List[float] = []
+    errors = {"write": 0, "read": 0}
+    deadline = time.perf_counter() + duration_s
+
+    async def write_loop():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await recorder.record_message(workflow_id=workflow_id, user_id=workflow.user_id, message="x" * 200, role="user")
+                write_ms.append((time.perf_counter() - started) * 1000)
+            except OperationalError:
+                errors["write"] += 1
+
+    def read_history():
+        session = factory()
+        try:
+            session.query(ChatHistory).filter(ChatHistory.workflow_id == workflow_id) \
+                .order_by(ChatHistory.created_at.desc()).limit(50).all()
+        finally:
+            session.close()
+
+    async def read_loop():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(read_history)
+                read_ms.append((time.perf_counter() - started) * 1000)
+            except OperationalError:
+                errors["read"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[write_loop() for _ in range(writers)], *[read_loop() for _ in range(readers)])
+    elapsed = time.perf_counter() - started
+    await writer.stop()
+    engine.dispose()
+
+    writes, reads = summarize(write_ms), summarize(read_ms)
+    return {
+        "writes_per_s": round(len(write_ms) / elapsed, 1),
+        "reads_per_s": round(len(read_ms) / elapsed, 1),
+        "write_p50_ms": writes["p50_ms"],
+        "write_p99_ms": writes["p99_ms"],
+        "read_p50_ms": reads["p50_ms"],
+        "read_p99_ms": reads["p99_ms"],
+        "write_errors": errors["write"],
+        "read_errors": errors["read"],
+        "transactions": writer.transactions if writer.enabled else len(write_ms),
+    }
+
+
+def run(concurrency: int = 20, readers: int = 4, duration_s: float = 5.0) -> Dict[str, Any]:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ("default", "production"):
+            stats = asyncio.run(_workload(profile, directory, concurrency, readers, duration_s))
+            results[f"sqlite_{profile}_w{concurrency}_r{readers}"] = stats
+    return results
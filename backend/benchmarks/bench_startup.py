@@ -0,0 +1,49 @@
+"""
+Startup time benchmark
+Cold import of the app and lifespan startup, each in a fresh interpreter
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict
+
+from benchmarks.common import BACKEND_DIR, summarize
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import main
+print((time.perf_counter() - started) * 1000)
+"""
+
+LIFESPAN_SCRIPT = """
+import time
+started = time.perf_counter()
+from fastapi.testclient import TestClient
+import main
+with TestClient(main.app) as client:
+    client.get("/health")
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def _time_script(script: str, env: Dict[str, str]) -> float:
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=BACKEND_DIR, env=env, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def run(repeat: int = 5) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'startup.sqlite')}",
+            "CHROMA_PATH": os.path.join(tmp, "chroma_db"),
+        })
+        results["startup.import_main"] = summarize([_time_script(IMPORT_SCRIPT, env) for _ in range(repeat)])
+        results["startup.lifespan"] = summarize([_time_script(LIFESPAN_SCRIPT, env) for _ in range(repeat)])
+
+        env["PRELOAD_SERVICES"] = "true"
+        results["startup.lifespan_preload"] = summarize([_time_script(LIFESPAN_SCRIPT, env) for _ in range(repeat)])
+    return results
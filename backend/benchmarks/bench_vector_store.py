@@ -0,0 +1,66 @@
+"""
+VectorStore benchmarks
+Bulk add and search latency at increasing collection sizes
+"""
+import asyncio
+import tempfile
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.common import measure_async, summarize
+from services.vector_store import VectorStore
+
+# Chroma rejects very large single add() calls
+ADD_BATCH = 5000
+
+
+def random_vectors(count: int, dim: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+async def _bench_size(size: int, dim: int, queries: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        store = VectorStore(path=tmp)
+        vectors = random_vectors(size, dim, seed=size)
+
+        add_samples = []
+        for start in range(0, size, ADD_BATCH):
+            batch = vectors[start:start + ADD_BATCH]
+            texts = [f"chunk {start + i}" for i in range(len(batch))]
+            timing = await measure_async(
+                lambda: store.store_embeddings(f"doc-{start}", texts, batch.tolist()),
+                repeat=1,
+                warmup=0,
+                items=len(batch),
+            )
+            add_samples.append(timing["mean_ms"])
+
+        query_vectors = random_vectors(queries, dim, seed=size + 1).tolist()
+        search_samples = []
+        for vector in query_vectors:
+            timing = await measure_async(
+                lambda: _query(store, vector),
+                repeat=1,
+                warmup=0,
+            )
+            search_samples.append(timing["mean_ms"])
+
+        return {
+            "add": summarize(add_samples, items=ADD_BATCH),
+            "search": summarize(search_samples),
+        }
+
+
+async def _query(store: VectorStore, vector: List[float]):
+    store.collection.query(query_embeddings=[vector], n_results=5)
+
+
+def run(sizes: List[int] = (10_000,), dim: int = 1536, queries: int = 100) -> Dict[str, Any]:
+    """Sizes up to 1M are supported but need several GB of RAM and disk"""
+    results: Dict[str, Any] = {}
+    for size in sizes:
+        results[f"vector_store[n={size},dim={dim}]"] = asyncio.run(_bench_size(size, dim, queries))
+    return results
@@ -0,0 +1,94 @@
+"""
+Shared helpers for benchmarks
+Timing statistics and JSON result files
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples_ms: List[float], items: int = 1) -> Dict[str, float]:
+    """Latency statistics (milliseconds) and throughput for a list of samples"""
+    total_s = sum(samples_ms) / 1000
+    return {
+        "runs": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 4) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 4),
+        "p99_ms": round(percentile(samples_ms, 99), 4),
+        "min_ms": round(min(samples_ms), 4) if samples_ms else 0.0,
+        "max_ms": round(max(samples_ms), 4) if samples_ms else 0.0,
+        "items_per_s": round(items * len(samples_ms) / total_s, 2) if total_s else 0.0,
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1, items: int = 1) -> Dict[str, float]:
+    """Time a synchronous callable"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples, items)
+
+
+async def measure_async(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1, items: int = 1) -> Dict[str, float]:
+    """Time an async callable"""
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples, items)
+
+
+def git_commit() -> Optional[str]:
+    """Short hash of the checked out commit, if available"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def write_results(results: Dict[str, Any], output: Optional[str] = None) -> str:
+    """Write benchmark results as JSON and return the file path"""
+    commit = git_commit()
+    payload = {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{commit or 'nogit'}.json")
+    with open(output, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    return output
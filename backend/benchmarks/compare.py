@@ -0,0 +1,50 @@
+"""
+Compare two benchmark result files
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+from typing import Any, Dict, Iterator, Tuple
+
+# Metrics where a higher value is an improvement
+HIGHER_IS_BETTER = {"items_per_s", "requests_per_s", "recall"}
+TRACKED = ("p50_ms", "p99_ms", "mean_ms", "items_per_s", "requests_per_s", "recall")
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, name)
+        elif key in TRACKED and isinstance(value, (int, float)):
+            yield name, float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = dict(flatten(json.load(f)["results"]))
+    with open(args.after) as f:
+        after = dict(flatten(json.load(f)["results"]))
+
+    regressions = 0
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        marker = "❌" if worse > args.threshold else ("✅" if worse < -args.threshold else "  ")
+        regressions += worse > args.threshold
+        print(f"{marker} {name}: {old:.3f} -> {new:.3f} ({change:+.1f}%)")
+
+    if regressions:
+        raise SystemExit(f"{regressions} metric(s) regressed by more than {args.threshold}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Mock OpenAI-compatible server for benchmarks
+Serves deterministic embeddings and chat completions with configurable latency
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+EMBEDDING_DIM = 1536
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Deterministic pseudo-embedding derived from the text hash"""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    values = []
+    counter = 0
+    while len(values) < dim:
+        block = hashlib.sha256(seed + counter.to_bytes(4, "little")).digest()
+        values.extend((b - 127.5) / 127.5 for b in block)
+        counter += 1
+    return values[:dim]
+
+
+def create_mock_app(embedding_latency_ms: float = 0.0, chat_latency_ms: float = 0.0) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request) -> Dict:
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        if embedding_latency_ms:
+            await asyncio.sleep(embedding_latency_ms / 1000)
+        return {
+            "object": "list",
+            "model": body.get("model", "text-embedding-ada-002"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> Dict:
+        body = await request.json()
+        if chat_latency_ms:
+            await asyncio.sleep(chat_latency_ms / 1000)
+        prompt = body["messages"][-1]["content"]
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"Mock answer to: {prompt[:80]}"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+        }
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def mock_openai_server(embedding_latency_ms: float = 0.0, chat_latency_ms: float = 0.0) -> Iterator[str]:
+    """Run the mock server in a background thread and point the OpenAI client at it"""
+    port = free_port()
+    config = uvicorn.Config(
+        create_mock_app(embedding_latency_ms, chat_latency_ms),
+        host="127.0.0.1",
+        port=port,
+        log_level="warning",
+    )
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    base_url = f"http://127.0.0.1:{port}/v1"
+    previous = {key: os.environ.get(key) for key in ("OPENAI_BASE_URL", "OPENAI_API_KEY")}
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "mock-key"
+    try:
+        yield base_url
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        server.should_exit = True
+        thread.join(timeout=5)
@@ -0,0 +1,92 @@
+"""
+Benchmark runner
+Run one or more suites and store the results as JSON
+
+    python -m benchmarks.run --suite all
+    python -m benchmarks.run --suite vector --sizes 10000 100000 1000000
+    python -m benchmarks.run --suite quantization --sizes 100000 --rerank-factor 20
+    python -m benchmarks.run --suite sqlite --concurrency 50 --duration 10
+    python -m benchmarks.run --suite shards --sizes 100000 --dim 384 --shards 1 2 4 --deadline-ms 250
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import write_results
+
+SUITES = ["startup", "document", "vector", "quantization", "executor", "chat", "batch", "sqlite", "shards"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run backend benchmarks")
+    parser.add_argument("--suite", choices=SUITES + ["all"], nargs="+", default=["all"])
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000], help="Vector counts for the vector suite")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--rerank-factor", type=int, default=10, help="Candidates re-scored per result (quantization suite)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=10.0)
+    parser.add_argument("--readers", type=int, default=4, help="Concurrent history readers (sqlite suite)")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per profile (sqlite suite)")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4], help="Shard counts (shards suite)")
+    parser.add_argument("--deadline-ms", type=float, default=250.0, help="Per-search shard deadline (shards suite)")
+    args = parser.parse_args(argv)
+
+    suites = SUITES if "all" in args.suite else args.suite
+    results = {}
+
+    if "startup" in suites:
+        from benchmarks import bench_startup
+        results.update(bench_startup.run(repeat=args.repeat))
+    if "document" in suites:
+        from benchmarks import bench_document_processor
+        results.update(bench_document_processor.run(args.pages, repeat=args.repeat))
+    if "vector" in suites:
+        from benchmarks import bench_vector_store
+        results.update(bench_vector_store.run(args.sizes, dim=args.dim))
+    if "quantization" in suites:
+        from benchmarks import bench_quantization
+        results.update(bench_quantization.run(args.sizes, dim=args.dim, rerank_factor=args.rerank_factor))
+    if "executor" in suites:
+        from benchmarks import bench_executor
+        results.update(bench_executor.run(
+            repeat=args.repeat * 4,
+            llm_latency_ms=args.llm_latency_ms,
+            embedding_latency_ms=args.embedding_latency_ms,
+        ))
+    if "chat" in suites:
+        from benchmarks import bench_chat_load
+        results.update(bench_chat_load.run(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            llm_latency_ms=args.llm_latency_ms,
+            embedding_latency_ms=args.embedding_latency_ms,
+        ))
+    if "batch" in suites:
+        from benchmarks import bench_batch_eval
+        results.update(bench_batch_eval.run(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            llm_latency_ms=args.llm_latency_ms,
+            embedding_latency_ms=args.embedding_latency_ms,
+        ))
+    if "sqlite" in suites:
+        from benchmarks import bench_sqlite
+        results.update(bench_sqlite.run(concurrency=args.concurrency, readers=args.readers, duration_s=args.duration))
+    if "shards" in suites:
+        from benchmarks import bench_shards
+        results.update(bench_shards.run(args.sizes, dim=args.dim, shard_counts=args.shards, deadline_ms=args.deadline_ms))
+
+    for name, stats in results.items():
+        print(f"{name}: {stats}")
+    print(f"📊 Results written to {write_results(results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Command line maintenance tools
+Run from the backend directory: python cli.py reindex --help
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_db
+from services import registry
+from services.batch_eval import parse_queries
+from services.chat_session import open_session_workflow
+from services.workflow_analyzer import stored_plan_steps
+from services.vector_shards import start_shard_servers, wait_for_shards
+
+
+def print_json(data):
+    print(json.dumps(data, indent=2, default=str))
+
+
+async def run_reindex(version_id: int, progress_s: float):
+    reindexer = registry.get_reindexer()
+    task = asyncio.create_task(reindexer.run(version_id))
+    while not task.done():
+        await asyncio.wait({task}, timeout=progress_s)
+        summary = await asyncio.to_thread(reindexer.get_version, version_id)
+        counts = summary["documents"]
+        print(f"ℹ️  v{version_id} {summary['status']}: {counts['done']} done, {counts['pending']} pending, {counts['failed']} failed")
+    print_json(task.result())
+
+
+async def run_evaluation(workflow_id: str, queries_path: str, concurrency: int, output_path: str):
+    with open(queries_path, encoding="utf-8") as f:
+        queries = parse_queries(f)
+    workflow = await asyncio.to_thread(open_session_workflow, uuid.UUID(workflow_id))
+    if workflow is None:
+        raise ValueError(f"Workflow {workflow_id} not found")
+    if not workflow.is_valid:
+        raise ValueError(f"Workflow {workflow_id} is not valid")
+    output = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    try:
+        async for record in registry.get_batch_evaluator().run(workflow, stored_plan_steps(workflow), queries, concurrency):
+            output.write(json.dumps(record, default=str) + "\n")
+            if output_path and record.get("summary"):
+                print_json(record)
+    finally:
+        if output_path:
+            output.close()
+
+
+def serve_shards(count: int, path: str, base_port: int, host: str):
+    """Run local vector shard processes until interrupted"""
+    processes, spec = start_shard_servers(count, path, base_port, host)
+    try:
+        wait_for_shards(spec)
+        print(f"✅ {count} vector shards running, start the API with:")
+        print(f"VECTOR_SHARDS={spec}")
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        print("⚠️  A shard process exited")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backend maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    reindex = commands.add_parser("reindex", help="Blue/green rebuild of the vector index")
+    actions = reindex.add_subparsers(dest="action", required=True)
+    start = actions.add_parser("start", help="Create a new index version and build it")
+    start.add_argument("--chunk-size", type=int)
+    start.add_argument("--chunk-overlap", type=int)
+    resume = actions.add_parser("resume", help="Resume a paused or interrupted build")
+    resume.add_argument("version_id", type=int)
+    status = actions.add_parser("status", help="Show index versions")
+    status.add_argument("version_id", type=int, nargs="?")
+    for action in (start, resume):
+        action.add_argument("--concurrency", type=int, help="Documents processed at once (REINDEX_CONCURRENCY)")
+        action.add_argument("--max-docs-per-s", type=float, help="Throughput cap, 0 for none (REINDEX_MAX_DOCS_PER_S)")
+        action.add_argument("--progress-s", type=float, default=10.0, help="Seconds between progress lines")
+
+    evaluate = commands.add_parser("evaluate", help="Run a file of test queries through a workflow (nothing saved to chat history)")
+    evaluate.add_argument("workflow_id")
+    evaluate.add_argument("queries", help="One query per line, plain text or JSON with a \"query\" field")
+    evaluate.add_argument("--concurrency", type=int, help="Queries executed at once (EVAL_CONCURRENCY)")
+    evaluate.add_argument("--output", help="JSONL result file (default: stdout)")
+
+    shards = commands.add_parser("shards", help="Local vector shard processes")
+    shard_actions = shards.add_subparsers(dest="action", required=True)
+    serve = shard_actions.add_parser("serve", help="Run one Chroma server per shard on this host")
+    serve.add_argument("--count", type=int, default=2)
+    serve.add_argument("--path", default="./chroma_shards", help="Shard i stores its data in <path>/<i>")
+    serve.add_argument("--base-port", type=int, default=8101, help="Shard i listens on base port + i")
+    serve.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    if args.command == "shards":
+        serve_shards(args.count, args.path, args.base_port, args.host)
+        return
+
+    init_db()
+    if args.command == "evaluate":
+        try:
+            asyncio.run(run_evaluation(args.workflow_id, args.queries, args.concurrency, args.output))
+        except ValueError as e:
+            print(f"⚠️  {e}")
+            sys.exit(1)
+        return
+
+    reindexer = registry.get_reindexer()
+    try:
+        if args.action == "status":
+            print_json(reindexer.get_version(args.version_id) if args.version_id else reindexer.list_versions())
+            return
+        if args.concurrency:
+            reindexer.concurrency = args.concurrency
+        if args.max_docs_per_s is not None:
+            reindexer.max_docs_per_s = args.max_docs_per_s
+        version_id = reindexer.create_version(args.chunk_size, args.chunk_overlap)["id"] if args.action == "start" else args.version_id
+        asyncio.run(run_reindex(version_id, args.progress_s))
+    except ValueError as e:
+        print(f"⚠️  {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
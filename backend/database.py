@@ -2,7 +2,7 @@
 Database configuration and models
 PostgreSQL connection using SQLAlchemy
 """
-from sqlalchemy import create_engine, Column, String, Integer, Float, Boolean, Text, DateTime, JSON, ForeignKey
+from sqlalchemy import create_engine, event, Column, String, Integer, Float, Boolean, Text, DateTime, JSON, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.types import TypeDecorator, CHAR
@@ -19,15 +19,49 @@ if not DATABASE_URL:
     DATABASE_URL = "sqlite:///./workflow_db.sqlite"
     print("ℹ️  No DATABASE_URL found, using SQLite: ./workflow_db.sqlite")
 
-# Create engine with appropriate settings
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False},
+# "production" turns on WAL journaling, tuned pragmas and a pooled set of read connections
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default")
+SQLITE_PRODUCTION = DATABASE_URL.startswith("sqlite") and SQLITE_PROFILE == "production"
+
+def _sqlite_pragmas() -> list:
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",  # durable across application crashes; fsync at checkpoints
+        f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE_MB', '256')) * 1024 * 1024}",
+        f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_SIZE_MB', '64')) * 1024}",  # negative: KiB
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+def create_db_engine(url: str, sqlite_profile: str = None):
+    """Engine for `url`; SQLite URLs honour SQLITE_PROFILE (or `sqlite_profile`)"""
+    if not url.startswith("sqlite"):
+        return create_engine(url, echo=False)
+    if (sqlite_profile or SQLITE_PROFILE) != "production":
+        return create_engine(url, connect_args={"check_same_thread": False}, echo=False)
+    
+    sqlite_engine = create_engine(
+        url,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")) / 1000
+        },
+        pool_size=int(os.getenv("SQLITE_POOL_SIZE", "8")),
+        max_overflow=int(os.getenv("SQLITE_POOL_OVERFLOW", "8")),
         echo=False
     )
-else:
-    engine = create_engine(DATABASE_URL, echo=False)
+    pragmas = _sqlite_pragmas()
+    
+    @event.listens_for(sqlite_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    
+    return sqlite_engine
+
+# Create engine with appropriate settings
+engine = create_db_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -35,7 +69,7 @@ Base = declarative_base()
 def get_engine_info() -> str:
     """Get database engine information"""
     if DATABASE_URL.startswith("sqlite"):
-        return f"SQLite (local file)"
+        return "SQLite (local file, WAL)" if SQLITE_PRODUCTION else "SQLite (local file)"
     elif DATABASE_URL.startswith("postgresql"):
         return f"PostgreSQL"
     else:
@@ -90,6 +124,7 @@ class Workflow(Base):
     edges = relationship("WorkflowEdge", back_populates="workflow", cascade="all, delete-orphan")
     documents = relationship("Document", back_populates="workflow")
     chat_history = relationship("ChatHistory", back_populates="workflow")
+    plan = relationship("WorkflowPlan", back_populates="workflow", uselist=False, cascade="all, delete-orphan")
 
 class WorkflowNode(Base):
     __tablename__ = "workflow_nodes"
@@ -117,6 +152,21 @@ class WorkflowEdge(Base):
     
     workflow = relationship("Workflow", back_populates="edges")
 
+class WorkflowPlan(Base):
+    """Server-side analysis result and compiled execution plan of a workflow"""
+    __tablename__ = "workflow_plans"
+    
+    workflow_id = Column(GUID(), ForeignKey("workflows.id", ondelete="CASCADE"), primary_key=True)
+    digest = Column(String(64), nullable=False)
+    analyzer_version = Column(Integer, nullable=False)
+    is_valid = Column(Boolean, default=False)
+    errors = Column(JSON, default=[])
+    warnings = Column(JSON, default=[])
+    steps = Column(JSON, default=[])  # ordered [{node_id, node_type, config}]
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    workflow = relationship("Workflow", back_populates="plan")
+
 class Document(Base):
     __tablename__ = "documents"
     
@@ -133,6 +183,22 @@ class Document(Base):
     
     workflow = relationship("Workflow", back_populates="documents")
 
+class IngestionJob(Base):
+    """Aggregate progress of a batch upload being extracted and embedded"""
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(GUID(), primary_key=True, default=uuid.uuid4)
+    workflow_id = Column(GUID(), ForeignKey("workflows.id", ondelete="CASCADE"))
+    user_id = Column(GUID())
+    status = Column(String, nullable=False, default="queued")  # queued, running, completed, failed
+    total_documents = Column(Integer, default=0)
+    processed_documents = Column(Integer, default=0)
+    failed_documents = Column(Integer, default=0)
+    chunks = Column(Integer, default=0)
+    errors = Column(JSON, default=[])  # first failures, [{document_id, filename, error}]
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
 class ChatHistory(Base):
     __tablename__ = "chat_history"
     
@@ -144,6 +210,76 @@ class ChatHistory(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     workflow = relationship("Workflow", back_populates="chat_history")
+    trace = relationship("ChatTrace", back_populates="chat_message", uselist=False, cascade="all, delete-orphan")
+
+class ChatTrace(Base):
+    __tablename__ = "chat_traces"
+    
+    id = Column(GUID(), primary_key=True, default=uuid.uuid4)
+    chat_history_id = Column(GUID(), ForeignKey("chat_history.id", ondelete="CASCADE"), unique=True, index=True)
+    workflow_id = Column(GUID(), ForeignKey("workflows.id", ondelete="CASCADE"))
+    duration_ms = Column(Float)
+    spans = Column(JSON, default=[])  # compact rows, see services.tracing.SPAN_FIELDS
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    chat_message = relationship("ChatHistory", back_populates="trace")
+
+class IndexVersion(Base):
+    """A generation of the vector index, built side by side and switched to atomically"""
+    __tablename__ = "index_versions"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    collection_name = Column(String, nullable=False, unique=True)
+    status = Column(String, nullable=False, default="building", index=True)  # building, paused, active, retired
+    chunk_size = Column(Integer)
+    chunk_overlap = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    activated_at = Column(DateTime)
+    finished_at = Column(DateTime)  # set once the previous version has been dropped
+    
+    checkpoints = relationship("IndexCheckpoint", back_populates="version", cascade="all, delete-orphan")
+
+class IndexCheckpoint(Base):
+    """Per-document progress of an index version build"""
+    __tablename__ = "index_checkpoints"
+    
+    version_id = Column(Integer, ForeignKey("index_versions.id", ondelete="CASCADE"), primary_key=True)
+    document_id = Column(GUID(), ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, done, failed
+    chunks = Column(Integer, default=0)
+    error = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    version = relationship("IndexVersion", back_populates="checkpoints")
+
+# Search runs over the whole index, so every change to it is one change of the corpus
+CORPUS_SCOPE = "documents"
+
+class CorpusVersion(Base):
+    """Counter bumped with every change of the searchable chunks; keys cached retrievals"""
+    __tablename__ = "corpus_versions"
+    
+    scope = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+_tables_created = False
+
+def init_db():
+    """Create missing tables. Runs from the app lifespan (or `python database.py`), never at import"""
+    global _tables_created
+    if _tables_created:
+        return
+    Base.metadata.create_all(bind=engine)
+    # Created up front so concurrent first bumps only ever update the row
+    db = SessionLocal()
+    try:
+        if db.get(CorpusVersion, CORPUS_SCOPE) is None:
+            db.add(CorpusVersion(scope=CORPUS_SCOPE, version=0))
+            db.commit()
+    finally:
+        db.close()
+    _tables_created = True
 
 def get_db():
     db = SessionLocal()
@@ -151,3 +287,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+if __name__ == "__main__":
+    init_db()
+    print(f"✅ Database tables created: {get_engine_info()}")
@@ -2,35 +2,113 @@
 FastAPI Backend for No-Code Workflow Builder
 Main application entry point
 """
+from contextlib import asynccontextmanager
+import asyncio
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import uvicorn
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-from routers import workflows, documents, chat, llm
-from database import engine, Base, get_engine_info
+from routers import workflows, documents, chat, llm, admin
+from database import init_db, get_engine_info
+from middleware import CompressionMiddleware, LoadSheddingMiddleware, ProfilingMiddleware, parse_route_prefixes
+from services import registry
+from services.embeddings import shutdown_process_pool
+from services.garbage_collector import run_periodically as run_orphan_gc
 
-# Create database tables with error handling
-try:
-    Base.metadata.create_all(bind=engine)
-    print(f"✅ Database connected successfully: {get_engine_info()}")
-except Exception as e:
-    print(f"⚠️  Database connection issue: {e}")
-    print("Backend will continue but database operations may fail")
+def env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables with error handling (disable with AUTO_CREATE_TABLES=false
+    # and run `python database.py` as a release step instead)
+    if env_flag("AUTO_CREATE_TABLES", "true"):
+        try:
+            await run_in_threadpool(init_db)
+            print(f"✅ Database connected successfully: {get_engine_info()}")
+        except Exception as e:
+            print(f"⚠️  Database connection issue: {e}")
+            print("Backend will continue but database operations may fail")
+    
+    # The embedded Chroma store must only be opened by a single process
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and os.getenv("VECTOR_STORE_MODE", "embedded") == "embedded":
+        print(f"⚠️  {workers} workers share the embedded vector store; set VECTOR_STORE_MODE=server")
+    
+    # Services are built on first use unless preloading is requested
+    if env_flag("PRELOAD_SERVICES"):
+        await run_in_threadpool(registry.preload)
+    
+    # Warm the busiest workflows in the background; /ready answers 503 until it is done
+    warmup_task = asyncio.create_task(registry.get_warmup().run(registry.get_workflow_executor))
+    
+    # Event-loop lag drives load shedding (and blocking call site reports in debug mode)
+    loop_monitor = registry.get_loop_monitor()
+    loop_monitor.start()
+    
+    # Serialized group-commit writer (on by default with SQLITE_PROFILE=production)
+    write_queue = registry.get_write_queue()
+    write_queue.start()
+    
+    # Chat rows are written behind the request path unless disabled
+    recorder = registry.get_chat_recorder()
+    if env_flag("CHAT_WRITE_BEHIND", "true"):
+        await recorder.start()
+    
+    # Periodic orphan cleanup of the vector index and uploads (0 disables it)
+    gc_interval = float(os.getenv("GC_INTERVAL_SECONDS", "21600"))
+    gc_task = None
+    if gc_interval > 0:
+        gc_task = asyncio.create_task(run_orphan_gc(registry.get_orphan_collector, gc_interval))
+    
+    yield
+    
+    if gc_task is not None:
+        gc_task.cancel()
+    warmup_task.cancel()
+    if registry.created("batch_ingestor"):
+        await registry.get_batch_ingestor().stop()
+    if registry.created("reindexer"):
+        # Running builds are paused and resume from their checkpoints
+        await registry.get_reindexer().stop()
+    await recorder.stop()
+    await write_queue.stop()
+    await loop_monitor.stop()
+    registry.reset()
+    shutdown_process_pool()
 
 app = FastAPI(
     title="Workflow Builder API",
     description="Backend API for AI-powered workflow builder",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# Configure CORS
+# Admins can profile a single request with `X-Profile: cpu|alloc` (innermost middleware)
+app.add_middleware(ProfilingMiddleware, get_profiler=registry.get_profiler, authorize=admin.admin_token_matches)
+
+# Shed ingestion, list endpoints and batch evaluations first when the event loop falls behind or too many
+# LLM calls are in flight; chat is never shed
+app.add_middleware(
+    LoadSheddingMiddleware,
+    get_monitor=registry.get_loop_monitor,
+    routes=parse_route_prefixes(os.getenv(
+        "LOAD_SHED_ROUTES",
+        "POST /api/documents/,GET /api/documents/workflow/,GET /api/workflows/user/,GET /api/chat/history/,POST /api/chat/batch/"
+    )),
+    retry_after_s=int(os.getenv("LOAD_SHED_RETRY_AFTER_S", "5"))
+)
+
+# Configure CORS (outside load shedding, so 503 answers carry CORS headers too)
 allowed_origins = os.getenv("CORS_ORIGINS", "http://localhost:8080,http://localhost:5173").split(",")
 app.add_middleware(
     CORSMiddleware,
@@ -40,11 +118,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (workflow graphs, chat histories); 0 disables it
+compression_min_bytes = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+if compression_min_bytes > 0:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=compression_min_bytes,
+        gzip_level=int(os.getenv("GZIP_LEVEL", "6")),
+        brotli_quality=int(os.getenv("BROTLI_QUALITY", "4"))
+    )
+
 # Include routers
 app.include_router(workflows.router, prefix="/api/workflows", tags=["workflows"])
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(llm.router, prefix="/api/llm", tags=["llm"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 @app.get("/")
 async def root():
@@ -58,5 +147,12 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Whether this worker has warmed up; route traffic to it only after a 200"""
+    warmup = registry.get_warmup()
+    return ORJSONResponse(warmup.stats(), status_code=200 if warmup.ready else 503)
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
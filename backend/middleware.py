@@ -0,0 +1,206 @@
+"""
+HTTP middleware
+Response compression negotiated from Accept-Encoding (brotli when installed, else gzip),
+load shedding of low-priority routes while the process is overloaded, request profiling
+"""
+import gzip
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional, `pip install brotli`
+    brotli = None
+
+# Bodies that are already compressed or must reach the client unbuffered
+SKIPPED_CONTENT_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip", "text/event-stream")
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[name.strip()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+            self.compress = self._compressor.process
+            self.flush = self._compressor.flush
+            self.finish = self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.compress = self._compressor.compress
+            self.flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self._compressor.flush
+
+
+class CompressionMiddleware:
+    """Compress response bodies of at least `minimum_size` bytes
+
+    Single-message bodies are compressed in one go with an exact Content-Length;
+    streamed bodies are compressed chunk by chunk and flushed after each chunk.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or content_type.startswith(SKIPPED_CONTENT_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers and not headers["etag"].startswith("W/"):
+                    # The compressed representation is not byte-identical any more
+                    headers["ETag"] = "W/" + headers["etag"]
+                if not more_body:
+                    if encoding == "br":
+                        body = brotli.compress(body, quality=self.brotli_quality)
+                    else:
+                        body = gzip.compress(body, self.gzip_level)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                await send(start)
+
+            if more_body:
+                chunk = compressor.compress(body) + compressor.flush()
+            else:
+                chunk = compressor.compress(body) + compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def parse_route_prefixes(value: str) -> List[Tuple[str, str]]:
+    """"POST /api/documents/,GET /api/chat/history/" -> [(method, path prefix)]"""
+    routes = []
+    for item in value.split(","):
+        if item.strip():
+            method, _, prefix = item.strip().partition(" ")
+            routes.append((method.upper(), prefix.strip()))
+    return routes
+
+
+class LoadSheddingMiddleware:
+    """Answer low-priority routes with 503 + Retry-After while the monitor reports overload
+
+    Everything not listed in `routes` (chat above all) is always served, so interactive
+    latency does not compete with ingestion and list pages when the loop falls behind.
+    """
+
+    def __init__(self, app: ASGIApp, get_monitor: Callable, routes: List[Tuple[str, str]], retry_after_s: int = 5):
+        self.app = app
+        self.get_monitor = get_monitor
+        self.routes = routes
+        self.retry_after_s = retry_after_s
+
+    def _low_priority(self, scope: Scope) -> bool:
+        method, path = scope["method"], scope["path"]
+        return any(method == m and path.startswith(prefix) for m, prefix in self.routes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and self._low_priority(scope):
+            monitor = self.get_monitor()
+            reason = monitor.overload_reason() if monitor.running else None
+            if reason is not None:
+                monitor.shed += 1
+                response = JSONResponse(
+                    {"detail": f"Server busy ({reason}), retry later"},
+                    status_code=503,
+                    headers={"Retry-After": str(self.retry_after_s)}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class ProfilingMiddleware:
+    """Profile one request when it carries `X-Profile: cpu`, `alloc` or `cpu,alloc`
+
+    Only honoured together with a valid admin token (`authorize`); the response gets an
+    `X-Profile-Id` header naming the record kept by the profiler.
+    """
+
+    def __init__(self, app: ASGIApp, get_profiler: Callable, authorize: Callable[[Optional[str]], bool]):
+        self.app = app
+        self.get_profiler = get_profiler
+        self.authorize = authorize
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        requested = headers.get("x-profile")
+        modes = [m.strip() for m in (requested or "").lower().split(",") if m.strip() in ("cpu", "alloc")]
+        if not modes or not self.authorize(headers.get("x-admin-token")):
+            await self.app(scope, receive, send)
+            return
+
+        async with self.get_profiler().profile_request(modes, scope["method"], scope["path"]) as record:
+            async def send_with_id(message: Message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message)["X-Profile-Id"] = record["id"]
+                await send(message)
+
+            await self.app(scope, receive, send_with_id)
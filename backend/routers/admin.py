@@ -0,0 +1,126 @@
+"""
+Administrative endpoints
+Maintenance operations, protected by the ADMIN_TOKEN shared secret
+"""
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from typing import Optional
+import hmac
+import os
+
+from services.garbage_collector import OrphanCollector
+from services.loop_monitor import LoopMonitor
+from services.profiler import Profiler
+from services.registry import get_loop_monitor, get_orphan_collector, get_profiler, get_reindexer, get_vector_store
+from services.reindexer import Reindexer
+from services.vector_shards import ShardedVectorStore
+
+def admin_token_matches(token: Optional[str]) -> bool:
+    expected = os.getenv("ADMIN_TOKEN")
+    return bool(expected and token and hmac.compare_digest(token, expected))
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow the request only with the configured admin token"""
+    if not os.getenv("ADMIN_TOKEN"):
+        raise HTTPException(status_code=403, detail="Admin API is disabled (ADMIN_TOKEN not set)")
+    if not admin_token_matches(x_admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.post("/gc")
+async def collect_orphans(
+    dry_run: bool = True,
+    collector: OrphanCollector = Depends(get_orphan_collector)
+):
+    """Find (and unless dry_run, delete) vector chunks and uploads without a Document row"""
+    return await collector.collect(dry_run=dry_run)
+
+@router.get("/loop")
+async def event_loop_stats(monitor: LoopMonitor = Depends(get_loop_monitor)):
+    """Event-loop lag, load shedding state and (in debug mode) the slowest blocking call sites"""
+    return monitor.stats()
+
+@router.get("/shards")
+async def vector_shard_stats(vector_store = Depends(get_vector_store)):
+    """Searches per vector shard that missed the deadline or failed (VECTOR_SHARDS)"""
+    if not isinstance(vector_store, ShardedVectorStore):
+        raise HTTPException(status_code=404, detail="Vector store is not sharded (VECTOR_SHARDS not set)")
+    return vector_store.stats()
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = 10,
+    interval_ms: Optional[float] = None,
+    profiler: Profiler = Depends(get_profiler)
+):
+    """Sample every thread of this worker for `seconds`; returns collapsed stacks for flamegraph.pl or speedscope"""
+    try:
+        result = await profiler.profile(seconds, interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(result["collapsed"], headers={"X-Profile-Samples": str(result["samples"])})
+
+@router.get("/profile/requests")
+async def list_request_profiles(profiler: Profiler = Depends(get_profiler)):
+    """Recent requests profiled with the X-Profile header"""
+    return profiler.request_profiles()
+
+@router.get("/profile/requests/{profile_id}")
+async def get_request_profile(profile_id: str, format: str = "json", profiler: Profiler = Depends(get_profiler)):
+    """One request profile; `format=collapsed` returns just its collapsed stacks"""
+    record = profiler.request_profile(profile_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        if "collapsed" not in record:
+            raise HTTPException(status_code=404, detail="Request was not CPU profiled")
+        return PlainTextResponse(record["collapsed"])
+    return record
+
+class ReindexRequest(BaseModel):
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
+
+@router.post("/reindex")
+async def start_reindex(
+    request: ReindexRequest,
+    reindexer: Reindexer = Depends(get_reindexer)
+):
+    """Build a new index version in the background and switch to it when complete"""
+    try:
+        version = await run_in_threadpool(reindexer.create_version, request.chunk_size, request.chunk_overlap)
+        return reindexer.start(version["id"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/reindex")
+async def list_index_versions(reindexer: Reindexer = Depends(get_reindexer)):
+    """List index versions with their build progress"""
+    return await run_in_threadpool(reindexer.list_versions)
+
+@router.get("/reindex/{version_id}")
+async def get_index_version(version_id: int, reindexer: Reindexer = Depends(get_reindexer)):
+    """Get the build progress of an index version"""
+    try:
+        return await run_in_threadpool(reindexer.get_version, version_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.post("/reindex/{version_id}/resume")
+async def resume_reindex(version_id: int, reindexer: Reindexer = Depends(get_reindexer)):
+    """Resume a paused or interrupted build from its checkpoints"""
+    try:
+        return reindexer.start(version_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/reindex/{version_id}/pause")
+async def pause_reindex(version_id: int, reindexer: Reindexer = Depends(get_reindexer)):
+    """Pause a running build; finished documents stay checkpointed"""
+    await reindexer.pause(version_id)
+    return await run_in_threadpool(reindexer.get_version, version_id)
@@ -2,17 +2,36 @@
 Chat interface endpoints
 Handle user queries and workflow execution
 """
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import contextlib
+import json
+
+import orjson
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from uuid import UUID
+from datetime import datetime
 
-from database import get_db, ChatHistory, Workflow
-from services.workflow_executor import WorkflowExecutor
+from database import get_db, ChatHistory, ChatTrace
+from services.batch_eval import BatchEvaluator, parse_queries
+from services.chat_pipeline import StagePipeline
+from services.chat_recorder import ChatRecorder
+from services.chat_session import ChatSession, open_session_workflow, save_trace
+from services.workflow_executor import RETRIEVAL_TOP_K, WorkflowExecutor
+from services.registry import get_batch_evaluator, get_chat_recorder, get_plan_cache, get_workflow_executor
+from services.tracing import ExecutionTrace, expand_spans, source_id, span_status
+from services.workflow_analyzer import (
+    PlanCache,
+    embedding_provider,
+    retrieval_step,
+    stored_plan_steps
+)
 
 router = APIRouter()
-workflow_executor = WorkflowExecutor()
 
 class ChatMessage(BaseModel):
     workflow_id: UUID
@@ -22,60 +41,238 @@ class ChatMessage(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     sources: List[str] = []
+    message_id: Optional[str] = None
+
+class HistoryMessage(BaseModel):
+    id: UUID
+    message: str
+    role: str
+    created_at: datetime
 
 @router.post("/message")
 async def send_message(
     chat_message: ChatMessage,
-    db: Session = Depends(get_db)
+    workflow_executor: WorkflowExecutor = Depends(get_workflow_executor),
+    recorder: ChatRecorder = Depends(get_chat_recorder),
+    plan_cache: PlanCache = Depends(get_plan_cache)
 ) -> ChatResponse:
     """Send a message and execute the workflow"""
-    # Get workflow
-    workflow = db.query(Workflow).filter(Workflow.id == chat_message.workflow_id).first()
-    if not workflow:
-        raise HTTPException(status_code=404, detail="Workflow not found")
-    
-    if not workflow.is_valid:
-        raise HTTPException(status_code=400, detail="Workflow is not valid")
+    vector_store = workflow_executor.vector_store
+    pipeline = StagePipeline()
     
-    # Save user message
-    user_message = ChatHistory(
-        workflow_id=chat_message.workflow_id,
-        user_id=chat_message.user_id,
-        message=chat_message.message,
-        role="user"
-    )
-    db.add(user_message)
-    db.commit()
+    # Load the workflow while retrieval runs, when its cached plan says it retrieves;
+    # the stages only meet in the knowledgeBase node. Without a cached plan nothing is
+    # started: unknown workflows and plans without a knowledge base never pay for an
+    # embedding. The session is closed right away: a connection held across the LLM
+    # call would starve the pool for the retrieval cache's version reads under load
+    pipeline.add("workflow", lambda: run_in_threadpool(open_session_workflow, chat_message.workflow_id))
+    cached = plan_cache.get(chat_message.workflow_id)
+    prefetch = cached is not None and cached["is_valid"] and retrieval_step(cached["steps"]) is not None
+    provider = embedding_provider(cached["steps"]) if cached is not None else None
+    retrieval_cache = workflow_executor.retrieval_cache
+    retrieval_key = workflow_executor.retrieval_key(chat_message.workflow_id, chat_message.message, provider)
+    # A current cached retrieval leaves nothing to prefetch, not even the query embedding
+    if prefetch and retrieval_cache is not None and retrieval_cache.peek(retrieval_key) is not None:
+        prefetch = False
+    if prefetch:
+        pipeline.add("query_embedding", lambda: vector_store.embed_query(chat_message.message, provider))
+        def retrieve(query_embedding):
+            search = lambda: vector_store.search_by_embedding(
+                query_embedding, n_results=RETRIEVAL_TOP_K, provider=provider, workflow_id=str(chat_message.workflow_id)
+            )
+            return retrieval_cache.fetch(retrieval_key, search) if retrieval_cache is not None else search()
+        pipeline.add("retrieval", retrieve, after=["query_embedding"])
     
     try:
-        # Execute workflow
-        result = await workflow_executor.execute(
-            workflow=workflow,
-            user_query=chat_message.message
-        )
+        workflow = await pipeline.result("workflow")
+        if not workflow:
+            raise HTTPException(status_code=404, detail="Workflow not found")
+        
+        steps = stored_plan_steps(workflow)
+        plan_cache.put(workflow.id, workflow.plan.digest, steps, workflow.is_valid)
+        if not workflow.is_valid:
+            raise HTTPException(status_code=400, detail="Workflow is not valid")
         
-        # Save assistant response
-        assistant_message = ChatHistory(
+        # Prefetched retrieval is only usable if the cached plan matched the stored one,
+        # and a prefetched embedding only if it came from the plan's provider
+        stale = []
+        if cached is not None and cached["digest"] != workflow.plan.digest:
+            stale.append("retrieval")
+        if embedding_provider(steps) != provider:
+            stale.extend(["query_embedding", "retrieval"])
+        for name in stale:
+            task = pipeline.task(name)
+            if task is not None:
+                task.cancel()
+        prefetched = {
+            name: pipeline.task(name)
+            for name in ("query_embedding", "retrieval")
+            if pipeline.has(name) and not pipeline.task(name).cancelled()
+        }
+        
+        # Save user message (buffered, flushed in the background)
+        user_message = await recorder.record_message(
             workflow_id=chat_message.workflow_id,
             user_id=chat_message.user_id,
-            message=result["response"],
-            role="assistant"
+            message=chat_message.message,
+            role="user"
         )
-        db.add(assistant_message)
-        db.commit()
         
-        return ChatResponse(
-            response=result["response"],
-            sources=result.get("sources", [])
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        trace = ExecutionTrace(str(workflow.id))
+        try:
+            # Execute workflow
+            result = await workflow_executor.execute(
+                workflow=workflow,
+                user_query=chat_message.message,
+                trace=trace,
+                prefetched=prefetched
+            )
+        except Exception as e:
+            # Failed requests are the ones traces exist for; keep it with the user message
+            await save_trace(recorder, trace, chat_message.workflow_id, user_message["id"])
+            raise HTTPException(status_code=500, detail=str(e), headers={"X-Message-Id": str(user_message["id"])})
+        
+        try:
+            # Save assistant response together with its execution trace
+            assistant_message = await recorder.record_message(
+                workflow_id=chat_message.workflow_id,
+                user_id=chat_message.user_id,
+                message=result["response"],
+                role="assistant"
+            )
+            await save_trace(recorder, trace, chat_message.workflow_id, assistant_message["id"])
+            
+            return ChatResponse(
+                response=result["response"],
+                sources=[source_id(meta) for meta in result.get("sources", [])],
+                message_id=str(assistant_message["id"])
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Drops speculative work that validation or the plan made unnecessary
+        pipeline.cancel()
+
+@router.post("/batch/{workflow_id}")
+async def evaluate_batch(
+    workflow_id: UUID,
+    file: UploadFile = File(...),
+    concurrency: Optional[int] = None,
+    evaluator: BatchEvaluator = Depends(get_batch_evaluator)
+):
+    """Run every query of an uploaded file through the workflow, streaming one JSON line per query
+
+    Nothing is saved to chat history. The last line is a summary (`"summary": true`).
+    """
+    try:
+        queries = parse_queries((await file.read()).decode("utf-8").splitlines())
+        concurrency = evaluator.check_concurrency(concurrency)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Query file must be UTF-8 text")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    workflow = await run_in_threadpool(open_session_workflow, workflow_id)
+    if not workflow:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    if not workflow.is_valid:
+        raise HTTPException(status_code=400, detail="Workflow is not valid")
+    
+    async def lines():
+        async for record in evaluator.run(workflow, stored_plan_steps(workflow), queries, concurrency):
+            yield orjson.dumps(record) + b"\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.websocket("/ws/{workflow_id}")
+async def chat_session(
+    websocket: WebSocket,
+    workflow_id: UUID,
+    user_id: UUID,
+    workflow_executor: WorkflowExecutor = Depends(get_workflow_executor),
+    recorder: ChatRecorder = Depends(get_chat_recorder),
+    plan_cache: PlanCache = Depends(get_plan_cache)
+):
+    """Chat over one connection: several messages in flight, streamed tokens, cancellation"""
+    workflow = await run_in_threadpool(open_session_workflow, workflow_id)
+    if not workflow:
+        await websocket.close(code=4404, reason="Workflow not found")
+        return
+    steps = stored_plan_steps(workflow)
+    plan_cache.put(workflow.id, workflow.plan.digest, steps, workflow.is_valid)
+    if not workflow.is_valid:
+        await websocket.close(code=4400, reason="Workflow is not valid")
+        return
+    
+    session = ChatSession(
+        workflow, steps, workflow.plan.digest, user_id,
+        executor=workflow_executor, recorder=recorder, plan_cache=plan_cache
+    )
+    send_lock = asyncio.Lock()
+    
+    async def send(payload: Dict[str, Any]):
+        # Messages are answered concurrently; frames must not interleave
+        async with send_lock:
+            await websocket.send_json(payload)
+    
+    async def answer(message_id: str, text: str):
+        async def on_token(delta: str):
+            await send({"type": "token", "id": message_id, "delta": delta})
+        
+        try:
+            result = await session.ask(text, on_token)
+            await send({"type": "done", "id": message_id, **result})
+        except asyncio.CancelledError:
+            # Also raised when the socket went away, then there is nobody left to tell
+            with contextlib.suppress(Exception):
+                await send({"type": "cancelled", "id": message_id})
+        except Exception as e:
+            await send({"type": "error", "id": message_id, "detail": str(e)})
+        finally:
+            session.in_flight.pop(message_id, None)
+    
+    await websocket.accept()
+    await send({"type": "ready", "workflow_id": str(workflow.id)})
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+                kind = frame["type"]
+            except (ValueError, TypeError, KeyError):
+                await send({"type": "error", "detail": "Expected a JSON object with a type"})
+                continue
+            message_id = str(frame.get("id", ""))
+            
+            if kind == "ping":
+                await send({"type": "pong"})
+            elif kind == "message":
+                if not message_id or not isinstance(frame.get("message"), str):
+                    await send({"type": "error", "id": message_id, "detail": "A message needs an id and a message"})
+                elif message_id in session.in_flight:
+                    await send({"type": "error", "id": message_id, "detail": "Message id already in flight"})
+                elif len(session.in_flight) >= session.max_in_flight:
+                    await send({"type": "error", "id": message_id, "detail": "Too many messages in flight"})
+                else:
+                    session.in_flight[message_id] = asyncio.create_task(answer(message_id, frame["message"]))
+            elif kind == "cancel":
+                task = session.in_flight.get(message_id)
+                if task is None:
+                    await send({"type": "error", "id": message_id, "detail": "No such message in flight"})
+                else:
+                    task.cancel()
+            else:
+                await send({"type": "error", "id": message_id, "detail": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.close()
 
-@router.get("/history/{workflow_id}")
+@router.get("/history/{workflow_id}", response_model=List[HistoryMessage])
 async def get_chat_history(
     workflow_id: UUID,
     limit: int = 50,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    recorder: ChatRecorder = Depends(get_chat_recorder)
 ):
     """Get chat history for a workflow"""
     history = (
@@ -85,20 +282,63 @@ async def get_chat_history(
         .limit(limit)
         .all()
     )
-    
-    return [
-        {
-            "id": str(msg.id),
+    messages = {
+        str(msg.id): {
+            "id": msg.id,
             "message": msg.message,
             "role": msg.role,
-            "created_at": msg.created_at.isoformat()
+            "created_at": msg.created_at
         }
-        for msg in reversed(history)
-    ]
+        for msg in history
+    }
+    
+    # Overlay messages that are still waiting in the write-behind buffer
+    for row in recorder.pending_messages(workflow_id):
+        messages.setdefault(str(row["id"]), {
+            "id": row["id"],
+            "message": row["message"],
+            "role": row["role"],
+            "created_at": row["created_at"]
+        })
+    
+    latest = sorted(messages.values(), key=lambda msg: msg["created_at"], reverse=True)[:limit]
+    # Long histories are the largest chat payload; orjson encodes the rows as they are
+    return ORJSONResponse(latest[::-1])
+
+@router.get("/trace/{message_id}")
+async def get_chat_trace(
+    message_id: UUID,
+    db: Session = Depends(get_db),
+    recorder: ChatRecorder = Depends(get_chat_recorder)
+):
+    """Get the execution trace recorded for an assistant message (or the user message of a failed one)"""
+    pending = recorder.pending_trace(message_id)
+    if pending:
+        trace = ChatTrace(**pending)
+    else:
+        trace = db.query(ChatTrace).filter(ChatTrace.chat_history_id == message_id).first()
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    
+    return {
+        "message_id": str(trace.chat_history_id),
+        "workflow_id": str(trace.workflow_id),
+        "duration_ms": trace.duration_ms,
+        "status": span_status(trace.spans),
+        "spans": expand_spans(trace.spans),
+        "created_at": trace.created_at.isoformat()
+    }
 
 @router.delete("/history/{workflow_id}")
-async def clear_chat_history(workflow_id: UUID, db: Session = Depends(get_db)):
+async def clear_chat_history(
+    workflow_id: UUID,
+    db: Session = Depends(get_db),
+    recorder: ChatRecorder = Depends(get_chat_recorder)
+):
     """Clear chat history for a workflow"""
+    # Flush first so buffered rows cannot reappear after the delete
+    await recorder.flush()
+    db.query(ChatTrace).filter(ChatTrace.workflow_id == workflow_id).delete()
     db.query(ChatHistory).filter(ChatHistory.workflow_id == workflow_id).delete()
     db.commit()
     return {"message": "Chat history cleared successfully"}
@@ -3,24 +3,36 @@ Document processing endpoints
 Upload, process, and embed documents
 """
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from uuid import UUID
+from datetime import datetime
 import os
 import aiofiles
 
 from database import get_db, Document
-from services.document_processor import DocumentProcessor
+from services.document_processor import DocumentProcessor, remove_uploads
 from services.vector_store import VectorStore
+from services.ingestion import BatchIngestor
+from services.registry import get_batch_ingestor, get_document_processor, get_vector_store
+from services.reindexer import requeue_document
+from services.retrieval_cache import bump_corpus_version
+from services.workflow_analyzer import workflow_embedding_provider
 
 router = APIRouter()
-document_processor = DocumentProcessor()
-vector_store = VectorStore()
 
-UPLOAD_DIR = "uploads"
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+class DocumentSummary(BaseModel):
+    id: UUID
+    filename: str
+    processed: bool
+    created_at: datetime
+
 @router.post("/upload")
 async def upload_document(
     file: UploadFile = File(...),
@@ -57,44 +69,120 @@ async def upload_document(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/batch", status_code=202)
+async def upload_batch(
+    user_id: UUID,
+    workflow_id: UUID = None,
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    ingestor: BatchIngestor = Depends(get_batch_ingestor)
+):
+    """Upload many documents (files and/or one zip or tar archive) and ingest them in the background"""
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="Send files or an archive")
+    
+    saved = []
+    try:
+        # Uploads are spooled to temporary files by the server; copy them without reading into memory
+        if files:
+            saved += await run_in_threadpool(
+                ingestor.save_files, [(f.file, f.filename, f.content_type) for f in files]
+            )
+        if archive is not None:
+            saved += await run_in_threadpool(ingestor.save_archive, archive.file)
+        if not saved:
+            raise ValueError("No documents found in the upload")
+        
+        batch = await run_in_threadpool(ingestor.register, saved, workflow_id, user_id)
+    except ValueError as e:
+        ingestor.discard(saved)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        ingestor.discard(saved)
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    ingestor.start(batch["job"]["id"], batch["documents"])
+    return {
+        "job": batch["job"],
+        "documents": [{"id": d["id"], "filename": d["filename"]} for d in batch["documents"]]
+    }
+
+@router.get("/batch/{job_id}")
+async def get_batch_progress(job_id: UUID, ingestor: BatchIngestor = Depends(get_batch_ingestor)):
+    """Aggregate progress of a batch upload"""
+    job = await run_in_threadpool(ingestor.get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
 @router.post("/{document_id}/process")
-async def process_document(document_id: UUID, db: Session = Depends(get_db)):
+async def process_document(
+    document_id: UUID,
+    db: Session = Depends(get_db),
+    document_processor: DocumentProcessor = Depends(get_document_processor),
+    vector_store: VectorStore = Depends(get_vector_store)
+):
     """Process a document and create embeddings"""
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
+    # Chunk ids are "<document>_<index>" and adding an indexed id is a no-op (a deleted
+    # one is stored again), so a re-processing run only writes the chunks past the ones
+    # already indexed
+    previous_chunks = (document.embedding_count or 0) if document.processed else 0
+    chunks, provider, uncommitted = [], None, False
     try:
-        # Extract text from document
-        text = document_processor.extract_text(document.file_path)
+        # Extract and chunk text in a worker thread; PyMuPDF would block the event loop
+        text = await run_in_threadpool(document_processor.extract_text, document.file_path)
+        chunks = await run_in_threadpool(document_processor.chunk_text, text)
         
-        # Chunk text
-        chunks = document_processor.chunk_text(text)
-        
-        # Create embeddings
-        embeddings = await vector_store.create_embeddings(chunks)
+        # Create embeddings with the provider the workflow's knowledge base uses
+        provider = workflow_embedding_provider(document.workflow)
+        embeddings = await vector_store.create_embeddings(chunks, provider)
         
         # Store in vector database
+        uncommitted = True
         await vector_store.store_embeddings(
             str(document_id),
             chunks,
-            embeddings
+            embeddings,
+            provider,
+            workflow_id=str(document.workflow_id)
         )
         
         # Update document status
         document.processed = True
         document.embedding_count = len(chunks)
+        bump_corpus_version(db)
         db.commit()
+        uncommitted = False
+        # A reindex in progress must rebuild this document too
+        requeue_document(db, document.id)
         
         return {
             "message": "Document processed successfully",
             "chunks": len(chunks)
         }
     except Exception as e:
+        db.rollback()
+        if uncommitted:
+            # Remove what this run added; the chunks of an earlier good run (and of
+            # other index versions) stay, and so does the document's processed state
+            try:
+                await vector_store.delete_chunks(
+                    str(document_id), range(previous_chunks, len(chunks)), provider, str(document.workflow_id)
+                )
+                bump_corpus_version(db)
+                db.commit()
+                requeue_document(db, document.id)
+            except Exception:
+                db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+# Plain `def` read endpoints run in the threadpool, keeping their DB queries off the loop
 @router.get("/{document_id}")
-async def get_document(document_id: UUID, db: Session = Depends(get_db)):
+def get_document(document_id: UUID, db: Session = Depends(get_db)):
     """Get document information"""
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
@@ -109,36 +197,41 @@ async def get_document(document_id: UUID, db: Session = Depends(get_db)):
         "created_at": document.created_at.isoformat()
     }
 
-@router.get("/workflow/{workflow_id}")
-async def list_workflow_documents(workflow_id: UUID, db: Session = Depends(get_db)):
+@router.get("/workflow/{workflow_id}", response_model=List[DocumentSummary])
+def list_workflow_documents(workflow_id: UUID, db: Session = Depends(get_db)):
     """List all documents for a workflow"""
     documents = db.query(Document).filter(Document.workflow_id == workflow_id).all()
-    return [
+    # Returned as is: the rows need no validation and orjson encodes UUIDs and datetimes
+    return ORJSONResponse([
         {
-            "id": str(d.id),
+            "id": d.id,
             "filename": d.filename,
             "processed": d.processed,
-            "created_at": d.created_at.isoformat()
+            "created_at": d.created_at
         }
         for d in documents
-    ]
+    ])
 
 @router.delete("/{document_id}")
-async def delete_document(document_id: UUID, db: Session = Depends(get_db)):
+async def delete_document(
+    document_id: UUID,
+    db: Session = Depends(get_db),
+    vector_store: VectorStore = Depends(get_vector_store)
+):
     """Delete a document"""
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Delete file
-    if os.path.exists(document.file_path):
-        os.remove(document.file_path)
+    await run_in_threadpool(remove_uploads, [document.file_path])
     
     # Delete from vector store
     await vector_store.delete_document(str(document_id))
     
     # Delete record
     db.delete(document)
+    bump_corpus_version(db)
     db.commit()
     
     return {"message": "Document deleted successfully"}
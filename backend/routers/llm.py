@@ -2,15 +2,15 @@
 LLM integration endpoints
 Interact with OpenAI, Gemini, and other LLM providers
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os
 
 from services.llm_service import LLMService
+from services.registry import get_llm_service
 
 router = APIRouter()
-llm_service = LLMService()
 
 class LLMRequest(BaseModel):
     prompt: str
@@ -24,9 +24,14 @@ class LLMResponse(BaseModel):
     response: str
     model: str
     tokens_used: int
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
 
 @router.post("/generate")
-async def generate_response(request: LLMRequest) -> LLMResponse:
+async def generate_response(
+    request: LLMRequest,
+    llm_service: LLMService = Depends(get_llm_service)
+) -> LLMResponse:
     """Generate a response from an LLM"""
     try:
         result = await llm_service.generate(
@@ -41,11 +46,18 @@ async def generate_response(request: LLMRequest) -> LLMResponse:
         return LLMResponse(
             response=result["response"],
             model=result["model"],
-            tokens_used=result["tokens_used"]
+            tokens_used=result["tokens_used"],
+            prompt_tokens=result.get("prompt_tokens", 0),
+            cached_tokens=result.get("cached_tokens", 0)
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/usage")
+async def token_usage(llm_service: LLMService = Depends(get_llm_service)):
+    """Prompt tokens sent since startup and how many the provider's prefix cache served"""
+    return llm_service.usage_stats()
+
 @router.get("/models")
 async def list_models():
     """List available LLM models"""
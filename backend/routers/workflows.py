@@ -2,14 +2,21 @@
 Workflow management endpoints
 Create, read, update, delete workflows
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from uuid import UUID
 from datetime import datetime
 
-from database import get_db, Workflow, WorkflowNode, WorkflowEdge
+from database import get_db, Workflow, WorkflowNode, WorkflowEdge, Document
+from services.document_processor import remove_uploads
+from services.registry import get_plan_cache, get_vector_store
+from services.retrieval_cache import bump_corpus_version
+from services.vector_store import VectorStore
+from services.workflow_analyzer import PlanCache, analyze_workflow, apply_analysis
 
 router = APIRouter()
 
@@ -31,23 +38,73 @@ class WorkflowCreate(BaseModel):
     user_id: UUID
     nodes: List[NodeCreate] = []
     edges: List[EdgeCreate] = []
-    is_valid: Optional[bool] = False
+    is_valid: Optional[bool] = False  # ignored, validity is computed by the server
 
 class WorkflowUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     nodes: Optional[List[NodeCreate]] = None
     edges: Optional[List[EdgeCreate]] = None
-    is_valid: Optional[bool] = None
+    is_valid: Optional[bool] = None  # ignored, validity is computed by the server
+
+# Response models document the read endpoints; the handlers return ORJSONResponse
+# directly, so FastAPI neither validates nor re-encodes what was just read from the DB
+class NodeRead(BaseModel):
+    id: UUID
+    node_id: str
+    type: str
+    position: Dict[str, float]
+    config: Dict[str, Any]
+
+class EdgeRead(BaseModel):
+    id: UUID
+    edge_id: str
+    source: str
+    target: str
+
+class WorkflowRead(BaseModel):
+    id: UUID
+    name: str
+    description: Optional[str]
+    is_valid: bool
+    errors: List[str]
+    warnings: List[str]
+    nodes: List[NodeRead]
+    edges: List[EdgeRead]
+    created_at: datetime
+    updated_at: datetime
+
+class WorkflowSummary(BaseModel):
+    id: UUID
+    name: str
+    description: Optional[str]
+    is_valid: bool
+    created_at: datetime
+
+def workflow_etag(updated_at: Optional[datetime]) -> str:
+    """Validator of a workflow representation; every save moves `updated_at`"""
+    return f'"{updated_at.strftime("%Y%m%d%H%M%S%f") if updated_at else 0}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as used for If-None-Match"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
 
 @router.post("/")
-async def create_workflow(workflow: WorkflowCreate, db: Session = Depends(get_db)):
+async def create_workflow(
+    workflow: WorkflowCreate,
+    db: Session = Depends(get_db),
+    plan_cache: PlanCache = Depends(get_plan_cache)
+):
     """Create a new workflow"""
     db_workflow = Workflow(
         user_id=workflow.user_id,
         name=workflow.name,
-        description=workflow.description,
-        is_valid=workflow.is_valid
+        description=workflow.description
     )
     db.add(db_workflow)
     db.commit()
@@ -75,24 +132,48 @@ async def create_workflow(workflow: WorkflowCreate, db: Session = Depends(get_db
         )
         db.add(db_edge)
     
+    # Validate and compile the graph once, here, instead of on every chat message
+    analysis = analyze_workflow(
+        [node.model_dump() for node in workflow.nodes],
+        [edge.model_dump() for edge in workflow.edges]
+    )
+    apply_analysis(db_workflow, analysis)
+    
     db.commit()
-    return {"id": str(db_workflow.id), "message": "Workflow created successfully"}
+    plan_cache.put_analysis(db_workflow.id, analysis)
+    return {
+        "id": str(db_workflow.id),
+        "message": "Workflow created successfully",
+        "is_valid": analysis.is_valid,
+        "errors": analysis.errors,
+        "warnings": analysis.warnings
+    }
 
-@router.get("/{workflow_id}")
-async def get_workflow(workflow_id: UUID, db: Session = Depends(get_db)):
+# Plain `def` read endpoints run in the threadpool, keeping their DB queries off the loop
+@router.get("/{workflow_id}", response_model=WorkflowRead, responses={304: {"description": "Not modified"}})
+def get_workflow(workflow_id: UUID, request: Request, db: Session = Depends(get_db)):
     """Get a specific workflow"""
+    # Revalidation only needs the timestamp, not the graph
+    row = db.query(Workflow.updated_at).filter(Workflow.id == workflow_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    if etag_matches(request.headers.get("if-none-match"), workflow_etag(row.updated_at)):
+        return Response(status_code=304, headers={"ETag": workflow_etag(row.updated_at), "Cache-Control": "no-cache"})
+    
     workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
     if not workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
     
-    return {
-        "id": str(workflow.id),
+    return ORJSONResponse({
+        "id": workflow.id,
         "name": workflow.name,
         "description": workflow.description,
         "is_valid": workflow.is_valid,
+        "errors": workflow.plan.errors if workflow.plan else [],
+        "warnings": workflow.plan.warnings if workflow.plan else [],
         "nodes": [
             {
-                "id": str(node.id),
+                "id": node.id,
                 "node_id": node.node_id,
                 "type": node.node_type,
                 "position": {"x": node.position_x, "y": node.position_y},
@@ -102,37 +183,38 @@ async def get_workflow(workflow_id: UUID, db: Session = Depends(get_db)):
         ],
         "edges": [
             {
-                "id": str(edge.id),
+                "id": edge.id,
                 "edge_id": edge.edge_id,
                 "source": edge.source_node_id,
                 "target": edge.target_node_id
             }
             for edge in workflow.edges
         ],
-        "created_at": workflow.created_at.isoformat(),
-        "updated_at": workflow.updated_at.isoformat()
-    }
+        "created_at": workflow.created_at,
+        "updated_at": workflow.updated_at
+    }, headers={"ETag": workflow_etag(workflow.updated_at), "Cache-Control": "no-cache"})
 
-@router.get("/user/{user_id}")
-async def list_user_workflows(user_id: UUID, db: Session = Depends(get_db)):
+@router.get("/user/{user_id}", response_model=List[WorkflowSummary])
+def list_user_workflows(user_id: UUID, db: Session = Depends(get_db)):
     """List all workflows for a user"""
     workflows = db.query(Workflow).filter(Workflow.user_id == user_id).all()
-    return [
+    return ORJSONResponse([
         {
-            "id": str(w.id),
+            "id": w.id,
             "name": w.name,
             "description": w.description,
             "is_valid": w.is_valid,
-            "created_at": w.created_at.isoformat()
+            "created_at": w.created_at
         }
         for w in workflows
-    ]
+    ])
 
 @router.put("/{workflow_id}")
 async def update_workflow(
     workflow_id: UUID,
     workflow: WorkflowUpdate,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    plan_cache: PlanCache = Depends(get_plan_cache)
 ):
     """Update a workflow"""
     db_workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
@@ -143,8 +225,22 @@ async def update_workflow(
         db_workflow.name = workflow.name
     if workflow.description is not None:
         db_workflow.description = workflow.description
-    if workflow.is_valid is not None:
-        db_workflow.is_valid = workflow.is_valid
+    
+    # Graph the analysis runs on: new nodes/edges if provided, otherwise the stored ones
+    if workflow.nodes is not None:
+        node_dicts = [node.model_dump() for node in workflow.nodes]
+    else:
+        node_dicts = [
+            {"node_id": n.node_id, "node_type": n.node_type, "config": n.config or {}}
+            for n in db_workflow.nodes
+        ]
+    if workflow.edges is not None:
+        edge_dicts = [edge.model_dump() for edge in workflow.edges]
+    else:
+        edge_dicts = [
+            {"source_node_id": e.source_node_id, "target_node_id": e.target_node_id}
+            for e in db_workflow.edges
+        ]
     
     # Update nodes if provided
     if workflow.nodes is not None:
@@ -176,16 +272,44 @@ async def update_workflow(
             )
             db.add(db_edge)
     
+    analysis = analyze_workflow(node_dicts, edge_dicts)
+    apply_analysis(db_workflow, analysis)
+    # Set explicitly: a graph-only change does not touch the workflows row, and the
+    # ETag of get_workflow is derived from this timestamp
+    db_workflow.updated_at = datetime.utcnow()
+    
     db.commit()
-    return {"message": "Workflow updated successfully"}
+    plan_cache.put_analysis(workflow_id, analysis)
+    return {
+        "message": "Workflow updated successfully",
+        "is_valid": analysis.is_valid,
+        "errors": analysis.errors,
+        "warnings": analysis.warnings
+    }
 
 @router.delete("/{workflow_id}")
-async def delete_workflow(workflow_id: UUID, db: Session = Depends(get_db)):
+async def delete_workflow(
+    workflow_id: UUID,
+    db: Session = Depends(get_db),
+    plan_cache: PlanCache = Depends(get_plan_cache),
+    vector_store: VectorStore = Depends(get_vector_store)
+):
     """Delete a workflow"""
     workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
     if not workflow:
         raise HTTPException(status_code=404, detail="Workflow not found")
     
+    # Remove the workflow's documents with their chunks and files; anything left
+    # behind by a failure here is picked up by the orphan collector
+    documents = db.query(Document).filter(Document.workflow_id == workflow_id).all()
+    await vector_store.delete_documents([str(d.id) for d in documents])
+    await run_in_threadpool(remove_uploads, [d.file_path for d in documents])
+    for document in documents:
+        db.delete(document)
+    
     db.delete(workflow)
+    if documents:
+        bump_corpus_version(db)
     db.commit()
+    plan_cache.invalidate(workflow_id)
     return {"message": "Workflow deleted successfully"}
@@ -0,0 +1,169 @@
+"""
+Batch evaluation
+Run a file of test queries through a workflow, one result record per query, nothing saved to chat history
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from services.tracing import ExecutionTrace, source_id
+from services.workflow_analyzer import PlanStep, embedding_provider, retrieval_step
+from services.workflow_executor import WorkflowExecutor
+
+# Query embedding requests in flight at once; batches are requested in query order
+EMBED_PIPELINE_DEPTH = 2
+
+
+def parse_queries(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """One query per line: plain text, or a JSON object with a "query" field
+
+    Other fields of a JSON line (an id, the expected answer) are copied to its result.
+    """
+    queries = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("{"):
+            queries.append({"query": line})
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {number}: invalid JSON ({e.msg})")
+        if not isinstance(item, dict) or not isinstance(item.get("query"), str) or not item["query"].strip():
+            raise ValueError(f"Line {number}: a JSON line needs a non-empty \"query\" string")
+        queries.append(item)
+    if not queries:
+        raise ValueError("No queries found")
+    return queries
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))]
+
+
+class BatchEvaluator:
+    """Runs many queries through WorkflowExecutor.execute with bounded concurrency
+
+    Query embeddings are created `embed_batch` at a time ahead of execution instead of one
+    request per query, and identical queries share one retrieval through the executor's
+    retrieval cache. Results are yielded as queries finish, followed by one summary.
+    """
+
+    def __init__(self, executor: WorkflowExecutor, concurrency: int = None, max_concurrency: int = None, embed_batch: int = None):
+        self.executor = executor
+        self.concurrency = concurrency or int(os.getenv("EVAL_CONCURRENCY", "8"))
+        self.max_concurrency = max_concurrency or int(os.getenv("EVAL_MAX_CONCURRENCY", "32"))
+        self.embed_batch = embed_batch or int(os.getenv("EVAL_EMBED_BATCH", "64"))
+
+    def check_concurrency(self, concurrency: Optional[int]) -> int:
+        concurrency = concurrency or self.concurrency
+        if not 1 <= concurrency <= self.max_concurrency:
+            raise ValueError(f"concurrency must be between 1 and {self.max_concurrency}")
+        return concurrency
+
+    def _embed_ahead(self, texts: List[str], provider: Optional[str]) -> Tuple[Dict[str, asyncio.Future], List[asyncio.Future]]:
+        """One future per distinct text, resolved when its embedding batch returns; and the batches"""
+        vector_store = self.executor.vector_store
+        slots = asyncio.Semaphore(EMBED_PIPELINE_DEPTH)
+        distinct = list(dict.fromkeys(texts))
+
+        async def embed(batch: List[str]) -> List[List[float]]:
+            async with slots:
+                return await vector_store.create_embeddings(batch, provider)
+
+        async def pick(batch_task: asyncio.Future, index: int) -> List[float]:
+            return (await batch_task)[index]
+
+        futures, batches = {}, []
+        for start in range(0, len(distinct), self.embed_batch):
+            batch = distinct[start:start + self.embed_batch]
+            batch_task = asyncio.ensure_future(embed(batch))
+            batches.append(batch_task)
+            for index, text in enumerate(batch):
+                futures[text] = asyncio.ensure_future(pick(batch_task, index))
+        return futures, batches
+
+    async def run(
+        self,
+        workflow: Any,
+        steps: List[PlanStep],
+        queries: List[Dict[str, Any]],
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        concurrency = self.check_concurrency(concurrency)
+        embeddings: Dict[str, asyncio.Future] = {}
+        batches: List[asyncio.Future] = []
+        if retrieval_step(steps) is not None:
+            embeddings, batches = self._embed_ahead([item["query"] for item in queries], embedding_provider(steps))
+
+        pending: asyncio.Queue = asyncio.Queue()
+        for index, item in enumerate(queries):
+            pending.put_nowait((index, item))
+        finished: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            while not pending.empty():
+                index, item = pending.get_nowait()
+                await finished.put(await self._evaluate(workflow, steps, index, item, embeddings))
+
+        started = time.perf_counter()
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(queries)))]
+        latencies, tokens, cached_tokens, errors = [], 0, 0, 0
+        try:
+            for _ in range(len(queries)):
+                record = await finished.get()
+                latencies.append(record["latency_ms"])
+                tokens += record.get("tokens", 0)
+                cached_tokens += record.get("cached_tokens", 0)
+                errors += "error" in record
+                yield record
+        finally:
+            for task in workers + batches + list(embeddings.values()):
+                task.cancel()
+                if task.done() and not task.cancelled():
+                    task.exception()  # a failed embedding batch was reported per query
+
+        elapsed = time.perf_counter() - started
+        yield {
+            "summary": True,
+            "queries": len(queries),
+            "errors": errors,
+            "concurrency": concurrency,
+            "duration_s": round(elapsed, 3),
+            "queries_per_s": round(len(queries) / elapsed, 2) if elapsed else 0.0,
+            "latency_p50_ms": _percentile(latencies, 50),
+            "latency_p95_ms": _percentile(latencies, 95),
+            "tokens": tokens,
+            "cached_tokens": cached_tokens
+        }
+
+    async def _evaluate(
+        self,
+        workflow: Any,
+        steps: List[PlanStep],
+        index: int,
+        item: Dict[str, Any],
+        embeddings: Dict[str, asyncio.Future]
+    ) -> Dict[str, Any]:
+        record = {**item, "index": index}
+        trace = ExecutionTrace(str(workflow.id))
+        prefetched = {"query_embedding": embeddings[item["query"]]} if item["query"] in embeddings else {}
+        started = time.perf_counter()
+        try:
+            result = await self.executor.execute(workflow, item["query"], trace=trace, prefetched=prefetched, steps=steps)
+            record["response"] = result["response"]
+            record["sources"] = [source_id(meta) for meta in result["sources"]]
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        record["tokens"] = sum(span.tokens for span in trace.spans)
+        record["cached_tokens"] = sum(span.cached_tokens for span in trace.spans)
+        record["node_ms"] = {span.node_id: round(span.duration_ms, 3) for span in trace.spans}
+        return record
@@ -0,0 +1,45 @@
+"""
+Async stage pipeline
+Run independent request stages concurrently as a small dependency graph
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class StagePipeline:
+    """Start each stage as soon as its dependencies are done
+
+    A stage function receives the results of its dependencies as keyword
+    arguments named after them. Stages start when they are added; results are
+    awaited with `result()`. `cancel()` stops whatever is still running, e.g.
+    speculative work for a request that failed validation.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def add(self, name: str, fn: Callable[..., Awaitable[Any]], after: Optional[List[str]] = None):
+        deps = {dep: self._tasks[dep] for dep in after or []}
+
+        async def run():
+            kwargs = {dep: await task for dep, task in deps.items()}
+            return await fn(**kwargs)
+
+        self._tasks[name] = asyncio.create_task(run(), name=f"stage:{name}")
+
+    def has(self, name: str) -> bool:
+        return name in self._tasks
+
+    def task(self, name: str) -> Optional[asyncio.Task]:
+        return self._tasks.get(name)
+
+    async def result(self, name: str) -> Any:
+        return await self._tasks[name]
+
+    def cancel(self):
+        """Cancel unfinished stages and silence errors of finished, unused ones"""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
@@ -0,0 +1,274 @@
+"""
+Write-behind recorder for chat persistence
+Buffer ChatHistory/ChatTrace rows in memory and flush them in batched inserts
+"""
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+
+from database import SessionLocal, ChatHistory, ChatTrace
+from services.db_writer import WriteQueue
+
+# Tables are flushed in this order so traces never precede their message
+TABLES = {"chat_history": ChatHistory, "chat_traces": ChatTrace}
+DATETIME_FIELDS = ("created_at",)
+
+
+def _encode(row: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = {}
+    for key, value in row.items():
+        if isinstance(value, uuid.UUID):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        encoded[key] = value
+    return encoded
+
+
+def _decode(row: Dict[str, Any]) -> Dict[str, Any]:
+    decoded = dict(row)
+    for key in DATETIME_FIELDS:
+        if isinstance(decoded.get(key), str):
+            decoded[key] = datetime.fromisoformat(decoded[key])
+    return decoded
+
+
+class ChatRecorder:
+    """Bounded in-memory write buffer with a background flusher
+
+    Until `start()` is called (from the FastAPI lifespan) rows are written through
+    synchronously, so code paths without a running flusher stay correct.
+    """
+
+    def __init__(
+        self,
+        max_pending: int = None,
+        batch_size: int = None,
+        flush_interval_ms: float = None,
+        wal_path: str = None,
+        session_factory=SessionLocal,
+        writer: Optional[WriteQueue] = None
+    ):
+        self.max_pending = max_pending or int(os.getenv("CHAT_BUFFER_MAX", "10000"))
+        self.batch_size = batch_size or int(os.getenv("CHAT_FLUSH_BATCH", "500"))
+        self.flush_interval = (flush_interval_ms or float(os.getenv("CHAT_FLUSH_INTERVAL_MS", "200"))) / 1000
+        self.wal_path = wal_path if wal_path is not None else os.getenv("CHAT_WAL_PATH") or None
+        self.wal_fsync = os.getenv("CHAT_WAL_FSYNC", "false").lower() in ("1", "true", "yes")
+        self.session_factory = session_factory
+        # With a write queue, inserts share transactions with the process's other writes
+        self.writer = writer
+
+        # (table, row) pairs in arrival order; rows stay here until committed
+        self._pending: List[tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._wal = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # Recording
+
+    async def record_message(self, **row) -> Dict[str, Any]:
+        """Queue a ChatHistory row; id and created_at are assigned here"""
+        row.setdefault("id", uuid.uuid4())
+        row.setdefault("created_at", datetime.utcnow())
+        await self._record("chat_history", row)
+        return row
+
+    async def record_trace(self, **row) -> Dict[str, Any]:
+        """Queue a ChatTrace row for a message recorded with record_message"""
+        row.setdefault("id", uuid.uuid4())
+        row.setdefault("created_at", datetime.utcnow())
+        await self._record("chat_traces", row)
+        return row
+
+    async def _record(self, table: str, row: Dict[str, Any]):
+        if not self.running:
+            await self._write([(table, row)])
+            return
+
+        if len(self._pending) >= self.max_pending and not await self.flush():
+            # Back-pressure: make room before accepting more rows, and refuse them
+            # while the database is unavailable rather than grow without bound
+            raise RuntimeError(f"Chat buffer is full ({len(self._pending)} rows) and the database is unavailable")
+        self._pending.append((table, row))
+        self._append_wal(table, row)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    # Read-your-writes overlay
+
+    def pending_messages(self, workflow_id: uuid.UUID) -> List[Dict[str, Any]]:
+        """Unflushed ChatHistory rows of a workflow"""
+        return [
+            row for table, row in self._pending
+            if table == "chat_history" and str(row.get("workflow_id")) == str(workflow_id)
+        ]
+
+    def pending_trace(self, message_id: uuid.UUID) -> Optional[Dict[str, Any]]:
+        """Unflushed ChatTrace row of a message"""
+        for table, row in self._pending:
+            if table == "chat_traces" and str(row.get("chat_history_id")) == str(message_id):
+                return row
+        return None
+
+    # Flushing
+
+    async def start(self):
+        """Replay the WAL and start the background flusher"""
+        if self.running:
+            return
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        if self.wal_path:
+            await asyncio.to_thread(self._replay_wal)
+            self._wal = open(self.wal_path, "a", encoding="utf-8")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything that is buffered and stop the flusher"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            if not await self.flush():
+                print(f"⚠️  Chat recorder stopped with {len(self._pending)} unflushed rows")
+                break
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    # Keep the flusher alive; the rows stay buffered for the next round
+                    print(f"⚠️  Chat recorder flush failed, will retry: {e}")
+
+    async def flush(self) -> bool:
+        """Write buffered rows in batched multi-row inserts; returns False on failure"""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                try:
+                    await self._write(batch, drop_rejected=True)
+                except SQLAlchemyError as e:
+                    print(f"⚠️  Chat recorder flush failed, will retry: {e}")
+                    return False
+                del self._pending[:len(batch)]
+            self._truncate_wal()
+            return True
+
+    async def _write(self, batch: List[tuple], drop_rejected: bool = False):
+        if self.writer is None:
+            await asyncio.to_thread(self._insert, batch, drop_rejected)
+            return
+        try:
+            await self.writer.submit(partial(self._add_rows, batch))
+        except (IntegrityError, DataError):
+            if not drop_rejected:
+                raise
+            for item in batch:
+                try:
+                    await self.writer.submit(partial(self._add_rows, [item]))
+                except (IntegrityError, DataError) as e:
+                    print(f"⚠️  Dropping chat row {item[1].get('id')} rejected by the database: {e}")
+
+    @staticmethod
+    def _add_rows(batch: List[tuple], db):
+        """Stage multi-row inserts, parents first; the caller commits"""
+        for table, model in TABLES.items():
+            rows = [row for t, row in batch if t == table]
+            if rows:
+                db.execute(insert(model), rows)
+
+    def _insert(self, batch: List[tuple], drop_rejected: bool = False):
+        """Insert a batch in one transaction
+
+        Connection problems propagate so the batch is retried. With `drop_rejected`,
+        rows the database refuses (e.g. their workflow was deleted meanwhile) are
+        dropped instead of blocking the buffer forever.
+        """
+        db = self.session_factory()
+        try:
+            try:
+                self._add_rows(batch, db)
+                db.commit()
+            except (IntegrityError, DataError):
+                db.rollback()
+                if not drop_rejected:
+                    raise
+                self._insert_one_by_one(db, batch)
+        finally:
+            db.close()
+
+    def _insert_one_by_one(self, db, batch: List[tuple]):
+        """Fallback when a batch is rejected: keep the good rows, drop the bad ones"""
+        for table, row in batch:
+            try:
+                db.execute(insert(TABLES[table]), [row])
+                db.commit()
+            except (IntegrityError, DataError) as e:
+                db.rollback()
+                print(f"⚠️  Dropping chat row {row.get('id')} rejected by the database: {e}")
+
+    # Write-ahead log
+
+    def _append_wal(self, table: str, row: Dict[str, Any]):
+        if self._wal is None:
+            return
+        self._wal.write(json.dumps({"table": table, "row": _encode(row)}) + "\n")
+        self._wal.flush()
+        if self.wal_fsync:
+            os.fsync(self._wal.fileno())
+
+    def _truncate_wal(self):
+        if self._wal is None or self._pending:
+            return
+        self._wal.seek(0)
+        self._wal.truncate()
+
+    def _replay_wal(self):
+        """Insert rows logged before a crash that never reached the database"""
+        if not os.path.exists(self.wal_path):
+            return
+        with open(self.wal_path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if not entries:
+            return
+
+        db = self.session_factory()
+        try:
+            batch = []
+            for entry in entries:
+                model = TABLES[entry["table"]]
+                row = _decode(entry["row"])
+                if db.get(model, uuid.UUID(row["id"])) is None:
+                    batch.append((entry["table"], row))
+        finally:
+            db.close()
+        if batch:
+            self._insert(batch, drop_rejected=True)
+            print(f"✅ Replayed {len(batch)} chat rows from {self.wal_path}")
+        open(self.wal_path, "w").close()
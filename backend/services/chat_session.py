@@ -0,0 +1,142 @@
+"""
+Chat sessions
+Per-connection state for WebSocket chat: compiled plan and conversation window
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Workflow
+from services.chat_recorder import ChatRecorder
+from services.tracing import ExecutionTrace, export_trace, source_id
+from services.workflow_analyzer import PlanCache, PlanStep, analyze_stored_workflow, apply_analysis, stored_plan_steps
+from services.workflow_executor import WorkflowExecutor
+
+
+def load_workflow(db: Session, workflow_id: Any) -> Optional[Workflow]:
+    """Load a workflow, compiling the plan of workflows saved before plans existed"""
+    workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
+    if workflow is not None and stored_plan_steps(workflow) is None:
+        apply_analysis(workflow, analyze_stored_workflow(workflow))
+        db.commit()
+    return workflow
+
+
+def open_session_workflow(workflow_id: Any, session_factory=SessionLocal) -> Optional[Workflow]:
+    """Load a workflow that outlives its DB session (chat sockets, batch evaluations)"""
+    db = session_factory()
+    try:
+        workflow = load_workflow(db, workflow_id)
+        if workflow is not None:
+            stored_plan_steps(workflow)  # loads the plan before the session is closed
+            db.expunge(workflow)
+        return workflow
+    finally:
+        db.close()
+
+
+async def save_trace(recorder: ChatRecorder, trace: ExecutionTrace, workflow_id: Any, message_id: Any):
+    """Record a finished or failed execution trace with a chat message and export it
+
+    A successful execution is recorded with its assistant message, a failed one with
+    the user message it failed to answer.
+    """
+    await recorder.record_trace(
+        chat_history_id=message_id,
+        workflow_id=workflow_id,
+        duration_ms=round(trace.duration_ms, 3),
+        spans=trace.compact_spans()
+    )
+    export_trace(trace, message_id=str(message_id))
+
+
+class ChatSession:
+    """Everything a chat needs between messages, kept for the lifetime of a socket
+
+    The plan is loaded once and only replaced when the plan cache reports a new digest
+    (the workflow was saved meanwhile). Repeated questions are answered from the
+    executor's retrieval cache, which also serves every other session.
+    """
+
+    def __init__(
+        self,
+        workflow: Workflow,
+        steps: List[PlanStep],
+        digest: str,
+        user_id: Any,
+        executor: WorkflowExecutor,
+        recorder: ChatRecorder,
+        plan_cache: PlanCache,
+        history_turns: int = None,
+        max_in_flight: int = None
+    ):
+        self.workflow = workflow
+        self.workflow_id = workflow.id
+        self.steps = steps
+        self.digest = digest
+        self.user_id = user_id
+        self.executor = executor
+        self.recorder = recorder
+        self.plan_cache = plan_cache
+        turns = history_turns or int(os.getenv("CHAT_SESSION_HISTORY_TURNS", "10"))
+        self.history: deque = deque(maxlen=2 * turns)
+        self.max_in_flight = max_in_flight or int(os.getenv("CHAT_SESSION_MAX_IN_FLIGHT", "4"))
+        self.in_flight: Dict[str, asyncio.Task] = {}
+
+    def refresh_plan(self):
+        """Adopt a plan saved since the session started"""
+        entry = self.plan_cache.get(self.workflow_id)
+        if entry is None or entry["digest"] == self.digest:
+            return
+        if not entry["is_valid"]:
+            raise ValueError("Workflow is not valid")
+        self.steps, self.digest = entry["steps"], entry["digest"]
+
+    async def ask(self, message: str, on_token: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """Answer one message; tokens are passed to `on_token` as they are generated"""
+        self.refresh_plan()
+        history = list(self.history)
+
+        user_message = await self.recorder.record_message(
+            workflow_id=self.workflow_id,
+            user_id=self.user_id,
+            message=message,
+            role="user"
+        )
+        trace = ExecutionTrace(str(self.workflow_id))
+        try:
+            result = await self.executor.execute(
+                workflow=self.workflow,
+                user_query=message,
+                trace=trace,
+                steps=self.steps,
+                history=history,
+                on_token=on_token
+            )
+        except Exception:
+            await save_trace(self.recorder, trace, self.workflow_id, user_message["id"])
+            raise
+
+        assistant_message = await self.recorder.record_message(
+            workflow_id=self.workflow_id,
+            user_id=self.user_id,
+            message=result["response"],
+            role="assistant"
+        )
+        await save_trace(self.recorder, trace, self.workflow_id, assistant_message["id"])
+        self.history.append({"role": "user", "content": message})
+        self.history.append({"role": "assistant", "content": result["response"]})
+        return {
+            "response": result["response"],
+            "sources": [source_id(meta) for meta in result.get("sources", [])],
+            "message_id": str(assistant_message["id"])
+        }
+
+    def close(self):
+        """Cancel running messages when the socket goes away"""
+        for task in self.in_flight.values():
+            task.cancel()
+        self.in_flight.clear()
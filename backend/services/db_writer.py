@@ -0,0 +1,123 @@
+"""
+Serialized database writer
+One writer thread per process that commits queued write jobs together (group commit)
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, SQLITE_PRODUCTION
+
+
+class WriteQueue:
+    """Runs write jobs of this process one transaction at a time on a single thread
+
+    A job is a `fn(db)` callable that stages changes without committing. Jobs waiting
+    together (up to `max_batch`) share one transaction and one commit; if it fails,
+    each job is retried in its own transaction so a bad job only fails itself. SQLite
+    allows a single writer anyway, so this turns lock contention into a queue.
+
+    Until `start()` is called, or when disabled, jobs run directly in a worker thread.
+    """
+
+    def __init__(self, enabled: bool = None, max_batch: int = None, session_factory=SessionLocal):
+        default = "true" if SQLITE_PRODUCTION else "false"
+        self.enabled = enabled if enabled is not None else (os.getenv("DB_WRITE_QUEUE") or default).lower() in ("1", "true", "yes")
+        self.max_batch = max_batch or int(os.getenv("DB_WRITE_BATCH", "64"))
+        self.session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.transactions = 0
+        self.jobs = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running or not self.enabled:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Run every queued job, then stop the writer"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def submit(self, job: Callable[[Session], Any]) -> Any:
+        """Run `job` in a committed transaction and return its result"""
+        if not self.running:
+            return await asyncio.to_thread(self._run_one, job)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            outcomes = await loop.run_in_executor(self._executor, self._run_batch, [job for job, _ in batch])
+            for (_, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue  # the caller went away
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _run_one(self, job: Callable[[Session], Any]) -> Any:
+        db = self.session_factory()
+        try:
+            result = job(db)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _outcome(self, job: Callable[[Session], Any]) -> Tuple[bool, Any]:
+        try:
+            return True, self._run_one(job)
+        except Exception as e:
+            return False, e
+        finally:
+            self.transactions += 1
+
+    def _run_batch(self, jobs: List[Callable[[Session], Any]]) -> List[Tuple[bool, Any]]:
+        self.jobs += len(jobs)
+        if len(jobs) == 1:
+            return [self._outcome(jobs[0])]
+        db = self.session_factory()
+        try:
+            results = [job(db) for job in jobs]
+            db.commit()
+            self.transactions += 1
+            return [(True, result) for result in results]
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+        return [self._outcome(job) for job in jobs]
@@ -2,7 +2,7 @@
 Document processing service
 Extract text from PDFs and other documents using PyMuPDF
 """
-import fitz  # PyMuPDF
+import os
 from typing import List
 
 class DocumentProcessor:
@@ -12,6 +12,8 @@ class DocumentProcessor:
     
     def extract_text(self, file_path: str) -> str:
         """Extract text from a PDF document"""
+        import fitz  # PyMuPDF, imported on first use to keep startup fast
+
         try:
             doc = fitz.open(file_path)
             text = ""
@@ -25,7 +27,10 @@ class DocumentProcessor:
     def chunk_text(self, text: str, chunk_size: int = None, chunk_overlap: int = None) -> List[str]:
         """Split text into overlapping chunks"""
         chunk_size = chunk_size or self.chunk_size
-        chunk_overlap = chunk_overlap or self.chunk_overlap
+        # 0 is a valid overlap, only None means "use the default"
+        chunk_overlap = self.chunk_overlap if chunk_overlap is None else chunk_overlap
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
         
         chunks = []
         start = 0
@@ -38,3 +43,21 @@ class DocumentProcessor:
             start += chunk_size - chunk_overlap
         
         return chunks
+
+
+def extract_chunks(file_path: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+    """Extract and chunk a document in one call (runs in worker processes during batch ingestion)"""
+    processor = DocumentProcessor(chunk_size, chunk_overlap)
+    return processor.chunk_text(processor.extract_text(file_path))
+
+
+def remove_uploads(paths: List[str]) -> int:
+    """Delete uploaded files that still exist; blocking, call it from a worker thread"""
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
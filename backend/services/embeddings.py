@@ -0,0 +1,263 @@
+"""
+Embedding providers
+OpenAI embeddings plus local CPU backends that run batched inference in a process pool
+"""
+import abc
+import asyncio
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_PROVIDER = "openai"
+PROVIDER_NAMES = ("openai", "local", "hashing")
+
+
+class EmbeddingProvider(abc.ABC):
+    """Turns texts into vectors; one vector store collection exists per provider"""
+
+    name = ""
+
+    @abc.abstractmethod
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, model: str = None, batch_size: int = None):
+        self.model = model or os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
+        self.batch_size = batch_size or int(os.getenv("OPENAI_EMBEDDING_BATCH", "100"))
+        self._client = None
+
+    def _get_client(self):
+        """Create the OpenAI client on first use and reuse its connection pool"""
+        if self._client is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY not configured")
+
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=api_key)
+        return self._client
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Create embeddings using OpenAI, many texts per request"""
+        client = self._get_client()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        responses = await asyncio.gather(*(
+            client.embeddings.create(model=self.model, input=batch) for batch in batches
+        ))
+        embeddings = []
+        for response in responses:
+            embeddings.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+        return embeddings
+
+
+# Local models. The functions below run inside pool worker processes.
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_worker_models: Dict[Tuple[str, str], object] = {}
+
+
+def hashing_embed(texts: List[str], dim: int) -> np.ndarray:
+    """Deterministic feature-hashing embedding (signed token and bigram buckets)"""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = _TOKEN_RE.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            out[row, value % dim] += 1.0 if (value >> 63) & 1 else -1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return out / norms
+
+
+def _load_model(kind: str, ref: str):
+    key = (kind, ref)
+    if key not in _worker_models:
+        if kind == "sentence-transformers":
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                raise RuntimeError("Local embeddings need `pip install sentence-transformers`")
+            _worker_models[key] = SentenceTransformer(ref, device="cpu")
+        else:
+            raise ValueError(f"Unknown local model kind: {kind}")
+    return _worker_models[key]
+
+
+def _embed_into_shared_memory(kind: str, ref: str, texts: List[str], shm_name: str,
+                              row_offset: int, total_rows: int, dim: int) -> int:
+    """Pool task: embed a batch and write it straight into the shared output array"""
+    from multiprocessing import shared_memory
+
+    if kind == "hashing":
+        vectors = hashing_embed(texts, dim)
+    else:
+        model = _load_model(kind, ref)
+        vectors = np.asarray(model.encode(texts, batch_size=len(texts), normalize_embeddings=True), dtype=np.float32)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        output = np.ndarray((total_rows, dim), dtype=np.float32, buffer=shm.buf)
+        output[row_offset:row_offset + len(texts)] = vectors
+        del output
+    finally:
+        shm.close()
+    return len(texts)
+
+
+def _model_dimension(kind: str, ref: str) -> int:
+    return int(_load_model(kind, ref).get_sentence_embedding_dimension())
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all local providers (spawned, safe with server threads)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+
+            workers = int(os.getenv("EMBEDDING_POOL_WORKERS", "0")) or max(1, (os.cpu_count() or 2) - 1)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+class PooledEmbeddingProvider(EmbeddingProvider):
+    """Runs batches in the process pool; results land in one shared-memory array"""
+
+    kind = ""
+
+    def __init__(self, ref: str, dim: Optional[int], batch_size: int = None, use_pool: bool = True):
+        self.ref = ref
+        self.dim = dim
+        self.batch_size = batch_size or int(os.getenv("LOCAL_EMBEDDING_BATCH", "64"))
+        self.use_pool = use_pool
+
+    async def dimension(self) -> int:
+        return self.dim
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if not self.use_pool:
+            return self._embed_inline(texts).tolist()
+
+        from multiprocessing import shared_memory
+
+        dim = await self.dimension()
+        loop = asyncio.get_running_loop()
+        pool = get_process_pool()
+        shm = shared_memory.SharedMemory(create=True, size=len(texts) * dim * 4)
+        try:
+            await asyncio.gather(*(
+                loop.run_in_executor(
+                    pool,
+                    _embed_into_shared_memory,
+                    self.kind,
+                    self.ref,
+                    texts[start:start + self.batch_size],
+                    shm.name,
+                    start,
+                    len(texts),
+                    dim,
+                )
+                for start in range(0, len(texts), self.batch_size)
+            ))
+            output = np.ndarray((len(texts), dim), dtype=np.float32, buffer=shm.buf)
+            result = output.tolist()
+            del output
+            return result
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @abc.abstractmethod
+    def _embed_inline(self, texts: List[str]) -> np.ndarray:
+        ...
+
+
+class HashingEmbeddingProvider(PooledEmbeddingProvider):
+    """Deterministic, dependency-free embedder for tests and air-gapped setups"""
+
+    name = "hashing"
+    kind = "hashing"
+
+    def __init__(self, dim: int = None, use_pool: bool = None):
+        dim = dim or int(os.getenv("HASHING_EMBEDDING_DIM", "384"))
+        if use_pool is None:
+            use_pool = os.getenv("HASHING_EMBEDDING_POOL", "false").lower() in ("1", "true", "yes")
+        super().__init__(ref=str(dim), dim=dim, use_pool=use_pool)
+
+    def _embed_inline(self, texts: List[str]) -> np.ndarray:
+        return hashing_embed(texts, self.dim)
+
+
+class LocalEmbeddingProvider(PooledEmbeddingProvider):
+    """Sentence-transformer style model loaded from a local path, run on CPU"""
+
+    name = "local"
+    kind = "sentence-transformers"
+
+    def __init__(self, model_path: str = None):
+        model_path = model_path or os.getenv("LOCAL_EMBEDDING_MODEL")
+        if not model_path:
+            raise ValueError("LOCAL_EMBEDDING_MODEL not configured")
+        # The dimension is asked of a pool worker on first use, not here: construction
+        # happens on the event loop (and under the provider lock) inside a request
+        super().__init__(ref=model_path, dim=None)
+        self._dim_lock = asyncio.Lock()
+
+    async def dimension(self) -> int:
+        """Model dimension from a pool worker, which keeps the model loaded afterwards"""
+        if self.dim is None:
+            async with self._dim_lock:
+                if self.dim is None:
+                    loop = asyncio.get_running_loop()
+                    self.dim = await loop.run_in_executor(get_process_pool(), _model_dimension, self.kind, self.ref)
+        return self.dim
+
+    def _embed_inline(self, texts: List[str]) -> np.ndarray:
+        model = _load_model(self.kind, self.ref)
+        return np.asarray(model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True), dtype=np.float32)
+
+
+_providers: Dict[str, EmbeddingProvider] = {}
+_providers_lock = threading.Lock()
+
+PROVIDER_CLASSES = {
+    "openai": OpenAIEmbeddingProvider,
+    "local": LocalEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider,
+}
+
+
+def get_embedding_provider(name: Optional[str] = None) -> EmbeddingProvider:
+    """Shared provider instance by name (defaults to EMBEDDING_PROVIDER)"""
+    name = name or os.getenv("EMBEDDING_PROVIDER", DEFAULT_PROVIDER)
+    if name not in PROVIDER_CLASSES:
+        raise ValueError(f"Unsupported embedding provider: {name}")
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = PROVIDER_CLASSES[name]()
+        return _providers[name]
@@ -0,0 +1,150 @@
+"""
+Orphan garbage collector
+Remove vector chunks and uploaded files that no Document row refers to
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Set
+
+from database import SessionLocal, Document
+from services.document_processor import remove_uploads
+from services.retrieval_cache import bump_corpus_version
+from services.vector_store import VectorStore
+
+
+class OrphanCollector:
+    """Reconcile the vector index and the upload directory with the documents table
+
+    Deletes run in batches of `batch_size` with `batch_delay_ms` between them so a
+    large cleanup does not starve live queries. Files younger than `min_file_age_s`
+    are skipped: an upload writes its file before the Document row is committed.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        upload_dir: str = None,
+        batch_size: int = None,
+        batch_delay_ms: float = None,
+        min_file_age_s: float = None,
+        session_factory=SessionLocal
+    ):
+        self.vector_store = vector_store
+        self.upload_dir = upload_dir or os.getenv("UPLOAD_DIR", "uploads")
+        self.batch_size = batch_size or int(os.getenv("GC_BATCH_SIZE", "100"))
+        self.batch_delay = (batch_delay_ms if batch_delay_ms is not None else float(os.getenv("GC_BATCH_DELAY_MS", "200"))) / 1000
+        self.min_file_age_s = min_file_age_s if min_file_age_s is not None else float(os.getenv("GC_MIN_FILE_AGE_S", "3600"))
+        self.session_factory = session_factory
+        self._lock = asyncio.Lock()
+
+    def _live_documents(self) -> Dict[str, str]:
+        """Document id -> absolute file path of every Document row"""
+        db = self.session_factory()
+        try:
+            return {
+                str(document_id): os.path.abspath(file_path)
+                for document_id, file_path in db.query(Document.id, Document.file_path)
+            }
+        finally:
+            db.close()
+
+    def _still_orphaned(self, document_ids: List[str]) -> List[str]:
+        """The ids that still have no Document row; one may have been added since the scan"""
+        row_ids = []
+        for document_id in document_ids:
+            try:
+                row_ids.append(uuid.UUID(document_id))
+            except ValueError:
+                continue  # not a document id a row could have
+        db = self.session_factory()
+        try:
+            existing = {str(row_id) for row_id, in db.query(Document.id).filter(Document.id.in_(row_ids))} if row_ids else set()
+        finally:
+            db.close()
+        return [document_id for document_id in document_ids if document_id not in existing]
+
+    def _bump_corpus_version(self):
+        db = self.session_factory()
+        try:
+            bump_corpus_version(db)
+            db.commit()
+        finally:
+            db.close()
+
+    def _orphan_files(self, live_paths: Set[str]) -> List[str]:
+        if not os.path.isdir(self.upload_dir):
+            return []
+        cutoff = time.time() - self.min_file_age_s
+        orphans = []
+        for entry in os.scandir(self.upload_dir):
+            if not entry.is_file() or os.path.abspath(entry.path) in live_paths:
+                continue
+            if entry.stat().st_mtime <= cutoff:
+                orphans.append(entry.path)
+        return sorted(orphans)
+
+    async def collect(self, dry_run: bool = True) -> Dict[str, Any]:
+        """Find orphans and, unless `dry_run`, delete them; returns a report"""
+        async with self._lock:
+            started = time.perf_counter()
+            # Index first: a document processed while the index is listed then has a row
+            # by the time the rows are read, so its new chunks are not taken for orphans
+            indexed = await self.vector_store.list_document_ids()
+            live = await asyncio.to_thread(self._live_documents)
+            orphan_documents = sorted(set(indexed) - set(live))
+            orphan_files = await asyncio.to_thread(self._orphan_files, set(live.values()))
+
+            report = {
+                "dry_run": dry_run,
+                "orphan_documents": len(orphan_documents),
+                "orphan_chunks": sum(indexed[d] for d in orphan_documents),
+                "orphan_files": len(orphan_files),
+                "deleted_chunks": 0,
+                "deleted_files": 0,
+                "sample_documents": orphan_documents[:20],
+                "sample_files": orphan_files[:20],
+            }
+            if not dry_run:
+                deleted_documents = 0
+                for batch in self._batches(orphan_documents):
+                    # Deletes are spread out over time; re-check the rows right before each batch
+                    batch = await asyncio.to_thread(self._still_orphaned, batch)
+                    if batch:
+                        await self.vector_store.delete_documents(batch)
+                        report["deleted_chunks"] += sum(indexed[d] for d in batch)
+                        deleted_documents += len(batch)
+                    await asyncio.sleep(self.batch_delay)
+                if deleted_documents:
+                    # Orphaned chunks were still returned by searches
+                    await asyncio.to_thread(self._bump_corpus_version)
+                for batch in self._batches(orphan_files):
+                    report["deleted_files"] += await asyncio.to_thread(remove_uploads, batch)
+                    await asyncio.sleep(self.batch_delay)
+
+            report["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            return report
+
+    def _batches(self, items: List[Any]):
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+
+
+async def run_periodically(get_collector: Callable[[], OrphanCollector], interval_s: float):
+    """Background loop started from the FastAPI lifespan
+
+    Takes a factory so the collector (and the vector store) is only built when the
+    first run is due, not at startup.
+    """
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            report = await get_collector().collect(dry_run=False)
+            if report["deleted_chunks"] or report["deleted_files"]:
+                print(
+                    f"🧹 Removed {report['deleted_chunks']} orphan chunks "
+                    f"and {report['deleted_files']} orphan files"
+                )
+        except Exception as e:
+            print(f"⚠️  Orphan collection failed: {e}")
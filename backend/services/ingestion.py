@@ -0,0 +1,354 @@
+"""
+Batch ingestion service
+Register many uploads at once and extract, embed and index them as a pipeline
+"""
+import asyncio
+import os
+import shutil
+import tarfile
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from database import SessionLocal, Document, IngestionJob, Workflow
+from services.document_processor import DocumentProcessor, extract_chunks
+from services.embeddings import get_process_pool
+from services.reindexer import requeue_document
+from services.retrieval_cache import bump_corpus_version
+from services.vector_store import VectorStore
+from services.workflow_analyzer import workflow_embedding_provider
+
+# Failures kept on the job row for the progress endpoint
+MAX_REPORTED_ERRORS = 20
+
+
+def _safe_filename(name: str) -> str:
+    """Base name of an upload or archive member, without any directory part"""
+    return os.path.basename(name.replace("\\", "/")).strip()
+
+
+def job_summary(job: IngestionJob) -> Dict[str, Any]:
+    return {
+        "id": str(job.id),
+        "workflow_id": str(job.workflow_id) if job.workflow_id else None,
+        "status": job.status,
+        "total_documents": job.total_documents,
+        "processed_documents": job.processed_documents,
+        "failed_documents": job.failed_documents,
+        "pending_documents": job.total_documents - job.processed_documents - job.failed_documents,
+        "chunks": job.chunks,
+        "errors": job.errors or [],
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class BatchIngestor:
+    """Two-stage pipeline: text extraction in the CPU process pool feeds embedding workers
+
+    A bounded queue between the stages keeps both busy without letting extracted text
+    pile up in memory. Progress is written to the ingestion_jobs row in batches, so any
+    worker can report it.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        document_processor: DocumentProcessor,
+        upload_dir: str = None,
+        extract_workers: int = None,
+        embed_concurrency: int = None,
+        flush_every: int = None,
+        session_factory=SessionLocal
+    ):
+        self.vector_store = vector_store
+        self.document_processor = document_processor
+        self.upload_dir = upload_dir or os.getenv("UPLOAD_DIR", "uploads")
+        self.extract_workers = extract_workers or int(os.getenv("INGEST_EXTRACT_WORKERS", "0")) or (os.cpu_count() or 2)
+        self.embed_concurrency = embed_concurrency or int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+        self.flush_every = flush_every or int(os.getenv("INGEST_FLUSH_EVERY", "20"))
+        self.max_files = int(os.getenv("INGEST_MAX_FILES", "10000"))
+        self.max_archive_bytes = int(os.getenv("INGEST_MAX_ARCHIVE_BYTES", str(4 * 1024 ** 3)))
+        self.archive_extensions = tuple(
+            ext.strip().lower() for ext in os.getenv("INGEST_ARCHIVE_EXTENSIONS", ".pdf").split(",") if ext.strip()
+        )
+        self.session_factory = session_factory
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    # Saving uploads
+
+    def _store(self, source: BinaryIO, filename: str, mime_type: Optional[str]) -> Dict[str, Any]:
+        """Copy a stream to the upload directory in fixed-size blocks"""
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # Prefixed so files from different batches never overwrite each other
+        file_path = os.path.join(self.upload_dir, f"{uuid.uuid4().hex}_{filename}")
+        with open(file_path, "wb") as out:
+            shutil.copyfileobj(source, out, 1024 * 1024)
+        return {
+            "filename": filename,
+            "file_path": file_path,
+            "file_size": os.path.getsize(file_path),
+            "mime_type": mime_type,
+        }
+
+    def save_files(self, files: List[Tuple[BinaryIO, str, Optional[str]]]) -> List[Dict[str, Any]]:
+        """Save (stream, filename, content type) uploads"""
+        if len(files) > self.max_files:
+            raise ValueError(f"At most {self.max_files} files per batch")
+        return [self._store(source, _safe_filename(name) or "upload", mime) for source, name, mime in files]
+
+    def _wanted(self, name: str) -> bool:
+        filename = _safe_filename(name)
+        if not filename or filename.startswith(".") or "__MACOSX" in name:
+            return False
+        return filename.lower().endswith(self.archive_extensions)
+
+    def save_archive(self, source: BinaryIO) -> List[Dict[str, Any]]:
+        """Unpack a zip or tar archive member by member, never holding one in memory"""
+        if zipfile.is_zipfile(source):
+            source.seek(0)
+            return self._save_zip(source)
+        source.seek(0)
+        try:
+            # Stream mode reads the tar (optionally compressed) sequentially
+            with tarfile.open(fileobj=source, mode="r|*") as archive:
+                return self._save_members(
+                    (member.name, member.size, lambda m=member: archive.extractfile(m))
+                    for member in archive if member.isfile()
+                )
+        except tarfile.TarError:
+            raise ValueError("Archive must be a zip or tar file")
+
+    def _save_zip(self, source: BinaryIO) -> List[Dict[str, Any]]:
+        with zipfile.ZipFile(source) as archive:
+            return self._save_members(
+                (info.filename, info.file_size, lambda i=info: archive.open(i))
+                for info in archive.infolist() if not info.is_dir()
+            )
+
+    def _save_members(self, members) -> List[Dict[str, Any]]:
+        saved, total_bytes = [], 0
+        try:
+            for name, size, open_member in members:
+                if not self._wanted(name):
+                    continue
+                total_bytes += size
+                if len(saved) >= self.max_files or total_bytes > self.max_archive_bytes:
+                    raise ValueError("Archive exceeds INGEST_MAX_FILES or INGEST_MAX_ARCHIVE_BYTES")
+                with open_member() as member:
+                    saved.append(self._store(member, _safe_filename(name), "application/pdf"))
+        except Exception:
+            self.discard(saved)
+            raise
+        return saved
+
+    @staticmethod
+    def discard(saved: List[Dict[str, Any]]):
+        """Remove files of a batch that could not be registered"""
+        for entry in saved:
+            try:
+                os.remove(entry["file_path"])
+            except FileNotFoundError:
+                pass
+
+    # Jobs
+
+    def register(self, saved: List[Dict[str, Any]], workflow_id, user_id) -> Dict[str, Any]:
+        """Insert the job and every Document row in one transaction"""
+        db = self.session_factory()
+        try:
+            job = IngestionJob(workflow_id=workflow_id, user_id=user_id, total_documents=len(saved))
+            documents = [Document(id=uuid.uuid4(), workflow_id=workflow_id, user_id=user_id, **entry) for entry in saved]
+            db.add(job)
+            db.add_all(documents)
+            db.commit()
+            return {
+                "job": job_summary(job),
+                "documents": [
+                    {"id": str(d.id), "filename": d.filename, "file_path": d.file_path} for d in documents
+                ],
+            }
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def get_job(self, job_id) -> Optional[Dict[str, Any]]:
+        db = self.session_factory()
+        try:
+            job = db.get(IngestionJob, uuid.UUID(str(job_id)))
+            return job_summary(job) if job else None
+        finally:
+            db.close()
+
+    def start(self, job_id: str, documents: List[Dict[str, Any]]):
+        self._tasks[job_id] = asyncio.create_task(self.run(job_id, documents), name=f"ingest:{job_id}")
+
+    async def stop(self):
+        """Cancel running jobs (called on shutdown); their documents stay unprocessed"""
+        for task in list(self._tasks.values()):
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._tasks.clear()
+
+    def _target(self, job_id) -> Tuple[Optional[str], Optional[str]]:
+        """(workflow id, embedding provider) of a job"""
+        db = self.session_factory()
+        try:
+            job = db.get(IngestionJob, uuid.UUID(str(job_id)))
+            workflow = db.get(Workflow, job.workflow_id) if job.workflow_id else None
+            return (str(workflow.id) if workflow else None), workflow_embedding_provider(workflow)
+        finally:
+            db.close()
+
+    async def run(self, job_id: str, documents: List[Dict[str, Any]]):
+        """Extract -> embed -> store every document of a job"""
+        progress = _Progress(self, job_id)
+        try:
+            await asyncio.to_thread(self._set_status, job_id, "running")
+            workflow_id, provider = await asyncio.to_thread(self._target, job_id)
+            loop = asyncio.get_running_loop()
+            pool = get_process_pool()
+            extract_slots = asyncio.Semaphore(self.extract_workers)
+            extracted: asyncio.Queue = asyncio.Queue(maxsize=self.embed_concurrency * 2)
+
+            async def extract(document):
+                async with extract_slots:
+                    try:
+                        chunks = await loop.run_in_executor(
+                            pool,
+                            extract_chunks,
+                            document["file_path"],
+                            self.document_processor.chunk_size,
+                            self.document_processor.chunk_overlap,
+                        )
+                    except Exception as e:
+                        await progress.failed(document, e)
+                        return
+                await extracted.put((document, chunks))
+
+            async def embed():
+                while True:
+                    item = await extracted.get()
+                    if item is None:
+                        return
+                    document, chunks = item
+                    try:
+                        embeddings = await self.vector_store.create_embeddings(chunks, provider)
+                        await self.vector_store.store_embeddings(
+                            document["id"], chunks, embeddings, provider, workflow_id=workflow_id
+                        )
+                        await progress.done(document, len(chunks))
+                    except Exception as e:
+                        # Do not leave partial embeddings of a failed document in the index
+                        try:
+                            await self.vector_store.delete_document(document["id"])
+                        except Exception as cleanup_error:
+                            print(f"⚠️  Could not remove partial chunks of document {document['id']}: {cleanup_error}")
+                        await progress.failed(document, e)
+
+            async def produce():
+                await asyncio.gather(*(extract(document) for document in documents))
+                for _ in embedders:
+                    await extracted.put(None)
+
+            embedders = [asyncio.create_task(embed()) for _ in range(self.embed_concurrency)]
+            producer = asyncio.create_task(produce())
+            try:
+                # Awaited together: should every embedder die, the job fails instead of
+                # extraction waiting forever on the full queue
+                await asyncio.gather(producer, *embedders)
+            finally:
+                for task in [producer, *embedders]:
+                    task.cancel()
+            await progress.flush()
+            await asyncio.to_thread(self._set_status, job_id, "completed", finished=True)
+            print(f"✅ Ingested {progress.processed} documents ({progress.failed_count} failed) for job {job_id}")
+        except asyncio.CancelledError:
+            await progress.flush()
+            await asyncio.to_thread(self._set_status, job_id, "failed", finished=True, error="Interrupted")
+            raise
+        except Exception as e:
+            await progress.flush()
+            await asyncio.to_thread(self._set_status, job_id, "failed", finished=True, error=str(e))
+            print(f"⚠️  Ingestion job {job_id} failed: {e}")
+        finally:
+            self._tasks.pop(job_id, None)
+
+    def _set_status(self, job_id, status: str, finished: bool = False, error: str = None):
+        db = self.session_factory()
+        try:
+            job = db.get(IngestionJob, uuid.UUID(str(job_id)))
+            job.status = status
+            if finished:
+                job.finished_at = datetime.utcnow()
+            if error:
+                job.errors = (job.errors or []) + [{"document_id": None, "filename": None, "error": error}]
+            db.commit()
+        finally:
+            db.close()
+
+
+class _Progress:
+    """Collects per-document results and writes them to the database in batches"""
+
+    def __init__(self, ingestor: BatchIngestor, job_id: str):
+        self.ingestor = ingestor
+        self.job_id = job_id
+        self.processed = 0
+        self.failed_count = 0
+        self._done: List[Tuple[str, int]] = []
+        self._failed: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def done(self, document: Dict[str, Any], chunks: int):
+        self.processed += 1
+        self._done.append((document["id"], chunks))
+        await self._maybe_flush()
+
+    async def failed(self, document: Dict[str, Any], error: Exception):
+        self.failed_count += 1
+        self._failed.append({"document_id": document["id"], "filename": document["filename"], "error": str(error)})
+        await self._maybe_flush()
+
+    async def _maybe_flush(self):
+        if len(self._done) + len(self._failed) >= self.ingestor.flush_every or time.monotonic() - self._last_flush > 2:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            done, failed = self._done, self._failed
+            self._done, self._failed = [], []
+            self._last_flush = time.monotonic()
+            if done or failed:
+                await asyncio.to_thread(self._write, done, failed)
+
+    def _write(self, done: List[Tuple[str, int]], failed: List[Dict[str, Any]]):
+        db = self.ingestor.session_factory()
+        try:
+            for document_id, chunks in done:
+                db.query(Document).filter(Document.id == uuid.UUID(document_id)).update(
+                    {"processed": True, "embedding_count": chunks}
+                )
+            job = db.get(IngestionJob, uuid.UUID(str(self.job_id)))
+            job.processed_documents += len(done)
+            job.failed_documents += len(failed)
+            job.chunks += sum(chunks for _, chunks in done)
+            errors = job.errors or []
+            job.errors = errors + failed[:max(0, MAX_REPORTED_ERRORS - len(errors))]
+            if done:
+                bump_corpus_version(db)
+            db.commit()
+            # A reindex in progress must rebuild these documents too
+            for document_id, _ in done:
+                requeue_document(db, uuid.UUID(document_id))
+        finally:
+            db.close()
@@ -2,15 +2,28 @@
 LLM service for interacting with OpenAI, Gemini, and other providers
 """
 import os
-from typing import List, Optional, Dict, Any
-from openai import AsyncOpenAI
+from typing import AsyncIterator, List, Optional, Dict, Any
+
+from services.prompt_builder import build_messages, usage_counts
 # import google.generativeai as genai  # Uncomment when using Gemini
 
 class LLMService:
     def __init__(self):
         self.openai_key = os.getenv("OPENAI_API_KEY")
         self.gemini_key = os.getenv("GEMINI_API_KEY")
-        self.openai_client = AsyncOpenAI(api_key=self.openai_key) if self.openai_key else None
+        self._openai_client = None
+        self.in_flight = 0  # provider calls currently awaited, read by the load shedder
+        # Prompt tokens sent, and how many of them the provider served from its prefix cache
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def openai_client(self):
+        """OpenAI client, created on first use so importing the service stays cheap"""
+        if self._openai_client is None and self.openai_key:
+            from openai import AsyncOpenAI
+            self._openai_client = AsyncOpenAI(api_key=self.openai_key)
+        return self._openai_client
     
     async def generate(
         self,
@@ -19,20 +32,88 @@ class LLMService:
         temperature: float = 0.7,
         max_tokens: int = 1000,
         system_prompt: Optional[str] = None,
-        context: Optional[List[str]] = None
+        context: Optional[List[str]] = None,
+        history: Optional[List[Dict[str, str]]] = None
     ) -> Dict[str, Any]:
         """Generate a response from an LLM"""
         
         if model.startswith("gpt"):
-            return await self._generate_openai(
-                prompt, model, temperature, max_tokens, system_prompt, context
+            call = self._generate_openai(
+                prompt, model, temperature, max_tokens, system_prompt, context, history
             )
         elif model.startswith("gemini"):
-            return await self._generate_gemini(
+            call = self._generate_gemini(
                 prompt, model, temperature, max_tokens, system_prompt, context
             )
         else:
             raise ValueError(f"Unsupported model: {model}")
+        
+        self.in_flight += 1
+        try:
+            return await call
+        finally:
+            self.in_flight -= 1
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        model: str = "gpt-4",
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        system_prompt: Optional[str] = None,
+        context: Optional[List[str]] = None,
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a response: yields {"delta": text} items, then the same result dict as generate"""
+        if not model.startswith("gpt"):
+            # Providers without streaming answer in one piece
+            result = await self.generate(prompt, model, temperature, max_tokens, system_prompt, context, history)
+            yield {"delta": result["response"]}
+            yield result
+            return
+        if not self.openai_client:
+            raise ValueError("OpenAI API key not configured")
+        
+        parts, usage = [], None
+        self.in_flight += 1
+        try:
+            stream = await self.openai_client.chat.completions.create(
+                model=model,
+                messages=build_messages(prompt, system_prompt, context, history),
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                # The final chunk then carries the usage block; the installed client predates the argument
+                extra_body={"stream_options": {"include_usage": True}}
+            )
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield {"delta": delta}
+        finally:
+            self.in_flight -= 1
+        
+        counts = self._record_usage(usage)
+        if usage is None:
+            # No usage block from this provider; each content chunk is one token
+            counts["tokens_used"] = len(parts)
+        yield {"response": "".join(parts), "model": model, **counts}
+    
+    def _record_usage(self, usage: Any) -> Dict[str, int]:
+        counts = usage_counts(usage)
+        self.prompt_tokens += counts["prompt_tokens"]
+        self.cached_tokens += counts["cached_tokens"]
+        return counts
+    
+    def usage_stats(self) -> Dict[str, Any]:
+        """Prompt tokens so far and the share the provider's prefix cache served"""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0
+        }
     
     async def _generate_openai(
         self,
@@ -41,25 +122,14 @@ class LLMService:
         temperature: float,
         max_tokens: int,
         system_prompt: Optional[str],
-        context: Optional[List[str]]
+        context: Optional[List[str]],
+        history: Optional[List[Dict[str, str]]] = None
     ) -> Dict[str, Any]:
         """Generate response using OpenAI"""
         if not self.openai_client:
             raise ValueError("OpenAI API key not configured")
         
-        messages = []
-        
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        
-        if context:
-            context_text = "\n\n".join(context)
-            messages.append({
-                "role": "system",
-                "content": f"Context:\n{context_text}"
-            })
-        
-        messages.append({"role": "user", "content": prompt})
+        messages = build_messages(prompt, system_prompt, context, history)
         
         response = await self.openai_client.chat.completions.create(
             model=model,
@@ -71,7 +141,7 @@ class LLMService:
         return {
             "response": response.choices[0].message.content,
             "model": model,
-            "tokens_used": response.usage.total_tokens
+            **self._record_usage(response.usage)
         }
     
     async def _generate_gemini(
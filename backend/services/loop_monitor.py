@@ -0,0 +1,157 @@
+"""
+Event loop monitor
+Measure event-loop lag, find the call sites that block the loop, decide when to shed load
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _site(frame) -> str:
+    return f"{os.path.relpath(frame.f_code.co_filename, BACKEND_DIR)}:{frame.f_lineno} {frame.f_code.co_name}"
+
+
+def blocking_call_site(frame) -> Tuple[str, str]:
+    """(innermost backend frame, innermost frame) of a stack, e.g. the route and the library call"""
+    leaf = _site(frame)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(BACKEND_DIR) and "site-packages" not in filename:
+            return _site(frame), leaf
+        frame = frame.f_back
+    return leaf, leaf
+
+
+class LoopMonitor:
+    """Samples how late a periodic timer fires on the event loop
+
+    `lag_ms` is the worst lag of the last `window` samples. With `debug`, a watchdog
+    thread samples the loop thread's stack while it is blocked for more than
+    `block_report_ms` and attributes the blocked time to the call site.
+    """
+
+    def __init__(
+        self,
+        interval_ms: float = None,
+        window: int = 10,
+        lag_threshold_ms: float = None,
+        llm_threshold: int = None,
+        llm_in_flight: Callable[[], int] = lambda: 0,
+        debug: bool = None,
+        block_report_ms: float = None
+    ):
+        self.interval = (interval_ms or float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"))) / 1000
+        self.lag_threshold_ms = lag_threshold_ms if lag_threshold_ms is not None else float(os.getenv("LOAD_SHED_LAG_MS", "200"))
+        self.llm_threshold = llm_threshold if llm_threshold is not None else int(os.getenv("LOAD_SHED_LLM_IN_FLIGHT", "32"))
+        self.llm_in_flight = llm_in_flight
+        self.debug = debug if debug is not None else os.getenv("LOOP_MONITOR_DEBUG", "false").lower() in ("1", "true", "yes")
+        self.block_report = (block_report_ms if block_report_ms is not None else float(os.getenv("LOOP_BLOCK_REPORT_MS", "100"))) / 1000
+        self._samples: deque = deque(maxlen=window)
+        self.max_lag_ms = 0.0
+        self.shed = 0
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._sites_lock = threading.Lock()
+        self._blocked_ms: Counter = Counter()
+        self._blocked_samples: Counter = Counter()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def lag_ms(self) -> float:
+        return max(self._samples, default=0.0)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopped.clear()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._task = asyncio.create_task(self._run())
+        if self.debug:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max(0.0, (now - expected) * 1000)
+            self._samples.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            self._heartbeat = now
+
+    def _watch(self):
+        """Watchdog thread: attribute blocked time to the loop thread's current frame"""
+        tick = min(self.interval, self.block_report) / 2
+        reported = False
+        while not self._stopped.wait(tick):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < self.block_report:
+                reported = False
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            site = blocking_call_site(frame)
+            with self._sites_lock:
+                self._blocked_ms[site] += tick * 1000
+                self._blocked_samples[site] += 1
+            if not reported:
+                reported = True
+                print(f"⚠️  Event loop blocked for {blocked * 1000:.0f} ms at {site[0]} ({site[1]})")
+
+    def slowest_call_sites(self, limit: int = 10) -> List[Dict[str, Any]]:
+        with self._sites_lock:
+            top = self._blocked_ms.most_common(limit)
+            return [
+                {"site": site, "leaf": leaf, "blocked_ms": round(ms, 1), "samples": self._blocked_samples[(site, leaf)]}
+                for (site, leaf), ms in top
+            ]
+
+    def overload_reason(self) -> Optional[str]:
+        """Why low-priority requests should be shed right now, or None"""
+        if self.lag_threshold_ms and self.lag_ms > self.lag_threshold_ms:
+            return f"event loop lag {self.lag_ms:.0f} ms"
+        if self.llm_threshold and self.llm_in_flight() >= self.llm_threshold:
+            return f"{self.llm_in_flight()} LLM calls in flight"
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "debug": self.debug,
+            "lag_ms": round(self.lag_ms, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "lag_threshold_ms": self.lag_threshold_ms,
+            "llm_in_flight": self.llm_in_flight(),
+            "llm_threshold": self.llm_threshold,
+            "overloaded": self.overload_reason(),
+            "shed_requests": self.shed,
+            "slowest_call_sites": self.slowest_call_sites()
+        }
@@ -0,0 +1,182 @@
+"""
+On-demand profiler
+Wall-clock stack sampling to collapsed stacks and tracemalloc allocation summaries, on a live worker
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from services.loop_monitor import BACKEND_DIR
+
+PROFILE_MODES = ("cpu", "alloc")
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(BACKEND_DIR) and "site-packages" not in filename:
+        return os.path.relpath(filename, BACKEND_DIR)
+    for marker in ("site-packages" + os.sep, "lib" + os.sep + "python"):
+        index = filename.rfind(marker)
+        if index >= 0:
+            return filename[index + len(marker):]
+    return filename
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed format: one `root;...;leaf count` line per stack"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class StackSampler:
+    """Background thread that records the stack of every other thread each `interval`"""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval_s):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+
+def allocation_summary(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int) -> List[Dict[str, Any]]:
+    """Largest allocation growth by source line between two snapshots"""
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    return [
+        {
+            "site": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+            "size_diff_kib": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff,
+            "size_kib": round(stat.size / 1024, 1)
+        }
+        for stat in stats[:top]
+    ]
+
+
+class Profiler:
+    """Timed whole-process profiles and per-request profiles kept for later retrieval
+
+    Sampling is wall-clock: threads waiting on I/O or locks are sampled too, which is
+    what shows a blocked event loop. Allocation tracing is process-wide, so concurrent
+    requests contribute to a profiled request's summary.
+    """
+
+    def __init__(self, interval_ms: float = None, max_seconds: float = None, keep: int = None, top: int = None):
+        self.interval_s = (interval_ms or float(os.getenv("PROFILE_INTERVAL_MS", "5"))) / 1000
+        self.max_seconds = max_seconds or float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+        self.keep = keep or int(os.getenv("PROFILE_KEEP_REQUESTS", "20"))
+        self.top = top or int(os.getenv("PROFILE_ALLOC_TOP", "25"))
+        self._timed_lock = asyncio.Lock()
+        self._tracing_requests = 0
+        self._started_tracing = False
+        self._requests: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    async def profile(self, seconds: float, interval_ms: Optional[float] = None) -> Dict[str, Any]:
+        """Sample every thread for `seconds`; one timed profile runs at a time"""
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be in (0, {self.max_seconds:g}]")
+        if self._timed_lock.locked():
+            raise RuntimeError("A profile is already running")
+        async with self._timed_lock:
+            sampler = StackSampler(interval_ms / 1000 if interval_ms else self.interval_s)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stacks = await asyncio.to_thread(sampler.stop)
+            return {"samples": sampler.samples, "collapsed": collapse(stacks)}
+
+    def _start_tracing(self):
+        if self._tracing_requests == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.getenv("PROFILE_ALLOC_FRAMES", "1")))
+            self._started_tracing = True
+        self._tracing_requests += 1
+
+    def _stop_tracing(self):
+        self._tracing_requests -= 1
+        if self._tracing_requests == 0 and self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @asynccontextmanager
+    async def profile_request(self, modes: List[str], method: str, path: str):
+        """Profile the body of the `async with`; the record is stored under its id"""
+        record = {
+            "id": uuid.uuid4().hex,
+            "method": method,
+            "path": path,
+            "modes": modes,
+            "started_at": datetime.utcnow().isoformat()
+        }
+        sampler = StackSampler(self.interval_s) if "cpu" in modes else None
+        before = None
+        if "alloc" in modes:
+            self._start_tracing()
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        if sampler is not None:
+            sampler.start()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            if sampler is not None:
+                record["samples"] = sampler.samples
+                record["collapsed"] = collapse(await asyncio.to_thread(sampler.stop))
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                record["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+                record["allocations"] = allocation_summary(before, after, self.top)
+                self._stop_tracing()
+            self._requests[record["id"]] = record
+            while len(self._requests) > self.keep:
+                self._requests.popitem(last=False)
+
+    def request_profiles(self) -> List[Dict[str, Any]]:
+        return [
+            {key: record[key] for key in ("id", "method", "path", "modes", "started_at", "duration_ms")}
+            for record in reversed(self._requests.values())
+        ]
+
+    def request_profile(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self._requests.get(profile_id)
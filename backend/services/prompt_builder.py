@@ -0,0 +1,56 @@
+"""
+Prompt assembly
+Static parts first as a byte-identical prefix, per-request retrieved context last, for provider prefix caching
+"""
+from typing import Any, Dict, List, Optional
+
+
+def normalize(text: str) -> str:
+    """Same text, same bytes: unified newlines, no trailing whitespace"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def build_messages(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    context: Optional[List[str]] = None,
+    history: Optional[List[Dict[str, str]]] = None
+) -> List[Dict[str, str]]:
+    """Chat messages laid out for prefix caching
+
+    1. one system message: the system prompt
+    2. earlier turns, oldest first; a conversation only appends, so its prefix keeps growing
+    3. the user message: retrieved context, then the question
+
+    Everything before the last message is the same for every request of a workflow
+    (and conversation), so the provider can serve it from its prefix cache.
+    """
+    system = normalize(system_prompt or "")
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.extend(history or [])
+
+    if context:
+        # Retrieval may return the same chunk twice (several providers, overlapping chunks)
+        context_text = "\n\n".join(normalize(chunk) for chunk in dict.fromkeys(context))
+        content = f"Context:\n{context_text}\n\nQuestion:\n{prompt}"
+    else:
+        content = prompt
+    messages.append({"role": "user", "content": content})
+    return messages
+
+
+def _field(value: Any, name: str) -> Any:
+    # The client returns fields it does not model as plain dicts
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def usage_counts(usage: Any) -> Dict[str, int]:
+    """Token counts of a usage block, including prompt tokens served from the provider's cache"""
+    return {
+        "tokens_used": _field(usage, "total_tokens") or 0,
+        "prompt_tokens": _field(usage, "prompt_tokens") or 0,
+        "cached_tokens": _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+    }
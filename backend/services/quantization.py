@@ -0,0 +1,438 @@
+"""
+Quantized vector collections
+Compressed in-memory codes (int8 or product quantization) with full-precision re-scoring
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+QUANTIZATION_MODES = ("none", "int8", "pq")
+
+# Rows scored per block so approximate search never materializes N x dim floats
+SCORE_BLOCK = 8192
+
+
+def parse_quantization(spec: str) -> Dict[str, str]:
+    """Parse VECTOR_QUANTIZATION: "int8" for every collection or "documents=pq,documents__local=int8" """
+    modes: Dict[str, str] = {}
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, mode = entry.rpartition("=")
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported vector quantization: {mode}")
+        modes[name or "*"] = mode
+    return modes
+
+
+def quantization_for(modes: Dict[str, str], collection_name: str) -> str:
+    # Settings apply to every index version: "documents_v3__local" uses "documents__local"
+    name = re.sub(r"_v\d+(?=__|$)", "", collection_name)
+    return modes.get(name, modes.get("*", "none"))
+
+
+class ScalarQuantizer:
+    """Per-dimension int8 scalar quantization (4x smaller than float32)"""
+
+    kind = "int8"
+
+    def __init__(self, low: np.ndarray = None, scale: np.ndarray = None):
+        self.low = low
+        self.scale = scale
+
+    def fit(self, sample: np.ndarray):
+        self.low = sample.min(axis=0)
+        scale = (sample.max(axis=0) - self.low) / 255
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+
+    @property
+    def code_size(self) -> int:
+        return len(self.low)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        # Values outside the trained range are clipped
+        codes = np.rint((vectors - self.low) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) + 128) * self.scale + self.low
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Shortlist score: negative inner product with the decoded vectors
+
+        Embeddings are unit length, so this ranks like L2 distance; the terms that are
+        constant per query are dropped and the shortlist is re-scored exactly.
+        """
+        weights = query * self.scale
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK):
+            out[start:start + SCORE_BLOCK] = -(codes[start:start + SCORE_BLOCK].astype(np.float32) @ weights)
+        return out
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "scale": self.scale}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ScalarQuantizer":
+        return cls(state["low"], state["scale"])
+
+
+class ProductQuantizer:
+    """Product quantization: one byte per sub-vector, asymmetric distance lookup at query time"""
+
+    kind = "pq"
+
+    def __init__(self, subvectors: int = None, iterations: int = 20, centroids: np.ndarray = None):
+        self.subvectors = subvectors or int(os.getenv("PQ_SUBVECTORS", "96"))
+        self.iterations = iterations
+        self.centroids = centroids  # (subvectors, ks, sub_dim)
+
+    @property
+    def code_size(self) -> int:
+        return self.subvectors
+
+    def fit(self, sample: np.ndarray):
+        dim = sample.shape[1]
+        # Use the largest sub-vector count that divides the dimension
+        while dim % self.subvectors:
+            self.subvectors -= 1
+        sub_dim = dim // self.subvectors
+        ks = min(256, len(sample))
+        rng = np.random.default_rng(0)
+        centroids = np.empty((self.subvectors, ks, sub_dim), dtype=np.float32)
+        for j in range(self.subvectors):
+            centroids[j] = self._kmeans(sample[:, j * sub_dim:(j + 1) * sub_dim], ks, rng)
+        self.centroids = centroids
+
+    def _kmeans(self, data: np.ndarray, ks: int, rng) -> np.ndarray:
+        centroids = data[rng.choice(len(data), ks, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self._nearest(data, centroids)
+            sums = np.stack([np.bincount(assignment, weights=column, minlength=ks) for column in data.T], axis=1)
+            counts = np.bincount(assignment, minlength=ks)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        scores = (centroids ** 2).sum(axis=1) - 2 * data @ centroids.T
+        return scores.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub_dim = self.centroids.shape[2]
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for j in range(self.subvectors):
+            codes[:, j] = self._nearest(vectors[:, j * sub_dim:(j + 1) * sub_dim], self.centroids[j])
+        return codes
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distance computation with a per-query lookup table"""
+        sub_dim = self.centroids.shape[2]
+        table = ((self.centroids - query.reshape(self.subvectors, 1, sub_dim)) ** 2).sum(axis=2)
+        out = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.subvectors):
+            out += table[j][codes[:, j]]
+        return out
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ProductQuantizer":
+        centroids = state["centroids"]
+        return cls(subvectors=centroids.shape[0], centroids=centroids)
+
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+
+
+class _GrowableArray:
+    """Row-appendable numpy array with amortized O(1) appends"""
+
+    def __init__(self, initial: np.ndarray):
+        self._buffer = initial
+        self.size = len(initial)
+
+    def append(self, rows: np.ndarray):
+        needed = self.size + len(rows)
+        if needed > len(self._buffer):
+            grown = np.empty((max(needed, 2 * len(self._buffer), 1024),) + self._buffer.shape[1:], self._buffer.dtype)
+            grown[:self.size] = self._buffer[:self.size]
+            self._buffer = grown
+        self._buffer[self.size:needed] = rows
+        self.size = needed
+
+    @property
+    def view(self) -> np.ndarray:
+        return self._buffer[:self.size]
+
+
+class QuantizedCollection:
+    """Drop-in for the subset of the Chroma collection API that VectorStore uses
+
+    Only the compressed codes live in memory. Full-precision vectors are appended to a
+    memory-mapped file and read back for the top `rerank_factor * n_results` candidates;
+    texts and metadata are kept in SQLite. Until `train_size` vectors exist the codec is
+    untrained and search is exact. Deletes are tombstones; a reindex compacts them.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        name: str,
+        mode: str,
+        train_size: int = None,
+        rerank_factor: int = None
+    ):
+        if mode not in QUANTIZERS:
+            raise ValueError(f"Unsupported vector quantization: {mode}")
+        self.directory = directory
+        self.name = name
+        self.mode = mode
+        self.train_size = train_size or int(os.getenv("QUANT_TRAIN_SIZE", "10000"))
+        self.rerank_factor = rerank_factor or int(os.getenv("QUANT_RERANK_FACTOR", "10"))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(directory, "rows.sqlite"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                document_id TEXT,
+                text TEXT,
+                metadata TEXT,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS rows_document_id ON rows (document_id);
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._codes_path = os.path.join(directory, "codes.bin")
+        self._quantizer_path = os.path.join(directory, "quantizer.npz")
+        self.dim: Optional[int] = self._setting("dim", int)
+        self.quantizer = self._load_quantizer()
+        self._rows = self._db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+        # SQLite is the record of which rows exist; an add that failed before its commit
+        # may have left bytes behind that would shift every later row's offset
+        self._truncate_files(self._rows)
+        alive = np.zeros(self._rows, dtype=bool)
+        for (row,) in self._db.execute("SELECT row FROM rows WHERE deleted = 0"):
+            alive[row] = True
+        self._alive = _GrowableArray(alive)
+        codes = self._load_codes()
+        self._codes = _GrowableArray(codes) if codes is not None else None
+
+    # Storage
+
+    def _setting(self, key: str, cast=str):
+        found = self._db.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return cast(found[0]) if found else None
+
+    def _load_quantizer(self):
+        if not os.path.exists(self._quantizer_path):
+            return None
+        with np.load(self._quantizer_path) as state:
+            return QUANTIZERS[self.mode].from_state(dict(state))
+
+    def _load_codes(self) -> Optional[np.ndarray]:
+        if self.quantizer is None:
+            return None
+        dtype = np.int8 if self.mode == "int8" else np.uint8
+        codes = np.fromfile(self._codes_path, dtype=dtype) if os.path.exists(self._codes_path) else np.empty(0, dtype)
+        return codes.reshape(-1, self.quantizer.code_size)
+
+    def _truncate_files(self, rows: int):
+        """Cut the vector and code files back to `rows` rows"""
+        sizes = [(self._vectors_path, rows * (self.dim or 0) * 4)]
+        if self.quantizer is not None:
+            sizes.append((self._codes_path, rows * self.quantizer.code_size))
+        for path, size in sizes:
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _vectors(self) -> np.ndarray:
+        if not self._rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+
+    def memory_bytes(self) -> int:
+        """Resident size of the search structures (codes and the live-row mask)"""
+        codes = self._codes.view.nbytes if self._codes is not None else 0
+        return codes + self._alive.view.nbytes
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # Chroma-compatible API
+
+    def count(self) -> int:
+        return int(self._alive.view.sum())
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            new_dim = self.dim is None
+            if new_dim:
+                self.dim = vectors.shape[1]
+                self._db.execute("INSERT INTO settings (key, value) VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimension {self.dim}")
+
+            # Like Chroma, ignore ids that already exist; a deleted id can be added again
+            placeholders = ",".join("?" * len(ids))
+            existing = {
+                row_id for (row_id,) in
+                self._db.execute(f"SELECT id FROM rows WHERE deleted = 0 AND id IN ({placeholders})", list(ids))
+            }
+            keep = [i for i, row_id in enumerate(ids) if row_id not in existing]
+            if not keep:
+                self._db.commit()
+                return
+            vectors = vectors[keep]
+            first = self._rows
+
+            codes = None
+            try:
+                # The new row goes at the end; the tombstone's row stays a dead gap
+                self._db.execute(f"DELETE FROM rows WHERE deleted = 1 AND id IN ({placeholders})", list(ids))
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                if self.quantizer is not None:
+                    codes = self.quantizer.encode(vectors)
+                    with open(self._codes_path, "ab") as f:
+                        f.write(codes.tobytes())
+                self._db.executemany(
+                    "INSERT INTO rows (row, id, document_id, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (first + n, ids[i], (metadatas[i] or {}).get("document_id"), documents[i], json.dumps(metadatas[i]))
+                        for n, i in enumerate(keep)
+                    ]
+                )
+                self._db.commit()
+            except BaseException:
+                # Nothing of this add may stay behind: later rows are placed by offset
+                self._db.rollback()
+                self._truncate_files(first)
+                if new_dim:
+                    self.dim = None
+                raise
+            if codes is not None:
+                self._codes.append(codes)
+            self._rows += len(keep)
+            self._alive.append(np.ones(len(keep), dtype=bool))
+
+            if self.quantizer is None and self.count() >= self.train_size:
+                self._train()
+
+    def _train(self):
+        """Fit the codec on a sample of live vectors and encode every stored row"""
+        vectors = self._vectors()
+        live = np.flatnonzero(self._alive.view)
+        sample_rows = np.random.default_rng(0).choice(live, min(len(live), self.train_size), replace=False)
+        quantizer = QUANTIZERS[self.mode]()
+        quantizer.fit(np.asarray(vectors[np.sort(sample_rows)]))
+
+        dtype = np.int8 if self.mode == "int8" else np.uint8
+        codes = np.empty((self._rows, quantizer.code_size), dtype=dtype)
+        for start in range(0, self._rows, SCORE_BLOCK):
+            codes[start:start + SCORE_BLOCK] = quantizer.encode(np.asarray(vectors[start:start + SCORE_BLOCK]))
+        codes.tofile(self._codes_path)
+        np.savez(self._quantizer_path, **quantizer.state())
+        self.quantizer = quantizer
+        self._codes = _GrowableArray(codes)
+        print(f"✅ Trained {self.mode} quantizer for collection '{self.name}' on {len(sample_rows)} vectors")
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, **_) -> Dict[str, List[List[Any]]]:
+        with self._lock:
+            vectors = self._vectors()
+            alive = self._alive.view
+            codes = self._codes.view if self._codes is not None else None
+            quantizer = self.quantizer
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query in np.asarray(query_embeddings, dtype=np.float32):
+            rows, distances = self._search(query, n_results, vectors, alive, codes, quantizer)
+            entries = self._fetch(rows)
+            result["ids"].append([entries[row][0] for row in rows])
+            result["documents"].append([entries[row][1] for row in rows])
+            result["metadatas"].append([entries[row][2] for row in rows])
+            result["distances"].append([float(d) for d in distances])
+        return result
+
+    def _search(self, query, n_results, vectors, alive, codes, quantizer):
+        live = np.flatnonzero(alive)
+        if not len(live):
+            return [], []
+        if quantizer is None:
+            candidates = live
+        else:
+            approx = quantizer.distances(query, codes)
+            approx[~alive] = np.inf
+            shortlist = min(len(live), n_results * self.rerank_factor)
+            candidates = np.argpartition(approx, shortlist - 1)[:shortlist]
+
+        # Re-score the candidates with the full-precision vectors
+        exact = np.empty(len(candidates), dtype=np.float32)
+        order = np.argsort(candidates)
+        for start in range(0, len(candidates), SCORE_BLOCK):
+            block = candidates[order[start:start + SCORE_BLOCK]]
+            exact[order[start:start + SCORE_BLOCK]] = ((np.asarray(vectors[block]) - query) ** 2).sum(axis=1)
+        top = np.argsort(exact)[:n_results]
+        return [int(row) for row in candidates[top]], exact[top]
+
+    def _fetch(self, rows: List[int]) -> Dict[int, tuple]:
+        if not rows:
+            return {}
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            found = self._db.execute(
+                f"SELECT row, id, text, metadata FROM rows WHERE row IN ({placeholders})", rows
+            ).fetchall()
+        return {row: (row_id, text, json.loads(metadata)) for row, row_id, text, metadata in found}
+
+    def get(self, include: List[str] = None, limit: int = None, offset: int = 0, **_) -> Dict[str, List[Any]]:
+        with self._lock:
+            found = self._db.execute(
+                "SELECT id, text, metadata FROM rows WHERE deleted = 0 ORDER BY row LIMIT ? OFFSET ?",
+                (limit if limit is not None else -1, offset or 0)
+            ).fetchall()
+        return {
+            "ids": [row_id for row_id, _, _ in found],
+            "documents": [text for _, text, _ in found],
+            "metadatas": [json.loads(metadata) for _, _, metadata in found],
+        }
+
+    def delete(self, ids: List[str] = None, where: Dict[str, Any] = None):
+        if ids is not None:
+            column, values = "id", list(ids)
+        else:
+            document_ids = (where or {}).get("document_id")
+            if isinstance(document_ids, dict):
+                document_ids = document_ids.get("$in", [])
+            elif document_ids is not None:
+                document_ids = [document_ids]
+            else:
+                raise ValueError("QuantizedCollection only supports deletes by id or document_id")
+            column, values = "document_id", list(document_ids)
+        if not values:
+            return
+
+        placeholders = ",".join("?" * len(values))
+        with self._lock:
+            rows = [
+                row for (row,) in self._db.execute(
+                    f"SELECT row FROM rows WHERE deleted = 0 AND {column} IN ({placeholders})", values
+                )
+            ]
+            self._db.execute(
+                f"UPDATE rows SET deleted = 1 WHERE {column} IN ({placeholders})", values
+            )
+            self._db.commit()
+            self._alive.view[rows] = False
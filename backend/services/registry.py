@@ -0,0 +1,125 @@
+"""
+Service registry
+Lazily constructed, process-wide service singletons shared by all routers
+"""
+import threading
+from typing import Any, Callable, Dict
+
+from services.batch_eval import BatchEvaluator
+from services.chat_recorder import ChatRecorder
+from services.db_writer import WriteQueue
+from services.document_processor import DocumentProcessor
+from services.garbage_collector import OrphanCollector
+from services.ingestion import BatchIngestor
+from services.llm_service import LLMService
+from services.loop_monitor import LoopMonitor
+from services.profiler import Profiler
+from services.reindexer import Reindexer, active_collection_name
+from services.retrieval_cache import RetrievalCache
+from services.vector_shards import create_vector_store
+from services.vector_store import VectorStore
+from services.warmup import WarmUp
+from services.workflow_analyzer import PlanCache
+from services.workflow_executor import WorkflowExecutor
+
+_instances: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def _get_or_create(name: str, factory: Callable[[], Any]) -> Any:
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = factory()
+                _instances[name] = instance
+    return instance
+
+
+def get_document_processor() -> DocumentProcessor:
+    return _get_or_create("document_processor", DocumentProcessor)
+
+
+def get_vector_store() -> VectorStore:
+    return _get_or_create("vector_store", lambda: create_vector_store(version_loader=active_collection_name))
+
+
+def get_llm_service() -> LLMService:
+    return _get_or_create("llm_service", LLMService)
+
+
+def get_workflow_executor() -> WorkflowExecutor:
+    return _get_or_create(
+        "workflow_executor",
+        lambda: WorkflowExecutor(
+            vector_store=get_vector_store(),
+            llm_service=get_llm_service(),
+            retrieval_cache=get_retrieval_cache()
+        ),
+    )
+
+
+def get_batch_evaluator() -> BatchEvaluator:
+    return _get_or_create("batch_evaluator", lambda: BatchEvaluator(get_workflow_executor()))
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    return _get_or_create("retrieval_cache", RetrievalCache)
+
+
+def get_write_queue() -> WriteQueue:
+    return _get_or_create("write_queue", WriteQueue)
+
+
+def get_chat_recorder() -> ChatRecorder:
+    return _get_or_create("chat_recorder", lambda: ChatRecorder(writer=get_write_queue()))
+
+
+def get_plan_cache() -> PlanCache:
+    return _get_or_create("plan_cache", PlanCache)
+
+
+def get_orphan_collector() -> OrphanCollector:
+    return _get_or_create("orphan_collector", lambda: OrphanCollector(get_vector_store()))
+
+
+def get_reindexer() -> Reindexer:
+    return _get_or_create("reindexer", lambda: Reindexer(get_vector_store(), get_document_processor()))
+
+
+def get_batch_ingestor() -> BatchIngestor:
+    return _get_or_create("batch_ingestor", lambda: BatchIngestor(get_vector_store(), get_document_processor()))
+
+
+def _llm_in_flight() -> int:
+    return get_llm_service().in_flight if created("llm_service") else 0
+
+
+def get_loop_monitor() -> LoopMonitor:
+    return _get_or_create("loop_monitor", lambda: LoopMonitor(llm_in_flight=_llm_in_flight))
+
+
+def get_profiler() -> Profiler:
+    return _get_or_create("profiler", Profiler)
+
+
+def get_warmup() -> WarmUp:
+    return _get_or_create("warmup", lambda: WarmUp(get_plan_cache()))
+
+
+def created(name: str) -> bool:
+    """Whether a service has been constructed (shutdown hooks must not build one)"""
+    return name in _instances
+
+
+def preload():
+    """Construct every service up front (called from the FastAPI lifespan)"""
+    get_document_processor()
+    get_workflow_executor()
+
+
+def reset():
+    """Drop all singletons so they are rebuilt on next use"""
+    with _lock:
+        _instances.clear()
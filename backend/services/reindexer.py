@@ -0,0 +1,361 @@
+"""
+Blue/green reindexing service
+Rebuild the vector index as a new version from stored uploads, then switch reads atomically
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+
+from database import SessionLocal, Document, IndexCheckpoint, IndexVersion
+from services.document_processor import DocumentProcessor
+from services.retrieval_cache import bump_corpus_version
+from services.vector_store import COLLECTION_FAMILY, VectorStore
+from services.workflow_analyzer import workflow_embedding_provider
+
+
+def active_collection_name(session_factory=SessionLocal) -> str:
+    """Collection name of the active index version ("documents" before the first reindex)"""
+    db = session_factory()
+    try:
+        name = db.query(IndexVersion.collection_name).filter(IndexVersion.status == "active").scalar()
+        return name or COLLECTION_FAMILY
+    finally:
+        db.close()
+
+
+def requeue_document(db, document_id):
+    """Make unfinished index versions pick up a document that was (re)processed live"""
+    unfinished = [
+        version_id for (version_id,) in db.query(IndexVersion.id).filter(
+            (IndexVersion.status.in_(("building", "paused")))
+            | ((IndexVersion.status == "active") & (IndexVersion.finished_at.is_(None)))
+        )
+    ]
+    for version_id in unfinished:
+        checkpoint = db.get(IndexCheckpoint, (version_id, document_id))
+        if checkpoint is None:
+            db.add(IndexCheckpoint(version_id=version_id, document_id=document_id))
+        else:
+            checkpoint.status = "pending"
+    db.commit()
+
+
+def version_summary(db, version: IndexVersion) -> Dict[str, Any]:
+    counts = dict(
+        db.query(IndexCheckpoint.status, func.count())
+        .filter(IndexCheckpoint.version_id == version.id)
+        .group_by(IndexCheckpoint.status)
+    )
+    return {
+        "id": version.id,
+        "collection_name": version.collection_name,
+        "status": version.status,
+        "chunk_size": version.chunk_size,
+        "chunk_overlap": version.chunk_overlap,
+        "documents": {status: counts.get(status, 0) for status in ("pending", "done", "failed")},
+        "error": version.error,
+        "created_at": version.created_at.isoformat() if version.created_at else None,
+        "activated_at": version.activated_at.isoformat() if version.activated_at else None,
+        "finished_at": version.finished_at.isoformat() if version.finished_at else None,
+    }
+
+
+class Reindexer:
+    """Builds index versions in the background
+
+    The build is checkpointed per document, so a paused, failed or interrupted run
+    resumes where it stopped. `concurrency` and `max_docs_per_s` bound how much of the
+    machine (and the embedding API quota) a rebuild takes away from live queries.
+    Documents processed live during a build are requeued into it, and the previous
+    version is only dropped after every worker has had time to switch.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        document_processor: DocumentProcessor,
+        concurrency: int = None,
+        max_docs_per_s: float = None,
+        max_failures: int = None,
+        drop_delay_s: float = None,
+        session_factory=SessionLocal
+    ):
+        self.vector_store = vector_store
+        self.document_processor = document_processor
+        self.concurrency = concurrency or int(os.getenv("REINDEX_CONCURRENCY", "2"))
+        self.max_docs_per_s = max_docs_per_s if max_docs_per_s is not None else float(os.getenv("REINDEX_MAX_DOCS_PER_S", "0"))
+        self.max_failures = max_failures if max_failures is not None else int(os.getenv("REINDEX_MAX_FAILURES", "0"))
+        self.drop_delay_s = drop_delay_s if drop_delay_s is not None else float(
+            os.getenv("REINDEX_DROP_DELAY_S", str(2 * vector_store.version_ttl_s))
+        )
+        self.session_factory = session_factory
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._next_start = 0.0
+
+    # Versions
+
+    def create_version(self, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None) -> Dict[str, Any]:
+        """Register a new version with a pending checkpoint for every processed document"""
+        chunk_size = chunk_size or self.document_processor.chunk_size
+        chunk_overlap = chunk_overlap if chunk_overlap is not None else self.document_processor.chunk_overlap
+        if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("chunk_overlap must be between 0 and chunk_size")
+
+        db = self.session_factory()
+        try:
+            if db.query(IndexVersion).filter(IndexVersion.status.in_(("building", "paused"))).first():
+                raise ValueError("Another index version is being built; resume or finish it first")
+            version = IndexVersion(collection_name="pending", chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            db.add(version)
+            db.flush()
+            version.collection_name = f"{COLLECTION_FAMILY}_v{version.id}"
+            document_ids = [document_id for (document_id,) in db.query(Document.id).filter(Document.processed == True)]
+            db.bulk_save_objects([IndexCheckpoint(version_id=version.id, document_id=d) for d in document_ids])
+            db.commit()
+            return version_summary(db, version)
+        finally:
+            db.close()
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        db = self.session_factory()
+        try:
+            return [version_summary(db, v) for v in db.query(IndexVersion).order_by(IndexVersion.id.desc())]
+        finally:
+            db.close()
+
+    def get_version(self, version_id: int) -> Dict[str, Any]:
+        db = self.session_factory()
+        try:
+            version = db.get(IndexVersion, version_id)
+            if version is None:
+                raise ValueError("Index version not found")
+            return version_summary(db, version)
+        finally:
+            db.close()
+
+    def _update_version(self, version_id: int, **fields):
+        db = self.session_factory()
+        try:
+            db.query(IndexVersion).filter(IndexVersion.id == version_id).update(fields)
+            db.commit()
+        finally:
+            db.close()
+
+    # Background runs
+
+    def start(self, version_id: int) -> Dict[str, Any]:
+        """Run (or resume) a build in the background of this process"""
+        task = self._tasks.get(version_id)
+        if task is not None and not task.done():
+            raise ValueError("Index version is already being built")
+        summary = self.get_version(version_id)
+        if summary["status"] == "retired" or summary["finished_at"]:
+            raise ValueError("Index version is already finished")
+        self._tasks[version_id] = asyncio.create_task(self.run(version_id), name=f"reindex:{version_id}")
+        return summary
+
+    async def pause(self, version_id: int):
+        task = self._tasks.pop(version_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def stop(self):
+        """Pause every running build (called on shutdown); they resume from checkpoints"""
+        for version_id in list(self._tasks):
+            await self.pause(version_id)
+
+    async def run(self, version_id: int) -> Dict[str, Any]:
+        """Build, switch, wait for workers to follow, catch up and drop the old version"""
+        summary = await asyncio.to_thread(self.get_version, version_id)
+        try:
+            if summary["status"] != "active":
+                await asyncio.to_thread(self._retry_failed, version_id)
+                await asyncio.to_thread(self._update_version, version_id, status="building", error=None)
+                await self._build(version_id)
+                previous = await asyncio.to_thread(self._switch, version_id)
+                self.vector_store.use_version(summary["collection_name"])
+                print(f"✅ Switched reads to index version {version_id} ({summary['collection_name']})")
+            else:
+                previous = None
+
+            # Other workers follow within INDEX_VERSION_TTL_S; writes they made to the
+            # old version meanwhile were requeued into this one
+            await asyncio.sleep(self.drop_delay_s)
+            await self._build(version_id)
+            await self._finish(version_id, previous)
+            return await asyncio.to_thread(self.get_version, version_id)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self._mark_paused, version_id, "Paused")
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self._mark_paused, version_id, str(e))
+            print(f"⚠️  Reindex of version {version_id} stopped: {e}")
+            raise
+
+    def _mark_paused(self, version_id: int, error: str):
+        db = self.session_factory()
+        try:
+            version = db.get(IndexVersion, version_id)
+            if version is not None and version.status == "building":
+                version.status = "paused"
+            if version is not None:
+                version.error = error
+            db.commit()
+        finally:
+            db.close()
+
+    def _retry_failed(self, version_id: int):
+        db = self.session_factory()
+        try:
+            db.query(IndexCheckpoint).filter(
+                IndexCheckpoint.version_id == version_id, IndexCheckpoint.status == "failed"
+            ).update({"status": "pending", "error": None})
+            db.commit()
+        finally:
+            db.close()
+
+    def _pending(self, version_id: int, limit: int) -> List[Dict[str, Any]]:
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(IndexCheckpoint.document_id, Document)
+                .outerjoin(Document, Document.id == IndexCheckpoint.document_id)
+                .filter(IndexCheckpoint.version_id == version_id, IndexCheckpoint.status == "pending")
+                .limit(limit)
+                .all()
+            )
+            return [
+                {
+                    "document_id": document_id,
+                    "file_path": document.file_path if document else None,
+                    "provider": workflow_embedding_provider(document.workflow) if document else None,
+                    "workflow_id": str(document.workflow_id) if document else None,
+                }
+                for document_id, document in rows
+            ]
+        finally:
+            db.close()
+
+    def _checkpoint(self, version_id: int, document_id, status: str, chunks: int = 0, error: str = None):
+        db = self.session_factory()
+        try:
+            checkpoint = db.get(IndexCheckpoint, (version_id, document_id))
+            if checkpoint is not None:
+                checkpoint.status = status
+                checkpoint.chunks = chunks
+                checkpoint.error = error
+                if status == "done" and checkpoint.version.status == "active":
+                    # Catch-up after the switch changes what searches return
+                    bump_corpus_version(db)
+            db.commit()
+        finally:
+            db.close()
+
+    def _drop_checkpoint(self, version_id: int, document_id):
+        db = self.session_factory()
+        try:
+            db.query(IndexCheckpoint).filter(
+                IndexCheckpoint.version_id == version_id, IndexCheckpoint.document_id == document_id
+            ).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    async def _build(self, version_id: int):
+        """Process pending checkpoints until none are left"""
+        summary = await asyncio.to_thread(self.get_version, version_id)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(item):
+            async with semaphore:
+                await self._throttle()
+                await self._index_document(summary, item)
+
+        while True:
+            batch = await asyncio.to_thread(self._pending, version_id, self.concurrency * 20)
+            if not batch:
+                break
+            await asyncio.gather(*(worker(item) for item in batch))
+
+        failed = (await asyncio.to_thread(self.get_version, version_id))["documents"]["failed"]
+        if failed > self.max_failures:
+            raise ValueError(f"{failed} documents failed to index; fix them and resume")
+
+    async def _throttle(self):
+        """Space document starts to at most max_docs_per_s"""
+        if not self.max_docs_per_s:
+            return
+        now = time.monotonic()
+        wait = self._next_start - now
+        self._next_start = max(now, self._next_start) + 1 / self.max_docs_per_s
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _index_document(self, summary: Dict[str, Any], item: Dict[str, Any]):
+        version_id, collection_name = summary["id"], summary["collection_name"]
+        document_id = item["document_id"]
+        if item["file_path"] is None:
+            # Deleted since the build started
+            await asyncio.to_thread(self._drop_checkpoint, version_id, document_id)
+            return
+        try:
+            text = await asyncio.to_thread(self.document_processor.extract_text, item["file_path"])
+            chunks = self.document_processor.chunk_text(text, summary["chunk_size"], summary["chunk_overlap"])
+            embeddings = await self.vector_store.create_embeddings(chunks, item["provider"])
+            # Replace whatever an earlier, interrupted attempt left behind
+            await self.vector_store.delete_document(str(document_id), version=collection_name)
+            await self.vector_store.store_embeddings(
+                str(document_id), chunks, embeddings, item["provider"], version=collection_name, workflow_id=item["workflow_id"]
+            )
+            await asyncio.to_thread(self._checkpoint, version_id, document_id, "done", len(chunks))
+        except Exception as e:
+            await asyncio.to_thread(self._checkpoint, version_id, document_id, "failed", 0, str(e))
+
+    def _switch(self, version_id: int) -> str:
+        """Retire the active version and activate the new one in one transaction"""
+        db = self.session_factory()
+        try:
+            previous = db.query(IndexVersion).filter(IndexVersion.status == "active").with_for_update().first()
+            previous_name = previous.collection_name if previous else COLLECTION_FAMILY
+            if previous is not None:
+                previous.status = "retired"
+            version = db.get(IndexVersion, version_id)
+            version.status = "active"
+            version.activated_at = datetime.utcnow()
+            version.error = None
+            bump_corpus_version(db)
+            # Chunk counts now describe the new version
+            for document_id, chunks in db.query(IndexCheckpoint.document_id, IndexCheckpoint.chunks).filter(
+                IndexCheckpoint.version_id == version_id, IndexCheckpoint.status == "done"
+            ):
+                db.query(Document).filter(Document.id == document_id).update({"embedding_count": chunks})
+            db.commit()
+            return previous_name
+        finally:
+            db.close()
+
+    async def _finish(self, version_id: int, previous: Optional[str]):
+        if previous is None:
+            db = self.session_factory()
+            try:
+                retired = (
+                    db.query(IndexVersion.collection_name)
+                    .filter(IndexVersion.status == "retired", IndexVersion.id < version_id)
+                    .order_by(IndexVersion.id.desc())
+                    .first()
+                )
+            finally:
+                db.close()
+            previous = retired[0] if retired else COLLECTION_FAMILY
+        if previous != self.vector_store.collection_name:
+            await asyncio.to_thread(self.vector_store.drop_version, previous)
+        await asyncio.to_thread(self._update_version, version_id, finished_at=datetime.utcnow())
+        print(f"🧹 Dropped index version {previous}")
@@ -0,0 +1,144 @@
+"""
+Retrieval cache
+Knowledge base search results keyed by workflow, normalized query, top-k and corpus version
+"""
+import asyncio
+import os
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, CorpusVersion, CORPUS_SCOPE
+
+_caches: "weakref.WeakSet[RetrievalCache]" = weakref.WeakSet()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def retrieval_key(workflow_id: Any, query: str, top_k: int, provider: Optional[str], collection: str) -> Tuple:
+    return (str(workflow_id), normalize_query(query), top_k, provider, collection)
+
+
+def bump_corpus_version(db: Session):
+    """Invalidate cached retrievals once the caller's transaction commits
+
+    Call it in the transaction that records a change of the searchable chunks
+    (documents processed or deleted, orphans removed, index versions switched).
+    """
+    updated = db.query(CorpusVersion).filter(CorpusVersion.scope == CORPUS_SCOPE).update(
+        {CorpusVersion.version: CorpusVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(CorpusVersion(scope=CORPUS_SCOPE, version=1))
+    db.info["corpus_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session):
+    # Caches of this process see the change at once; other processes within version_ttl_s
+    if session.info.pop("corpus_changed", False):
+        for cache in list(_caches):
+            cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session):
+    session.info.pop("corpus_changed", None)
+
+
+class RetrievalCache:
+    """LRU of search results that is only valid for the corpus version it was filled at
+
+    Entries hold the search task itself, so identical concurrent queries share one
+    search. An entry whose version is behind the current corpus version is a miss
+    and gets replaced; nothing has to be found and deleted on invalidation.
+    """
+
+    def __init__(self, max_entries: int = None, version_ttl_s: float = None, session_factory=SessionLocal):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+        self.version_ttl_s = version_ttl_s if version_ttl_s is not None else float(os.getenv("RETRIEVAL_CACHE_VERSION_TTL_S", "1"))
+        self.session_factory = session_factory
+        self._entries: "OrderedDict[Tuple, Tuple[int, asyncio.Future]]" = OrderedDict()
+        self._version = 0
+        self._version_read_at = float("-inf")
+        self._generation = 0  # moved by invalidate(), possibly from another thread
+        self._fresh_generation = -1
+        self.hits = 0
+        self.misses = 0
+        _caches.add(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def invalidate(self):
+        """Force the next lookup to re-read the corpus version"""
+        self._generation += 1
+
+    def _read_version(self) -> int:
+        db = self.session_factory()
+        try:
+            row = db.get(CorpusVersion, CORPUS_SCOPE)
+            return row.version if row else 0
+        finally:
+            db.close()
+
+    def _version_is_fresh(self) -> bool:
+        return (
+            self._fresh_generation == self._generation
+            and time.monotonic() - self._version_read_at < self.version_ttl_s
+        )
+
+    async def corpus_version(self) -> int:
+        if self._version_is_fresh():
+            return self._version
+        generation = self._generation
+        version = await asyncio.to_thread(self._read_version)
+        # A commit that landed during the read must trigger another one
+        if self._generation == generation:
+            self._version = version
+            self._version_read_at = time.monotonic()
+            self._fresh_generation = generation
+        return version
+
+    def peek(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        """Finished results for `key` if they are known to be current, without any I/O"""
+        if not self.enabled or not self._version_is_fresh():
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self._version or not self._usable(entry[1]) or not entry[1].done():
+            return None
+        return entry[1].result()
+
+    @staticmethod
+    def _usable(task: asyncio.Future) -> bool:
+        # Partial results of a sharded store (a shard missed the deadline) are not kept
+        return not task.done() or (
+            not task.cancelled() and task.exception() is None and not getattr(task.result(), "partial", False)
+        )
+
+    async def fetch(self, key: Tuple, search: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """Cached results for `key`, running `search` on a miss"""
+        if not self.enabled:
+            return await search()
+        version = await self.corpus_version()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version and self._usable(entry[1]):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            task = entry[1]
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(search())
+            self._entries[key] = (version, task)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        # Shielded: a cancelled caller must not cancel a search other callers wait for
+        return list(await asyncio.shield(task))
@@ -0,0 +1,196 @@
+"""
+Execution tracing service
+Record per-node spans for workflow executions and optionally export them to OpenTelemetry
+"""
+import os
+import time
+from typing import List, Dict, Any, Optional
+
+# Order of the fields in a compact span row; new fields go last so older rows still expand
+SPAN_FIELDS = (
+    "node_id",
+    "node_type",
+    "start_ms",
+    "duration_ms",
+    "input_chars",
+    "output_chars",
+    "source_ids",
+    "tokens",
+    "error",
+    "cached_tokens",
+)
+
+
+def payload_size(context: Dict[str, Any]) -> int:
+    """Approximate size (in characters) of the data flowing between nodes"""
+    size = len(context.get("query") or "")
+    size += sum(len(text) for text in context.get("knowledge") or [])
+    size += len(context.get("response") or "")
+    return size
+
+
+def source_id(metadata: Dict[str, Any]) -> str:
+    """Build a short identifier for a retrieved chunk"""
+    return f"{metadata.get('document_id')}:{metadata.get('chunk_index')}"
+
+
+class Span:
+    def __init__(self, trace: "ExecutionTrace", node_id: str, node_type: str):
+        self.trace = trace
+        self.node_id = node_id
+        self.node_type = node_type
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.input_chars = 0
+        self.output_chars = 0
+        self.source_ids: List[str] = []
+        self.tokens = 0
+        self.cached_tokens = 0  # prompt tokens the provider served from its prefix cache
+        self.error: Optional[str] = None
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.finished = time.perf_counter()
+        self.trace.spans.append(self)
+        return False
+
+    @property
+    def start_ms(self) -> float:
+        return (self.started - self.trace.started) * 1000
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return (end - self.started) * 1000
+
+    def to_row(self) -> List[Any]:
+        """Serialize the span as a compact row ordered like SPAN_FIELDS"""
+        return [
+            self.node_id,
+            self.node_type,
+            round(self.start_ms, 3),
+            round(self.duration_ms, 3),
+            self.input_chars,
+            self.output_chars,
+            self.source_ids,
+            self.tokens,
+            self.error,
+            self.cached_tokens,
+        ]
+
+
+class ExecutionTrace:
+    """Timing and data-flow trace of a single workflow execution"""
+
+    def __init__(self, workflow_id: str):
+        self.workflow_id = workflow_id
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.finished: Optional[float] = None
+        self.spans: List[Span] = []
+
+    def span(self, node_id: str, node_type: str) -> Span:
+        """Open a span for a node; it is recorded when the context manager exits"""
+        return Span(self, node_id, node_type)
+
+    def finish(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    @property
+    def status(self) -> str:
+        return "error" if any(span.error for span in self.spans) else "ok"
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return (end - self.started) * 1000
+
+    def compact_spans(self) -> List[List[Any]]:
+        """Spans in the compact row form that is persisted with the chat message"""
+        return [span.to_row() for span in self.spans]
+
+
+def span_status(rows: List[List[Any]]) -> str:
+    """Status of a persisted trace: error when one of its nodes failed, else ok"""
+    error = SPAN_FIELDS.index("error")
+    return "error" if any(len(row) > error and row[error] for row in rows or []) else "ok"
+
+
+def expand_spans(rows: List[List[Any]]) -> List[Dict[str, Any]]:
+    """Turn persisted compact span rows back into dictionaries"""
+    return [dict(zip(SPAN_FIELDS, row)) for row in rows or []]
+
+
+_otel_tracer = None
+
+
+def _get_otel_tracer():
+    """Lazily configure an OpenTelemetry tracer when an OTLP endpoint is set"""
+    global _otel_tracer
+
+    endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if not endpoint:
+        return None
+    if _otel_tracer is not None:
+        return _otel_tracer
+
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        print("⚠️  OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk is not installed")
+        _otel_tracer = False
+        return None
+
+    service_name = os.getenv("OTEL_SERVICE_NAME", "workflow-builder-api")
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint, insecure=True)))
+    _otel_tracer = provider.get_tracer("workflow-executor")
+    return _otel_tracer
+
+
+def export_trace(trace: ExecutionTrace, message_id: Optional[str] = None):
+    """Export a finished trace to the configured OpenTelemetry collector, if any"""
+    tracer = _get_otel_tracer()
+    if not tracer:
+        return
+
+    from opentelemetry import trace as otel_trace
+
+    def to_ns(offset_ms: float) -> int:
+        return trace.started_ns + int(offset_ms * 1_000_000)
+
+    root = tracer.start_span(
+        "workflow.execute",
+        start_time=trace.started_ns,
+        attributes={"workflow.id": trace.workflow_id, "chat.message_id": message_id or "", "workflow.status": trace.status},
+    )
+    if trace.status == "error":
+        root.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+    parent = otel_trace.set_span_in_context(root)
+    for span in trace.spans:
+        child = tracer.start_span(
+            f"node.{span.node_type}",
+            context=parent,
+            start_time=to_ns(span.start_ms),
+            attributes={
+                "node.id": span.node_id,
+                "node.type": span.node_type,
+                "node.input_chars": span.input_chars,
+                "node.output_chars": span.output_chars,
+                "node.source_ids": span.source_ids,
+                "node.tokens": span.tokens,
+                "node.cached_tokens": span.cached_tokens,
+            },
+        )
+        if span.error:
+            child.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, span.error))
+        child.end(end_time=to_ns(span.start_ms + span.duration_ms))
+    root.end(end_time=to_ns(trace.duration_ms))
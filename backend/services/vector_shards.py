@@ -0,0 +1,279 @@
+"""
+Sharded vector store
+Partition the index across several Chroma processes (or directories) and scatter-gather searches
+"""
+import asyncio
+import heapq
+import os
+import subprocess
+import sys
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from services.vector_store import VectorStore
+
+# "document": chunks go to the shard their document id hashes to; searches ask every shard.
+# "workflow": a workflow's documents share the shard its id hashes to; its searches ask only that shard.
+SHARD_STRATEGIES = ("document", "workflow")
+
+
+def parse_shards(value: str) -> List[Dict[str, str]]:
+    """"http://127.0.0.1:8101,./chroma_shards/1" -> one server shard and one embedded shard"""
+    shards = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith("http://"):
+            host, _, port = item[len("http://"):].rstrip("/").partition(":")
+            shards.append({"mode": "server", "host": host, "port": port or "8000"})
+        else:
+            shards.append({"mode": "embedded", "path": item})
+    return shards
+
+
+def shard_index(key: str, count: int) -> int:
+    """Stable placement; Python's hash() differs between processes"""
+    return zlib.crc32(key.encode()) % count
+
+
+class SearchResults(list):
+    """Merged search results; `partial` when a shard missed the deadline or failed"""
+
+    def __init__(self, items, partial: bool = False):
+        super().__init__(items)
+        self.partial = partial
+
+
+class ShardedVectorStore:
+    """Drop-in VectorStore over several shards, each a VectorStore of its own
+
+    Searches ask their shards concurrently and keep the nearest `n_results` of all answers.
+    Shards that have not answered after `deadline_ms` (0 waits for all) or that fail are left
+    out, and the results are marked partial. The shard list and the strategy decide where
+    every chunk lives; changing either needs a reindex.
+    """
+
+    def __init__(
+        self,
+        shards: List[VectorStore],
+        strategy: str = None,
+        deadline_ms: float = None,
+        version_loader: Optional[Callable[[], str]] = None
+    ):
+        if not shards:
+            raise ValueError("At least one vector shard is required")
+        self.shards = shards
+        self.strategy = strategy or os.getenv("VECTOR_SHARD_BY", "document")
+        if self.strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"Unsupported VECTOR_SHARD_BY: {self.strategy}")
+        if self.strategy == "workflow" and any(m != "none" for shard in shards for m in shard.quantization.values()):
+            # Quantized collections cannot filter a workflow's chunks
+            raise ValueError("VECTOR_SHARD_BY=workflow does not support VECTOR_QUANTIZATION")
+        self.deadline_s = (deadline_ms if deadline_ms is not None else float(os.getenv("VECTOR_SHARD_DEADLINE_MS", "500"))) / 1000
+        # A stalled shard only ties up its own search threads
+        threads = int(os.getenv("VECTOR_SHARD_THREADS", "4"))
+        for index, shard in enumerate(shards):
+            shard.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"vector-shard-{index}")
+        self.searches = 0
+        self.partial_searches = 0
+        self.missed: Counter = Counter()
+
+        # The shards follow the version this store loads, one database read for all of them
+        self.version_loader = version_loader
+        self.version_ttl_s = shards[0].version_ttl_s
+        self._version_checked = time.monotonic()
+        if version_loader is not None:
+            self.use_version(version_loader())
+
+    @classmethod
+    def from_config(cls, spec: str, version_loader: Optional[Callable[[], str]] = None, **kwargs) -> "ShardedVectorStore":
+        shards = [
+            VectorStore(mode=shard["mode"], path=shard.get("path"), host=shard.get("host"), port=shard.get("port"))
+            for shard in parse_shards(spec)
+        ]
+        return cls(shards, version_loader=version_loader, **kwargs)
+
+    @property
+    def collection_name(self) -> str:
+        return self.shards[0].collection_name
+
+    def use_version(self, collection_name: str):
+        for shard in self.shards:
+            shard.use_version(collection_name)
+
+    async def refresh_version(self, force: bool = False):
+        if self.version_loader is None:
+            return
+        if not force and time.monotonic() - self._version_checked < self.version_ttl_s:
+            return
+        self._version_checked = time.monotonic()
+        collection_name = await asyncio.to_thread(self.version_loader)
+        if collection_name != self.collection_name:
+            self.use_version(collection_name)
+
+    def drop_version(self, version: str):
+        for shard in self.shards:
+            shard.drop_version(version)
+
+    def shard_for(self, document_id: str, workflow_id: Optional[str] = None) -> int:
+        """Index of the shard that holds a document"""
+        key = workflow_id if self.strategy == "workflow" and workflow_id else document_id
+        return shard_index(key, len(self.shards))
+
+    def _describe(self, index: int) -> str:
+        shard = self.shards[index]
+        return f"http://{shard.host}:{shard.port}" if shard.mode == "server" else shard.path
+
+    async def create_embeddings(self, texts: List[str], provider: Optional[str] = None) -> List[List[float]]:
+        return await self.shards[0].create_embeddings(texts, provider)
+
+    async def embed_query(self, query: str, provider: Optional[str] = None) -> List[float]:
+        return await self.shards[0].embed_query(query, provider)
+
+    async def store_embeddings(
+        self,
+        document_id: str,
+        texts: List[str],
+        embeddings: List[List[float]],
+        provider: Optional[str] = None,
+        version: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ):
+        if version is None:
+            await self.refresh_version()
+        shard = self.shards[self.shard_for(document_id, workflow_id)]
+        await shard.store_embeddings(document_id, texts, embeddings, provider, version, workflow_id)
+
+    async def search(
+        self,
+        query: str,
+        n_results: int = 5,
+        provider: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ) -> SearchResults:
+        query_embedding = await self.embed_query(query, provider)
+        return await self.search_by_embedding(query_embedding, n_results, provider, workflow_id)
+
+    async def search_by_embedding(
+        self,
+        query_embedding: List[float],
+        n_results: int = 5,
+        provider: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ) -> SearchResults:
+        """Scatter the query to its shards, gather what arrives before the deadline"""
+        await self.refresh_version()
+        if self.strategy == "workflow" and workflow_id:
+            targets, where = [shard_index(workflow_id, len(self.shards))], {"workflow_id": workflow_id}
+        else:
+            targets, where = range(len(self.shards)), None
+        tasks = {
+            asyncio.ensure_future(self.shards[index].query(query_embedding, n_results, provider, where)): index
+            for index in targets
+        }
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.deadline_s or None)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        answers, errors = [], []
+        for task, index in tasks.items():
+            if task in done and task.exception() is None:
+                answers.append(task.result())
+                continue
+            self.missed[index] += 1
+            if task in done:
+                errors.append(task.exception())
+        self.searches += 1
+        if not answers:
+            if errors:
+                raise errors[0]
+            raise TimeoutError(f"No vector shard answered within {self.deadline_s * 1000:.0f} ms")
+        partial = len(answers) < len(tasks)
+        if partial:
+            self.partial_searches += 1
+        nearest = heapq.nsmallest(n_results, (pair for answer in answers for pair in answer), key=lambda pair: pair[0])
+        return SearchResults([item for _, item in nearest], partial)
+
+    async def delete_document(self, document_id: str, version: Optional[str] = None):
+        # Without the workflow id the owning shard is not known, and deletes are rare
+        await asyncio.gather(*(shard.delete_document(document_id, version) for shard in self.shards))
+
+    async def delete_chunks(
+        self,
+        document_id: str,
+        chunk_indexes: Iterable[int],
+        provider: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ):
+        shard = self.shards[self.shard_for(document_id, workflow_id)]
+        await shard.delete_chunks(document_id, chunk_indexes, provider, workflow_id)
+
+    async def delete_documents(self, document_ids: List[str]):
+        await asyncio.gather(*(shard.delete_documents(document_ids) for shard in self.shards))
+
+    async def list_document_ids(self, page_size: int = 5000) -> Dict[str, int]:
+        counts: Counter = Counter()
+        for shard_counts in await asyncio.gather(*(shard.list_document_ids(page_size) for shard in self.shards)):
+            counts.update(shard_counts)
+        return dict(counts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "strategy": self.strategy,
+            "deadline_ms": self.deadline_s * 1000,
+            "searches": self.searches,
+            "partial_searches": self.partial_searches,
+            "shards": [
+                {"shard": self._describe(index), "missed": self.missed[index]}
+                for index in range(len(self.shards))
+            ]
+        }
+
+
+def create_vector_store(version_loader: Optional[Callable[[], str]] = None):
+    """A ShardedVectorStore when VECTOR_SHARDS lists shards, else a single VectorStore"""
+    spec = os.getenv("VECTOR_SHARDS", "")
+    if parse_shards(spec):
+        return ShardedVectorStore.from_config(spec, version_loader=version_loader)
+    return VectorStore(version_loader=version_loader)
+
+
+def start_shard_servers(count: int, path: str, base_port: int, host: str = "127.0.0.1") -> Tuple[List[subprocess.Popen], str]:
+    """Start one Chroma server process per shard; returns them and their VECTOR_SHARDS value"""
+    processes, urls = [], []
+    for index in range(count):
+        directory = os.path.abspath(os.path.join(path, str(index)))
+        os.makedirs(directory, exist_ok=True)
+        port = base_port + index
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "chromadb.cli.cli", "run", "--path", directory, "--host", host, "--port", str(port)],
+            cwd=directory,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ))
+        urls.append(f"http://{host}:{port}")
+    return processes, ",".join(urls)
+
+
+def wait_for_shards(spec: str, timeout_s: float = 60):
+    """Block until every server shard of a VECTOR_SHARDS value answers a heartbeat"""
+    import chromadb
+
+    deadline = time.monotonic() + timeout_s
+    for shard in parse_shards(spec):
+        if shard["mode"] != "server":
+            continue
+        while True:
+            try:
+                chromadb.HttpClient(host=shard["host"], port=shard["port"]).heartbeat()
+                break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Vector shard {shard['host']}:{shard['port']} did not start")
+                time.sleep(0.2)
@@ -2,77 +2,288 @@
 Vector store service using ChromaDB
 Store and retrieve document embeddings
 """
+import asyncio
 import os
-import chromadb
-from typing import List, Dict, Any
-from openai import AsyncOpenAI
+import shutil
+import time
+from concurrent.futures import Executor
+from functools import partial
+from typing import Callable, Iterable, List, Dict, Any, Optional, Tuple
+
+from services.embeddings import DEFAULT_PROVIDER, PROVIDER_NAMES, get_embedding_provider
+from services.quantization import QuantizedCollection, parse_quantization, quantization_for
+
+# "embedded" opens ./chroma_db in-process (development, single worker).
+# "server" connects to a shared Chroma server so several workers can write safely.
+VECTOR_STORE_MODES = ("embedded", "server")
+
+# Every index version stores its collections under this name family:
+# "documents" (the original index), "documents_v2", "documents_v2__hashing", ...
+COLLECTION_FAMILY = "documents"
+
+
+def chunk_id(document_id: str, chunk_index: int) -> str:
+    return f"{document_id}_{chunk_index}"
 
 
 class VectorStore:
-    def __init__(self):
-        # Use the new PersistentClient API (no Settings class anymore)
-        self.client = chromadb.PersistentClient(path="./chroma_db")
-        self.collection_name = "documents"
+    def __init__(
+        self,
+        path: str = None,
+        mode: str = None,
+        quantization: str = None,
+        version_loader: Optional[Callable[[], str]] = None,
+        host: str = None,
+        port: str = None
+    ):
+        self.mode = mode or os.getenv("VECTOR_STORE_MODE", "embedded")
+        if self.mode not in VECTOR_STORE_MODES:
+            raise ValueError(f"Unsupported VECTOR_STORE_MODE: {self.mode}")
+
+        self.path = path or os.getenv("CHROMA_PATH", "./chroma_db")
+        self.host = host or os.getenv("CHROMA_HOST", "127.0.0.1")
+        self.port = port or os.getenv("CHROMA_PORT", "8001")
+        self.quantization = parse_quantization(
+            quantization if quantization is not None else os.getenv("VECTOR_QUANTIZATION", "")
+        )
+        if self.mode != "embedded" and any(m != "none" for m in self.quantization.values()):
+            raise ValueError("VECTOR_QUANTIZATION requires VECTOR_STORE_MODE=embedded")
+        self.client = self._create_client()
+        self._collections: Dict[str, Any] = {}
+        # Searches run on the default thread pool unless a dedicated one is assigned
+        self.executor: Optional[Executor] = None
+
+        # The active index version is read from the database and re-checked every
+        # INDEX_VERSION_TTL_S seconds, so a reindex switch reaches every worker
+        self.version_loader = version_loader
+        self.version_ttl_s = float(os.getenv("INDEX_VERSION_TTL_S", "5"))
+        self._version_checked = time.monotonic()
+        self.use_version(version_loader() if version_loader else COLLECTION_FAMILY)
+
+    def use_version(self, collection_name: str):
+        """Point reads and writes at an index version"""
+        self.collection_name = collection_name
+        # Ensure collection exists; it holds the default provider's vectors
+        self.collection = self._get_collection(collection_name)
+
+    async def refresh_version(self, force: bool = False):
+        """Pick up an index switch made by another worker or the CLI"""
+        if self.version_loader is None:
+            return
+        if not force and time.monotonic() - self._version_checked < self.version_ttl_s:
+            return
+        self._version_checked = time.monotonic()
+        collection_name = await asyncio.to_thread(self.version_loader)
+        if collection_name != self.collection_name:
+            self.use_version(collection_name)
+
+    def _create_client(self):
+        import chromadb  # imported lazily, it is slow to import
+
+        if self.mode == "embedded":
+            # Use the new PersistentClient API (no Settings class anymore)
+            return chromadb.PersistentClient(path=self.path)
+
+        client = chromadb.HttpClient(host=self.host, port=self.port)
+        self._configure_pool(client, int(os.getenv("CHROMA_POOL_SIZE", "20")), float(os.getenv("CHROMA_TIMEOUT_S", "30")))
+        return client
+
+    @staticmethod
+    def _configure_pool(client, pool_size: int, timeout_s: float):
+        """Size the keep-alive connection pool of the Chroma HTTP client and bound its requests"""
+        from requests.adapters import HTTPAdapter
 
-        # Ensure collection exists
-        self.collection = self.client.get_or_create_collection(name=self.collection_name)
+        class TimeoutAdapter(HTTPAdapter):
+            # The Chroma client sends without a timeout; a hung server would hold a thread forever
+            def send(self, request, **kwargs):
+                if kwargs.get("timeout") is None:
+                    kwargs["timeout"] = timeout_s
+                return super().send(request, **kwargs)
 
-    async def create_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Create embeddings using OpenAI"""
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not configured")
+        session = getattr(getattr(client, "_server", None), "_session", None)
+        if session is None:
+            return
+        adapter = TimeoutAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
 
-        client = AsyncOpenAI(api_key=api_key)
-        embeddings = []
+    def collection_name_for(self, provider: Optional[str] = None, version: Optional[str] = None) -> str:
+        """Vectors of different providers have different dimensions, so each gets a collection"""
+        version = version or self.collection_name
+        provider = provider or os.getenv("EMBEDDING_PROVIDER", DEFAULT_PROVIDER)
+        if provider not in PROVIDER_NAMES:
+            raise ValueError(f"Unsupported embedding provider: {provider}")
+        if provider == DEFAULT_PROVIDER:
+            return version
+        return f"{version}__{provider}"
 
-        for text in texts:
-            response = await client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
-            )
-            embeddings.append(response.data[0].embedding)
+    def collection_for(self, provider: Optional[str] = None, version: Optional[str] = None):
+        return self._get_collection(self.collection_name_for(provider, version))
 
-        return embeddings
+    def _get_collection(self, name: str):
+        """Chroma collection, or a quantized one when VECTOR_QUANTIZATION selects it"""
+        collection = self._collections.get(name)
+        if collection is None:
+            mode = quantization_for(self.quantization, name)
+            if mode == "none":
+                collection = self.client.get_or_create_collection(name=name)
+            else:
+                collection = QuantizedCollection(os.path.join(self.path, "quantized", name), name, mode)
+            self._collections[name] = collection
+        return collection
+
+    def _provider_collections(self, version: Optional[str] = None) -> List[Any]:
+        """Collections of one index version, or of every version when `version` is None"""
+        names = [collection.name for collection in self.client.list_collections()]
+        quantized_dir = os.path.join(self.path, "quantized")
+        if self.mode == "embedded" and os.path.isdir(quantized_dir):
+            names.extend(os.listdir(quantized_dir))
+        names.extend(self._collections)
+        return [self._get_collection(name) for name in sorted(set(names)) if self._in_version(name, version)]
+
+    @staticmethod
+    def _in_version(name: str, version: Optional[str]) -> bool:
+        if version is not None:
+            return name == version or name.startswith(f"{version}__")
+        return name == COLLECTION_FAMILY or name.startswith(f"{COLLECTION_FAMILY}_")
+
+    def drop_version(self, version: str):
+        """Delete every collection of an index version"""
+        if version == self.collection_name:
+            raise ValueError("Cannot drop the active index version")
+        for collection in self._provider_collections(version):
+            self._collections.pop(collection.name, None)
+            if isinstance(collection, QuantizedCollection):
+                collection.close()
+                shutil.rmtree(collection.directory, ignore_errors=True)
+            else:
+                self.client.delete_collection(name=collection.name)
+
+    async def create_embeddings(self, texts: List[str], provider: Optional[str] = None) -> List[List[float]]:
+        """Create embeddings with the given provider (EMBEDDING_PROVIDER by default)"""
+        return await get_embedding_provider(provider).embed(texts)
 
     async def store_embeddings(
         self,
         document_id: str,
         texts: List[str],
-        embeddings: List[List[float]]
+        embeddings: List[List[float]],
+        provider: Optional[str] = None,
+        version: Optional[str] = None,
+        workflow_id: Optional[str] = None
     ):
-        """Store embeddings in ChromaDB"""
-        ids = [f"{document_id}_{i}" for i in range(len(texts))]
+        """Store embeddings in ChromaDB (in the active index version unless `version` is given)"""
+        if version is None:
+            await self.refresh_version()
+        ids = [chunk_id(document_id, i) for i in range(len(texts))]
         metadatas = [{"document_id": document_id, "chunk_index": i} for i in range(len(texts))]
+        if workflow_id is not None:
+            for meta in metadatas:
+                meta["workflow_id"] = workflow_id
 
-        self.collection.add(
+        # Chroma calls block (disk or HTTP), keep them off the event loop
+        await asyncio.to_thread(
+            self.collection_for(provider, version).add,
             ids=ids,
             embeddings=embeddings,
             documents=texts,
             metadatas=metadatas
         )
 
-    async def search(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+    async def embed_query(self, query: str, provider: Optional[str] = None) -> List[float]:
+        """Embed a single search query"""
+        return (await self.create_embeddings([query], provider))[0]
+
+    async def search(
+        self,
+        query: str,
+        n_results: int = 5,
+        provider: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
         """Search for relevant documents"""
         # Get query embedding
-        query_embedding = await self.create_embeddings([query])
+        query_embedding = await self.embed_query(query, provider)
+        return await self.search_by_embedding(query_embedding, n_results, provider, workflow_id)
+
+    async def search_by_embedding(
+        self,
+        query_embedding: List[float],
+        n_results: int = 5,
+        provider: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Search with an already computed query embedding
 
-        results = self.collection.query(
-            query_embeddings=query_embedding,
-            n_results=n_results
+        `workflow_id` only routes searches of a sharded store; a single store searches everything.
+        """
+        return [item for _, item in await self.query(query_embedding, n_results, provider)]
+
+    async def query(
+        self,
+        query_embedding: List[float],
+        n_results: int,
+        provider: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """(distance, result) pairs, nearest first"""
+        await self.refresh_version()
+        results = await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            partial(self.collection_for(provider).query, query_embeddings=[query_embedding], n_results=n_results, where=where)
         )
 
         # Format response
         return [
-            {
-                "text": doc,
-                "metadata": meta
-            }
-            for doc, meta in zip(results["documents"][0], results["metadatas"][0])
+            (distance, {"text": doc, "metadata": meta})
+            for doc, meta, distance in zip(results["documents"][0], results["metadatas"][0], results["distances"][0])
         ]
 
-    async def delete_document(self, document_id: str):
-        """Delete all chunks for a document"""
-        results = self.collection.get(where={"document_id": document_id})
-        if results and "ids" in results and results["ids"]:
-            self.collection.delete(ids=results["ids"])
+    async def delete_document(self, document_id: str, version: Optional[str] = None):
+        """Delete all chunks for a document, whichever provider (and index version) holds them"""
+        # Filtered delete, no need to fetch the chunk ids first
+        for collection in await asyncio.to_thread(self._provider_collections, version):
+            await asyncio.to_thread(collection.delete, where={"document_id": document_id})
+
+    async def delete_chunks(
+        self,
+        document_id: str,
+        chunk_indexes: Iterable[int],
+        provider: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ):
+        """Delete single chunks of a document from the active index version"""
+        ids = [chunk_id(document_id, i) for i in chunk_indexes]
+        if not ids:
+            return
+        await self.refresh_version()
+        await asyncio.to_thread(self.collection_for(provider).delete, ids=ids)
+
+    async def delete_documents(self, document_ids: List[str]):
+        """Delete all chunks of several documents in one call per collection"""
+        if not document_ids:
+            return
+        for collection in await asyncio.to_thread(self._provider_collections):
+            await asyncio.to_thread(collection.delete, where={"document_id": {"$in": list(document_ids)}})
+
+    async def list_document_ids(self, page_size: int = 5000) -> Dict[str, int]:
+        """Chunk counts per document id, read page by page from the index metadata"""
+        counts: Dict[str, int] = {}
+        for collection in await asyncio.to_thread(self._provider_collections):
+            offset = 0
+            while True:
+                page = await asyncio.to_thread(
+                    collection.get,
+                    include=["metadatas"],
+                    limit=page_size,
+                    offset=offset
+                )
+                metadatas = page.get("metadatas") or []
+                for meta in metadatas:
+                    document_id = (meta or {}).get("document_id")
+                    if document_id:
+                        counts[document_id] = counts.get(document_id, 0) + 1
+                if len(metadatas) < page_size:
+                    break
+                offset += page_size
+        return counts
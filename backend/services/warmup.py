@@ -0,0 +1,134 @@
+"""
+Workflow warm-up
+Preload plans, vector collections and retrievals of the busiest workflows when a worker starts
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func
+
+from database import SessionLocal, ChatHistory
+from services.chat_session import open_session_workflow
+from services.workflow_analyzer import PlanCache, embedding_provider, retrieval_step, stored_plan_steps
+from services.workflow_executor import WorkflowExecutor
+
+
+class WarmUp:
+    """Pays a fresh worker's cold-start costs before traffic is routed to it
+
+    The busiest workflows are those with the most chat messages in the last `window_days`.
+    Each one's plan is compiled into the plan cache, and its most asked questions are
+    searched once. The searches open its vector collection, page its index in, load the
+    embedding model and fill the retrieval cache. The worker is `ready` when this is done;
+    a workflow that fails to warm is counted, not fatal.
+    """
+
+    def __init__(
+        self,
+        plan_cache: PlanCache,
+        max_workflows: int = None,
+        queries: int = None,
+        window_days: float = None,
+        concurrency: int = None,
+        session_factory=SessionLocal
+    ):
+        self.plan_cache = plan_cache
+        self.max_workflows = max_workflows if max_workflows is not None else int(os.getenv("WARMUP_WORKFLOWS", "20"))
+        self.queries = queries if queries is not None else int(os.getenv("WARMUP_QUERIES", "3"))
+        self.window_days = window_days or float(os.getenv("WARMUP_WINDOW_DAYS", "7"))
+        self.concurrency = concurrency or int(os.getenv("WARMUP_CONCURRENCY", "4"))
+        self.session_factory = session_factory
+        self.state = "pending"  # pending, warming, ready
+        self.warmed = 0
+        self.failed = 0
+        self.duration_ms: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def hot_workflows(self) -> List[Dict[str, Any]]:
+        """The busiest workflows, most messages first, with their most asked questions"""
+        since = datetime.utcnow() - timedelta(days=self.window_days)
+        messages = func.count(ChatHistory.id)
+        db = self.session_factory()
+        try:
+            hot = (
+                db.query(ChatHistory.workflow_id, messages)
+                .filter(ChatHistory.workflow_id.isnot(None), ChatHistory.created_at >= since)
+                .group_by(ChatHistory.workflow_id)
+                .order_by(messages.desc())
+                .limit(self.max_workflows)
+                .all()
+            )
+            workflows = []
+            for workflow_id, count in hot:
+                questions = [] if self.queries <= 0 else [
+                    message for message, in db.query(ChatHistory.message)
+                    .filter(
+                        ChatHistory.workflow_id == workflow_id,
+                        ChatHistory.role == "user",
+                        ChatHistory.created_at >= since
+                    )
+                    .group_by(ChatHistory.message)
+                    .order_by(messages.desc())
+                    .limit(self.queries)
+                ]
+                workflows.append({"workflow_id": workflow_id, "messages": count, "questions": questions})
+            return workflows
+        finally:
+            db.close()
+
+    async def run(self, get_executor: Callable[[], WorkflowExecutor]):
+        """Warm the busiest workflows, then report ready (started from the FastAPI lifespan)
+
+        Takes a factory because building the executor opens the vector store, which is
+        part of the cold start and must not block the event loop.
+        """
+        self.state = "warming"
+        started = time.perf_counter()
+        try:
+            if self.max_workflows > 0:
+                executor = await asyncio.to_thread(get_executor)
+                hot = await asyncio.to_thread(self.hot_workflows)
+                slots = asyncio.Semaphore(self.concurrency)
+
+                async def warm(item: Dict[str, Any]):
+                    async with slots:
+                        await self._warm_workflow(executor, item)
+
+                await asyncio.gather(*(warm(item) for item in hot))
+        except Exception as e:
+            print(f"⚠️  Warm-up failed: {e}")
+        self.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        self.state = "ready"
+        if self.warmed or self.failed:
+            print(f"🔥 Warmed up {self.warmed} workflows in {self.duration_ms:.0f} ms ({self.failed} failed)")
+
+    async def _warm_workflow(self, executor: WorkflowExecutor, item: Dict[str, Any]):
+        try:
+            workflow = await asyncio.to_thread(open_session_workflow, item["workflow_id"], self.session_factory)
+            if workflow is None:
+                return
+            steps = stored_plan_steps(workflow)
+            self.plan_cache.put(workflow.id, workflow.plan.digest, steps, workflow.is_valid)
+            if workflow.is_valid and retrieval_step(steps) is not None:
+                provider = embedding_provider(steps)
+                for question in item["questions"]:
+                    # The same search (and cache key) a chat message for this workflow runs
+                    await executor.retrieve(question, provider, str(workflow.id))
+            self.warmed += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"⚠️  Warm-up of workflow {item['workflow_id']} failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "status": self.state,
+            "warmed_workflows": self.warmed,
+            "failed_workflows": self.failed,
+            "duration_ms": self.duration_ms
+        }
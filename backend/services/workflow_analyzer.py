@@ -0,0 +1,315 @@
+"""
+Workflow graph analysis service
+Validate a workflow graph once on save and compile it into a linear execution plan
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from services.embeddings import PROVIDER_NAMES
+
+# Bump when the analysis rules or the plan format change so stored plans are recompiled
+ANALYZER_VERSION = 2
+
+# Which component may feed which
+ALLOWED_TARGETS = {
+    "userQuery": {"knowledgeBase", "llmEngine", "output"},
+    "knowledgeBase": {"llmEngine", "output"},
+    "llmEngine": {"output"},
+    "output": set(),
+}
+
+# Expected config value types per component; None means "not set"
+CONFIG_SCHEMAS = {
+    "userQuery": {"placeholder": str},
+    "knowledgeBase": {"chunkSize": int, "chunkOverlap": int, "passContext": bool, "embeddingProvider": str},
+    "llmEngine": {"model": str, "temperature": (int, float), "systemPrompt": str, "useWebSearch": bool},
+    "output": {"displayMode": str},
+}
+
+SUPPORTED_MODEL_PREFIXES = ("gpt", "gemini")
+
+
+class PlanStep:
+    """A node of the compiled plan, in execution order"""
+
+    def __init__(self, node_id: str, node_type: str, config: Optional[Dict[str, Any]] = None):
+        self.node_id = node_id
+        self.node_type = node_type
+        self.config = config or {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"node_id": self.node_id, "node_type": self.node_type, "config": self.config}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PlanStep":
+        return cls(data["node_id"], data["node_type"], data.get("config"))
+
+
+class WorkflowAnalysis:
+    def __init__(self, digest: str):
+        self.digest = digest
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+        self.steps: List[PlanStep] = []
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors and bool(self.steps)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "is_valid": self.is_valid,
+            "digest": self.digest,
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "steps": [step.to_dict() for step in self.steps],
+        }
+
+
+def graph_digest(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> str:
+    """Hash of everything that affects execution (positions are ignored)"""
+    canonical = {
+        "version": ANALYZER_VERSION,
+        "nodes": sorted(
+            [[n["node_id"], n["node_type"], n.get("config") or {}] for n in nodes],
+            key=lambda n: n[0],
+        ),
+        # Edge order matters: the first outgoing edge of a node is the one followed
+        "edges": [[e["source_node_id"], e["target_node_id"]] for e in edges],
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _check_config(node: Dict[str, Any], errors: List[str]):
+    schema = CONFIG_SCHEMAS.get(node["node_type"], {})
+    config = node.get("config") or {}
+    label = f"Component '{node['node_id']}'"
+
+    for key, expected in schema.items():
+        value = config.get(key)
+        if value is None:
+            continue
+        # bool is an int subclass; only accept it where a bool is expected
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            errors.append(f"{label}: '{key}' has an invalid type")
+
+    if node["node_type"] == "llmEngine":
+        model = config.get("model")
+        if isinstance(model, str) and not model.startswith(SUPPORTED_MODEL_PREFIXES):
+            errors.append(f"{label}: unsupported model '{model}'")
+        temperature = config.get("temperature")
+        if isinstance(temperature, (int, float)) and not 0 <= temperature <= 2:
+            errors.append(f"{label}: temperature must be between 0 and 2")
+
+    if node["node_type"] == "knowledgeBase":
+        chunk_size = config.get("chunkSize")
+        chunk_overlap = config.get("chunkOverlap")
+        if isinstance(chunk_size, int) and chunk_size <= 0:
+            errors.append(f"{label}: chunkSize must be positive")
+        if isinstance(chunk_overlap, int) and chunk_overlap < 0:
+            errors.append(f"{label}: chunkOverlap must not be negative")
+        if isinstance(chunk_size, int) and isinstance(chunk_overlap, int) and chunk_overlap >= chunk_size:
+            errors.append(f"{label}: chunkOverlap must be smaller than chunkSize")
+        provider = config.get("embeddingProvider")
+        if isinstance(provider, str) and provider not in PROVIDER_NAMES:
+            errors.append(f"{label}: unsupported embedding provider '{provider}'")
+
+
+def _find_cycle(node_ids: List[str], adjacency: Dict[str, List[str]]) -> Optional[List[str]]:
+    """Return the nodes of one cycle, or None (iterative DFS, no recursion limit)"""
+    WHITE, GREY, BLACK = 0, 1, 2
+    color = {node_id: WHITE for node_id in node_ids}
+
+    for root in node_ids:
+        if color[root] != WHITE:
+            continue
+        path = [root]
+        stack = [iter(adjacency.get(root, []))]
+        color[root] = GREY
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                color[path.pop()] = BLACK
+                stack.pop()
+            elif color[child] == GREY:
+                return path[path.index(child):] + [child]
+            elif color[child] == WHITE:
+                color[child] = GREY
+                path.append(child)
+                stack.append(iter(adjacency.get(child, [])))
+    return None
+
+
+def analyze_workflow(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> WorkflowAnalysis:
+    """Validate a workflow graph and compile its execution plan
+
+    `nodes` are dicts with node_id, node_type and config; `edges` are dicts with
+    source_node_id and target_node_id, in the order they were saved.
+    """
+    analysis = WorkflowAnalysis(graph_digest(nodes, edges))
+    errors, warnings = analysis.errors, analysis.warnings
+
+    if not nodes:
+        errors.append("Add components to build a workflow")
+        return analysis
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for node in nodes:
+        if node["node_id"] in by_id:
+            errors.append(f"Duplicate component id '{node['node_id']}'")
+        by_id[node["node_id"]] = node
+        if node["node_type"] not in ALLOWED_TARGETS:
+            errors.append(f"Component '{node['node_id']}' has unknown type '{node['node_type']}'")
+        else:
+            _check_config(node, errors)
+
+    adjacency: Dict[str, List[str]] = {node_id: [] for node_id in by_id}
+    for edge in edges:
+        source, target = edge["source_node_id"], edge["target_node_id"]
+        if source not in by_id or target not in by_id:
+            errors.append(f"Connection {source} -> {target} references a missing component")
+            continue
+        source_type, target_type = by_id[source]["node_type"], by_id[target]["node_type"]
+        if target_type not in ALLOWED_TARGETS.get(source_type, set()):
+            errors.append(f"A {source_type} component cannot connect to a {target_type} component")
+        adjacency[source].append(target)
+
+    cycle = _find_cycle(list(by_id), adjacency)
+    if cycle:
+        errors.append("Workflow contains a cycle: " + " -> ".join(cycle))
+
+    start_nodes = [n for n in nodes if n["node_type"] == "userQuery"]
+    if not start_nodes:
+        errors.append("Workflow must have a User Query component")
+    elif len(start_nodes) > 1:
+        errors.append("Workflow must have exactly one User Query component")
+    if not any(n["node_type"] == "output" for n in nodes):
+        errors.append("Workflow must have an Output component")
+
+    if not start_nodes or cycle:
+        return analysis
+
+    # Reachability from the user query
+    start = start_nodes[0]["node_id"]
+    reachable, frontier = {start}, [start]
+    while frontier:
+        for child in adjacency[frontier.pop()]:
+            if child not in reachable:
+                reachable.add(child)
+                frontier.append(child)
+    for node_id in by_id:
+        if node_id not in reachable:
+            warnings.append(f"Component '{node_id}' is not connected to the User Query")
+
+    # Compile the plan: execution follows the first outgoing connection of each node
+    current: Optional[str] = start
+    while current is not None:
+        node = by_id[current]
+        analysis.steps.append(PlanStep(current, node["node_type"], node.get("config")))
+        targets = adjacency[current]
+        if len(targets) > 1:
+            warnings.append(f"Component '{current}' has several outputs; only the first is executed")
+        current = targets[0] if targets else None
+
+    planned_types = [step.node_type for step in analysis.steps]
+    if "output" not in planned_types:
+        errors.append("The Output component is not reachable from the User Query")
+    if "llmEngine" not in planned_types:
+        warnings.append("Workflow has no LLM Engine; responses will be empty")
+
+    return analysis
+
+
+def analyze_stored_workflow(workflow: Any) -> WorkflowAnalysis:
+    """Analyze a workflow from its ORM nodes and edges"""
+    nodes = [
+        {"node_id": n.node_id, "node_type": n.node_type, "config": n.config or {}}
+        for n in workflow.nodes
+    ]
+    edges = [
+        {"source_node_id": e.source_node_id, "target_node_id": e.target_node_id}
+        for e in workflow.edges
+    ]
+    return analyze_workflow(nodes, edges)
+
+
+def apply_analysis(workflow: Any, analysis: WorkflowAnalysis):
+    """Store the analysis result on the workflow (the caller commits)"""
+    from database import WorkflowPlan
+
+    if workflow.plan is None:
+        workflow.plan = WorkflowPlan()
+    workflow.plan.digest = analysis.digest
+    workflow.plan.analyzer_version = ANALYZER_VERSION
+    workflow.plan.is_valid = analysis.is_valid
+    workflow.plan.errors = analysis.errors
+    workflow.plan.warnings = analysis.warnings
+    workflow.plan.steps = [step.to_dict() for step in analysis.steps]
+    workflow.is_valid = analysis.is_valid
+
+
+def stored_plan_steps(workflow: Any) -> Optional[List[PlanStep]]:
+    """Compiled steps saved with the workflow, or None if missing or outdated"""
+    plan = getattr(workflow, "plan", None)
+    if plan is None or plan.analyzer_version != ANALYZER_VERSION:
+        return None
+    return [PlanStep.from_dict(step) for step in plan.steps or []]
+
+
+def retrieval_step(steps: List[PlanStep]) -> Optional[PlanStep]:
+    """The knowledge base step that retrieves context, if the plan has one"""
+    for step in steps:
+        if step.node_type == "knowledgeBase" and step.config.get("passContext", True):
+            return step
+    return None
+
+
+def embedding_provider(steps: List[PlanStep]) -> Optional[str]:
+    """Embedding provider selected by the plan's knowledge base (None means the default)"""
+    for step in steps:
+        if step.node_type == "knowledgeBase":
+            return step.config.get("embeddingProvider")
+    return None
+
+
+def workflow_embedding_provider(workflow: Any) -> Optional[str]:
+    """Embedding provider of a stored workflow, used to embed its documents"""
+    if workflow is None:
+        return None
+    steps = stored_plan_steps(workflow)
+    if steps is None:
+        steps = analyze_stored_workflow(workflow).steps
+    return embedding_provider(steps)
+
+
+class PlanCache:
+    """Per-process LRU of compiled plans, keyed by workflow id
+
+    Lets the chat path start plan-dependent work (retrieval) before the workflow
+    has been loaded from the database; the loaded plan digest is authoritative.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, workflow_id: Any) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(str(workflow_id))
+        if entry is not None:
+            self._entries.move_to_end(str(workflow_id))
+        return entry
+
+    def put(self, workflow_id: Any, digest: str, steps: List[PlanStep], is_valid: bool):
+        self._entries[str(workflow_id)] = {"digest": digest, "steps": steps, "is_valid": is_valid}
+        self._entries.move_to_end(str(workflow_id))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put_analysis(self, workflow_id: Any, analysis: WorkflowAnalysis):
+        self.put(workflow_id, analysis.digest, analysis.steps, analysis.is_valid)
+
+    def invalidate(self, workflow_id: Any):
+        self._entries.pop(str(workflow_id), None)
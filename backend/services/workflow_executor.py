@@ -2,53 +2,100 @@
 Workflow execution service
 Orchestrate component execution based on workflow definition
 """
-from typing import Dict, Any, List
+import asyncio
+from typing import Awaitable, Callable, Dict, Any, List, Optional
 from database import Workflow
 from services.vector_store import VectorStore
 from services.llm_service import LLMService
+from services.retrieval_cache import RetrievalCache, retrieval_key
+from services.tracing import ExecutionTrace, payload_size, source_id
+from services.workflow_analyzer import analyze_stored_workflow, stored_plan_steps
+
+# Number of chunks the knowledge base retrieves per query
+RETRIEVAL_TOP_K = 5
 
 class WorkflowExecutor:
-    def __init__(self):
-        self.vector_store = VectorStore()
-        self.llm_service = LLMService()
+    def __init__(
+        self,
+        vector_store: Optional[VectorStore] = None,
+        llm_service: Optional[LLMService] = None,
+        retrieval_cache: Optional[RetrievalCache] = None
+    ):
+        self.vector_store = vector_store or VectorStore()
+        self.llm_service = llm_service or LLMService()
+        self.retrieval_cache = retrieval_cache
     
-    async def execute(self, workflow: Workflow, user_query: str) -> Dict[str, Any]:
-        """Execute a workflow with a user query"""
-        # Build execution graph
-        nodes = {node.node_id: node for node in workflow.nodes}
-        edges = workflow.edges
-        
-        # Find start node (userQuery)
-        start_nodes = [n for n in workflow.nodes if n.node_type == "userQuery"]
-        if not start_nodes:
-            raise ValueError("No user query node found")
-        
-        # Execute workflow
-        context = {"query": user_query, "sources": []}
-        current_node_id = start_nodes[0].node_id
-        
-        while current_node_id:
-            node = nodes.get(current_node_id)
-            if not node:
-                break
-            
-            # Execute node
-            context = await self._execute_node(node, context, str(workflow.id))
-            
-            # Find next node
-            next_edges = [e for e in edges if e.source_node_id == current_node_id]
-            current_node_id = next_edges[0].target_node_id if next_edges else None
-        
+    async def execute(
+        self,
+        workflow: Workflow,
+        user_query: str,
+        trace: Optional[ExecutionTrace] = None,
+        prefetched: Optional[Dict[str, asyncio.Future]] = None,
+        steps: Optional[List[Any]] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """Execute a workflow with a user query
+
+        `prefetched` may hold already running "query_embedding" and/or "retrieval"
+        tasks for this query, started by the caller while it was loading the workflow.
+        Chat sessions pass their own `steps` and conversation `history`; with `on_token`
+        the LLM response is streamed to that callback as it is generated. Pass a
+        `trace` to keep it when execution fails: the failing node's span holds the error.
+        """
+        trace = trace or ExecutionTrace(str(workflow.id))
+        try:
+            context = await self._run_plan(workflow, user_query, trace, prefetched, steps, history, on_token)
+        finally:
+            # A failed execution keeps its trace (with the failing span) for the caller to record
+            trace.finish()
         return {
             "response": context.get("response", "No response generated"),
-            "sources": context.get("sources", [])
+            "sources": context.get("sources", []),
+            "trace": trace
         }
     
+    async def _run_plan(
+        self,
+        workflow: Workflow,
+        user_query: str,
+        trace: ExecutionTrace,
+        prefetched: Optional[Dict[str, asyncio.Future]],
+        steps: Optional[List[Any]],
+        history: Optional[List[Dict[str, str]]],
+        on_token: Optional[Callable[[str], Awaitable[None]]]
+    ) -> Dict[str, Any]:
+        # Use the plan compiled when the workflow was saved; only workflows saved
+        # before plans existed are analyzed here
+        steps = steps if steps is not None else stored_plan_steps(workflow)
+        if steps is None:
+            with trace.span("plan", "plan"):
+                analysis = analyze_stored_workflow(workflow)
+                if not analysis.steps:
+                    raise ValueError("; ".join(analysis.errors) or "Workflow has no executable components")
+            steps = analysis.steps
+        
+        # Execute the plan; it is a finite list, so a bad graph can never loop forever
+        context = {"query": user_query, "sources": []}
+        for node in steps:
+            with trace.span(node.node_id, node.node_type) as span:
+                span.input_chars = payload_size(context)
+                sources_before = len(context["sources"])
+                context = await self._execute_node(node, context, str(workflow.id), prefetched, history, on_token)
+                span.output_chars = payload_size(context)
+                span.source_ids = [source_id(meta) for meta in context["sources"][sources_before:]]
+                span.tokens = context.pop("node_tokens", 0)
+                span.cached_tokens = context.pop("node_cached_tokens", 0)
+        return context
+    
     async def _execute_node(
         self,
         node: Any,
         context: Dict[str, Any],
-        workflow_id: str
+        workflow_id: str,
+        prefetched: Optional[Dict[str, asyncio.Future]] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """Execute a single node"""
         
@@ -60,9 +107,8 @@ class WorkflowExecutor:
             # Retrieve relevant documents
             config = node.config or {}
             if config.get("passContext", True):
-                results = await self.vector_store.search(
-                    context["query"],
-                    n_results=5
+                results = await self._retrieve(
+                    context["query"], prefetched or {}, config.get("embeddingProvider"), workflow_id
                 )
                 context["knowledge"] = [r["text"] for r in results]
                 context["sources"].extend([r["metadata"] for r in results])
@@ -71,16 +117,27 @@ class WorkflowExecutor:
         elif node.node_type == "llmEngine":
             # Generate response using LLM
             config = node.config or {}
-            
-            response = await self.llm_service.generate(
+            request = dict(
                 prompt=context["query"],
                 model=config.get("model", "gpt-4"),
                 temperature=config.get("temperature", 0.7),
                 system_prompt=config.get("systemPrompt"),
-                context=context.get("knowledge")
+                context=context.get("knowledge"),
+                history=history
             )
             
+            if on_token is None:
+                response = await self.llm_service.generate(**request)
+            else:
+                async for item in self.llm_service.generate_stream(**request):
+                    if "delta" in item:
+                        await on_token(item["delta"])
+                    else:
+                        response = item
+            
             context["response"] = response["response"]
+            context["node_tokens"] = response.get("tokens_used", 0)
+            context["node_cached_tokens"] = response.get("cached_tokens", 0)
             return context
         
         elif node.node_type == "output":
@@ -88,3 +145,40 @@ class WorkflowExecutor:
             return context
         
         return context
+
+    async def _retrieve(
+        self,
+        query: str,
+        prefetched: Dict[str, asyncio.Future],
+        provider: Optional[str] = None,
+        workflow_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Search the knowledge base, reusing cached or prefetched work when available"""
+        if "retrieval" in prefetched:
+            return await prefetched["retrieval"]
+        
+        shard_key = str(workflow_id) if workflow_id is not None else None
+        
+        async def search():
+            if "query_embedding" in prefetched:
+                embedding = await prefetched["query_embedding"]
+                return await self.vector_store.search_by_embedding(
+                    embedding, n_results=RETRIEVAL_TOP_K, provider=provider, workflow_id=shard_key
+                )
+            return await self.vector_store.search(query, n_results=RETRIEVAL_TOP_K, provider=provider, workflow_id=shard_key)
+        
+        if self.retrieval_cache is None:
+            return await search()
+        key = self.retrieval_key(workflow_id, query, provider)
+        return await self.retrieval_cache.fetch(key, search)
+    
+    async def retrieve(self, query: str, provider: Optional[str] = None, workflow_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Knowledge base search for a query, through the retrieval cache, as a chat message runs it
+
+        Used to warm a workflow: the search opens its collection and fills the cache.
+        """
+        return await self._retrieve(query, {}, provider, workflow_id)
+    
+    def retrieval_key(self, workflow_id: Any, query: str, provider: Optional[str]):
+        """Cache key of a knowledge base search; the active index version is part of it"""
+        return retrieval_key(workflow_id, query, RETRIEVAL_TOP_K, provider, self.vector_store.collection_name)
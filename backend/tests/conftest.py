@@ -0,0 +1,13 @@
+"""
+Shared test configuration
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_db
+
+# The app creates its tables in the lifespan, which a bare TestClient does not run
+init_db()
@@ -22,6 +22,26 @@ def test_health_check():
     assert response.json() == {"status": "healthy"}
 
 
+def test_readiness_check(monkeypatch):
+    """Test /ready stays 503 until the startup warm-up has finished"""
+    import time
+    
+    monkeypatch.setenv("WARMUP_WORKFLOWS", "0")
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "pending"
+    
+    with TestClient(app) as lifespan_client:
+        for _ in range(50):
+            response = lifespan_client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.1)
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+        assert lifespan_client.get("/health").json() == {"status": "healthy"}
+
+
 def test_root_endpoint():
     """Test root endpoint"""
     response = client.get("/")
@@ -118,6 +138,42 @@ def test_update_workflow():
     assert data["is_valid"] == True
 
 
+def test_get_workflow_etag():
+    """Test get_workflow revalidates with If-None-Match and changes ETag on update"""
+    workflow_id = test_create_workflow()
+    response = client.get(f"/api/workflows/{workflow_id}")
+    etag = response.headers["etag"]
+    
+    response = client.get(f"/api/workflows/{workflow_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    
+    client.put(f"/api/workflows/{workflow_id}", json={"edges": []})
+    response = client.get(f"/api/workflows/{workflow_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["edges"] == []
+
+
+def test_large_responses_are_compressed():
+    """Test large bodies are gzip encoded when the client accepts it"""
+    user_id = str(uuid4())
+    nodes = [
+        {"node_id": f"n{i}", "node_type": "userQuery", "position_x": float(i), "position_y": 0.0, "config": {}}
+        for i in range(50)
+    ]
+    workflow_id = client.post("/api/workflows", json={"name": "Large", "user_id": user_id, "nodes": nodes}).json()["id"]
+    
+    response = client.get(f"/api/workflows/{workflow_id}", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].startswith("W/")
+    assert len(response.json()["nodes"]) == 50
+    
+    response = client.get("/health", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+
 def test_delete_workflow():
     """Test workflow deletion"""
     # First create a workflow
@@ -160,6 +216,39 @@ def test_list_user_workflows():
     assert len(data) >= 1
 
 
+def test_cyclic_workflow_is_rejected():
+    """Test the server marks a cyclic workflow invalid and refuses to run it"""
+    user_id = str(uuid4())
+    workflow_data = {
+        "name": "Cyclic Workflow",
+        "user_id": user_id,
+        "nodes": [
+            {"node_id": "q", "node_type": "userQuery", "position_x": 0.0, "position_y": 0.0, "config": {}},
+            {"node_id": "kb", "node_type": "knowledgeBase", "position_x": 100.0, "position_y": 0.0, "config": {}},
+            {"node_id": "llm", "node_type": "llmEngine", "position_x": 200.0, "position_y": 0.0, "config": {}},
+            {"node_id": "out", "node_type": "output", "position_x": 300.0, "position_y": 0.0, "config": {}}
+        ],
+        "edges": [
+            {"edge_id": "e1", "source_node_id": "q", "target_node_id": "kb"},
+            {"edge_id": "e2", "source_node_id": "kb", "target_node_id": "llm"},
+            {"edge_id": "e3", "source_node_id": "llm", "target_node_id": "kb"}
+        ],
+        "is_valid": True
+    }
+    response = client.post("/api/workflows", json=workflow_data)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["is_valid"] is False
+    assert any("cycle" in error for error in data["errors"])
+    
+    response = client.post("/api/chat/message", json={
+        "workflow_id": data["id"],
+        "user_id": user_id,
+        "message": "hello"
+    })
+    assert response.status_code == 400
+
+
 def test_chat_history_empty():
     """Test empty chat history"""
     workflow_id = str(uuid4())
@@ -170,5 +259,354 @@ def test_chat_history_empty():
     assert len(data) == 0
 
 
+def test_chat_message_trace():
+    """Test that a chat message records a per-node execution trace"""
+    user_id = str(uuid4())
+    workflow_data = {
+        "name": "Trace Workflow",
+        "user_id": user_id,
+        "nodes": [
+            {"node_id": "q", "node_type": "userQuery", "position_x": 0.0, "position_y": 0.0, "config": {}},
+            {"node_id": "out", "node_type": "output", "position_x": 200.0, "position_y": 0.0, "config": {}}
+        ],
+        "edges": [{"edge_id": "e1", "source_node_id": "q", "target_node_id": "out"}],
+        "is_valid": True
+    }
+    workflow_id = client.post("/api/workflows", json=workflow_data).json()["id"]
+    
+    response = client.post("/api/chat/message", json={
+        "workflow_id": workflow_id,
+        "user_id": user_id,
+        "message": "hello"
+    })
+    assert response.status_code == 200
+    message_id = response.json()["message_id"]
+    
+    response = client.get(f"/api/chat/trace/{message_id}")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["workflow_id"] == workflow_id
+    assert [span["node_id"] for span in data["spans"]] == ["q", "out"]
+    assert data["spans"][0]["input_chars"] == len("hello")
+    assert data["status"] == "ok"
+
+
+def test_chat_message_embeds_only_for_retrieving_plans(monkeypatch):
+    """Test unknown workflows and plans without a knowledge base never embed the query"""
+    from services import registry
+    
+    embedded = []
+    
+    async def embed_query(query, provider=None):
+        embedded.append(query)
+        return [0.0]
+    
+    monkeypatch.setattr(registry.get_vector_store(), "embed_query", embed_query)
+    user_id = str(uuid4())
+    for _ in range(2):
+        response = client.post("/api/chat/message", json={"workflow_id": str(uuid4()), "user_id": user_id, "message": "hi"})
+        assert response.status_code == 404
+    
+    workflow_id = client.post("/api/workflows", json={
+        "name": "No Knowledge Base",
+        "user_id": user_id,
+        "nodes": [
+            {"node_id": "q", "node_type": "userQuery", "position_x": 0.0, "position_y": 0.0, "config": {}},
+            {"node_id": "out", "node_type": "output", "position_x": 200.0, "position_y": 0.0, "config": {}}
+        ],
+        "edges": [{"edge_id": "e1", "source_node_id": "q", "target_node_id": "out"}]
+    }).json()["id"]
+    for _ in range(2):
+        response = client.post("/api/chat/message", json={"workflow_id": workflow_id, "user_id": user_id, "message": "hi"})
+        assert response.status_code == 200
+    assert embedded == []
+
+
+def test_failed_chat_message_keeps_trace():
+    """Test a failed execution records its trace, with the failing span, under the user message"""
+    user_id = str(uuid4())
+    workflow_data = {
+        "name": "Failing Workflow",
+        "user_id": user_id,
+        "nodes": [
+            {"node_id": "q", "node_type": "userQuery", "position_x": 0.0, "position_y": 0.0, "config": {}},
+            {"node_id": "llm", "node_type": "llmEngine", "position_x": 100.0, "position_y": 0.0,
+             "config": {"model": "gemini-pro"}},
+            {"node_id": "out", "node_type": "output", "position_x": 200.0, "position_y": 0.0, "config": {}}
+        ],
+        "edges": [
+            {"edge_id": "e1", "source_node_id": "q", "target_node_id": "llm"},
+            {"edge_id": "e2", "source_node_id": "llm", "target_node_id": "out"}
+        ]
+    }
+    workflow_id = client.post("/api/workflows", json=workflow_data).json()["id"]
+    
+    response = client.post("/api/chat/message", json={
+        "workflow_id": workflow_id,
+        "user_id": user_id,
+        "message": "hello"
+    })
+    assert response.status_code == 500
+    
+    trace = client.get(f"/api/chat/trace/{response.headers['x-message-id']}").json()
+    assert trace["status"] == "error"
+    assert [span["node_id"] for span in trace["spans"]] == ["q", "llm"]
+    assert trace["spans"][-1]["error"].startswith("NotImplementedError")
+
+
+def test_chat_history_reads_unflushed_messages():
+    """Test write-behind chat rows are visible in the history before they are flushed"""
+    user_id = str(uuid4())
+    workflow_data = {
+        "name": "Write-behind Workflow",
+        "user_id": user_id,
+        "nodes": [
+            {"node_id": "q", "node_type": "userQuery", "position_x": 0.0, "position_y": 0.0, "config": {}},
+            {"node_id": "out", "node_type": "output", "position_x": 200.0, "position_y": 0.0, "config": {}}
+        ],
+        "edges": [{"edge_id": "e1", "source_node_id": "q", "target_node_id": "out"}]
+    }
+    # Entering the client runs the lifespan, which starts the background flusher
+    with TestClient(app) as lifespan_client:
+        workflow_id = lifespan_client.post("/api/workflows", json=workflow_data).json()["id"]
+        response = lifespan_client.post("/api/chat/message", json={
+            "workflow_id": workflow_id,
+            "user_id": user_id,
+            "message": "hello"
+        })
+        assert response.status_code == 200
+        
+        history = lifespan_client.get(f"/api/chat/history/{workflow_id}").json()
+        assert [msg["role"] for msg in history] == ["user", "assistant"]
+        trace = lifespan_client.get(f"/api/chat/trace/{response.json()['message_id']}")
+        assert trace.status_code == 200
+    
+    # Shutdown flushed the buffer to the database
+    history = client.get(f"/api/chat/history/{workflow_id}").json()
+    assert len(history) == 2
+
+
+def test_chat_trace_not_found():
+    """Test 404 for a message without a trace"""
+    response = client.get(f"/api/chat/trace/{uuid4()}")
+    assert response.status_code == 404
+
+
+def test_chat_websocket_session():
+    """Test a WebSocket chat session answers concurrent messages and pings"""
+    from starlette.websockets import WebSocketDisconnect
+    
+    user_id = str(uuid4())
+    workflow_data = {
+        "name": "Session Workflow",
+        "user_id": user_id,
+        "nodes": [
+            {"node_id": "q", "node_type": "userQuery", "position_x": 0.0, "position_y": 0.0, "config": {}},
+            {"node_id": "out", "node_type": "output", "position_x": 200.0, "position_y": 0.0, "config": {}}
+        ],
+        "edges": [{"edge_id": "e1", "source_node_id": "q", "target_node_id": "out"}],
+        "is_valid": True
+    }
+    workflow_id = client.post("/api/workflows", json=workflow_data).json()["id"]
+    
+    with client.websocket_connect(f"/api/chat/ws/{workflow_id}?user_id={user_id}") as ws:
+        assert ws.receive_json() == {"type": "ready", "workflow_id": workflow_id}
+        ws.send_json({"type": "message", "id": "a", "message": "hello"})
+        ws.send_json({"type": "message", "id": "b", "message": "again"})
+        ws.send_json({"type": "ping"})
+        frames = [ws.receive_json() for _ in range(3)]
+        assert {"type": "pong"} in frames
+        done = {f["id"]: f for f in frames if f["type"] == "done"}
+        assert set(done) == {"a", "b"} and done["a"]["message_id"]
+        
+        ws.send_json({"type": "cancel", "id": "missing"})
+        assert ws.receive_json()["type"] == "error"
+    
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"/api/chat/ws/{uuid4()}?user_id={user_id}") as ws:
+            ws.receive_json()
+    assert closed.value.code == 4404
+
+
+def test_chat_batch_evaluation():
+    """Test a batch evaluation streams one JSON line per query and writes no chat history"""
+    import json
+    
+    user_id = str(uuid4())
+    workflow_data = {
+        "name": "Eval Workflow",
+        "user_id": user_id,
+        "nodes": [
+            {"node_id": "q", "node_type": "userQuery", "position_x": 0.0, "position_y": 0.0, "config": {}},
+            {"node_id": "out", "node_type": "output", "position_x": 200.0, "position_y": 0.0, "config": {}}
+        ],
+        "edges": [{"edge_id": "e1", "source_node_id": "q", "target_node_id": "out"}],
+        "is_valid": True
+    }
+    workflow_id = client.post("/api/workflows", json=workflow_data).json()["id"]
+    queries = 'first question\n{"query": "second question", "expected": "yes"}\n\nthird question\n'
+    
+    response = client.post(
+        f"/api/chat/batch/{workflow_id}?concurrency=2",
+        files={"file": ("queries.jsonl", queries.encode(), "application/x-ndjson")}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in response.text.splitlines()]
+    summary = records.pop()
+    assert summary["summary"] and summary["queries"] == 3 and summary["errors"] == 0
+    assert sorted(r["query"] for r in records) == ["first question", "second question", "third question"]
+    assert next(r for r in records if r["index"] == 1)["expected"] == "yes"
+    assert all(r["latency_ms"] >= 0 and set(r["node_ms"]) == {"q", "out"} for r in records)
+    assert client.get(f"/api/chat/history/{workflow_id}").json() == []
+    
+    bad = client.post(f"/api/chat/batch/{workflow_id}", files={"file": ("q.jsonl", b'{"id": 1}\n')})
+    assert bad.status_code == 400
+    missing = client.post(f"/api/chat/batch/{uuid4()}", files={"file": ("q.txt", b"hello\n")})
+    assert missing.status_code == 404
+
+
+def test_load_shedding_spares_chat():
+    """Test low-priority routes get 503 + Retry-After while overloaded, others are served"""
+    from services import registry
+    
+    with TestClient(app) as lifespan_client:
+        monitor = registry.get_loop_monitor()
+        monitor.llm_threshold, monitor.llm_in_flight = 1, lambda: 1
+        response = lifespan_client.get(f"/api/workflows/user/{uuid4()}")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+        assert lifespan_client.get(f"/api/chat/trace/{uuid4()}").status_code == 404
+        assert monitor.stats()["shed_requests"] == 1
+        
+        monitor.llm_in_flight = lambda: 0
+        assert lifespan_client.get(f"/api/workflows/user/{uuid4()}").status_code == 200
+
+
+def test_request_profiling_header(monkeypatch):
+    """Test X-Profile is only honoured with the admin token and stores a profile"""
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    url = f"/api/workflows/user/{uuid4()}"
+    assert "x-profile-id" not in client.get(url, headers={"X-Profile": "cpu"}).headers
+    
+    response = client.get(url, headers={"X-Profile": "cpu,alloc", "X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+    record = client.get(f"/api/admin/profile/requests/{profile_id}", headers={"X-Admin-Token": "secret"}).json()
+    assert record["path"] == url and record["modes"] == ["cpu", "alloc"]
+    assert "allocations" in record and "collapsed" in record
+
+
+def test_admin_gc_requires_token(monkeypatch):
+    """Test the admin API is disabled without a token and rejects wrong tokens"""
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.post("/api/admin/gc").status_code == 403
+    
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.post("/api/admin/gc", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    response = client.post("/api/admin/gc", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["dry_run"] is True
+
+
+@pytest.mark.parametrize("quantization", ["", "int8"])
+def test_failed_reprocess_keeps_indexed_chunks(monkeypatch, tmp_path, quantization):
+    """Test failed (re-)processing runs keep the good chunks, can be retried and invalidate cached retrievals"""
+    import asyncio
+    import fitz
+    from database import SessionLocal, CorpusVersion
+    from services import registry
+    from services.reindexer import active_collection_name
+    from services.vector_store import VectorStore
+    
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "hashing")
+    vector_store = VectorStore(
+        path=str(tmp_path), mode="embedded", quantization=quantization, version_loader=active_collection_name
+    )
+    monkeypatch.setitem(registry._instances, "vector_store", vector_store)
+    pdf = fitz.open()
+    pdf.new_page().insert_text((72, 72), "Rockets need fuel. " * 20)
+    response = client.post(f"/api/documents/upload?user_id={uuid4()}",
+                           files={"file": (f"{uuid4()}.pdf", pdf.tobytes(), "application/pdf")})
+    document_id = response.json()["id"]
+    
+    store_embeddings = vector_store.store_embeddings
+    
+    async def store_then_fail(*args, **kwargs):
+        await store_embeddings(*args, **kwargs)
+        raise RuntimeError("lost connection")
+    
+    def corpus_version():
+        db = SessionLocal()
+        try:
+            return db.query(CorpusVersion.version).scalar()
+        finally:
+            db.close()
+    
+    async def searchable():
+        results = await vector_store.search("rockets fuel", n_results=1, provider="hashing")
+        return [r["metadata"]["document_id"] for r in results] == [document_id]
+    
+    # A failed first run leaves nothing behind, and the retry stores every chunk
+    monkeypatch.setattr(vector_store, "store_embeddings", store_then_fail)
+    assert client.post(f"/api/documents/{document_id}/process").status_code == 500
+    assert client.get(f"/api/documents/{document_id}").json()["processed"] is False
+    monkeypatch.setattr(vector_store, "store_embeddings", store_embeddings)
+    chunks = client.post(f"/api/documents/{document_id}/process").json()["chunks"]
+    assert asyncio.run(vector_store.list_document_ids()) == {document_id: chunks}
+    assert asyncio.run(searchable())
+    
+    before = corpus_version()
+    monkeypatch.setattr(vector_store, "store_embeddings", store_then_fail)
+    assert client.post(f"/api/documents/{document_id}/process").status_code == 500
+    assert corpus_version() > before
+    assert asyncio.run(vector_store.list_document_ids()) == {document_id: chunks}
+    assert asyncio.run(searchable())
+    document = client.get(f"/api/documents/{document_id}").json()
+    assert document["processed"] is True and document["embedding_count"] == chunks
+    client.delete(f"/api/documents/{document_id}")
+
+
+def test_batch_upload_archive(monkeypatch, tmp_path):
+    """Test a zip upload registers its PDFs and ingests them in the background"""
+    import io
+    import time
+    import zipfile
+    import fitz
+    
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "hashing")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in ("guides/setup.pdf", "faq.pdf"):
+            pdf = fitz.open()
+            pdf.new_page().insert_text((72, 72), f"Contents of {name}")
+            archive.writestr(name, pdf.tobytes())
+        archive.writestr("notes.txt", "not a pdf")
+    
+    with TestClient(app) as lifespan_client:
+        response = lifespan_client.post(
+            f"/api/documents/batch?user_id={uuid4()}",
+            files={"archive": ("docs.zip", buffer.getvalue(), "application/zip")}
+        )
+        assert response.status_code == 202
+        batch = response.json()
+        assert sorted(d["filename"] for d in batch["documents"]) == ["faq.pdf", "setup.pdf"]
+        
+        deadline = time.time() + 60
+        job = batch["job"]
+        while job["status"] not in ("completed", "failed") and time.time() < deadline:
+            time.sleep(0.2)
+            job = lifespan_client.get(f"/api/documents/batch/{job['id']}").json()
+        assert job["status"] == "completed"
+        assert job["processed_documents"] == 2 and job["failed_documents"] == 0
+        
+        document = lifespan_client.get(f"/api/documents/{batch['documents'][0]['id']}").json()
+        assert document["processed"] is True
+        for d in batch["documents"]:
+            lifespan_client.delete(f"/api/documents/{d['id']}")
+    
+    assert client.post(f"/api/documents/batch?user_id={uuid4()}").status_code == 400
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
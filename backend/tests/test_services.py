@@ -0,0 +1,795 @@
+"""
+Test suite for backend services
+"""
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from database import SessionLocal, ChatHistory
+from services.chat_pipeline import StagePipeline
+from services.chat_recorder import ChatRecorder
+from services.embeddings import EmbeddingProvider, HashingEmbeddingProvider, LocalEmbeddingProvider, shutdown_process_pool
+from services.garbage_collector import OrphanCollector
+from services.prompt_builder import build_messages, usage_counts
+from services.quantization import QuantizedCollection, parse_quantization
+from services.vector_store import VectorStore
+from services.workflow_analyzer import analyze_workflow
+
+
+def test_vector_store_rejects_unknown_mode():
+    """Test that an unknown VECTOR_STORE_MODE fails fast"""
+    with pytest.raises(ValueError):
+        VectorStore(mode="sharded-somewhere")
+
+
+def test_local_embedding_provider_defers_model_load(monkeypatch):
+    """Test constructing the local provider does not block on the process pool"""
+    import services.embeddings as embeddings
+
+    monkeypatch.setattr(embeddings, "get_process_pool", lambda: pytest.fail("pool used at construction"))
+    provider = LocalEmbeddingProvider(model_path="/models/unused")
+    assert provider.dim is None
+    with pytest.raises(TypeError):
+        EmbeddingProvider()
+
+
+def test_vector_store_embedded_mode(tmp_path):
+    """Test the embedded vector store opens at the given path"""
+    store = VectorStore(path=str(tmp_path), mode="embedded")
+    assert store.mode == "embedded"
+    assert store.collection.count() == 0
+
+
+async def test_hashing_embeddings_inline_and_pooled():
+    """Test the hashing provider is deterministic and the process pool gives the same vectors"""
+    texts = ["retrieval augmented generation", "workflow builder", ""]
+    inline = await HashingEmbeddingProvider(dim=64, use_pool=False).embed(texts)
+    pooled_provider = HashingEmbeddingProvider(dim=64, use_pool=True)
+    pooled_provider.batch_size = 2
+    try:
+        pooled = await pooled_provider.embed(texts)
+    finally:
+        shutdown_process_pool()
+    assert len(inline) == 3 and len(inline[0]) == 64
+    assert all(a == pytest.approx(b) for a, b in zip(inline, pooled))
+    assert sum(v * v for v in inline[0]) == pytest.approx(1.0, rel=1e-5)
+    assert not any(inline[2])
+
+
+async def test_vector_store_provider_collections(tmp_path, monkeypatch):
+    """Test a non-default provider gets its own collection and deletes reach it"""
+    monkeypatch.setenv("HASHING_EMBEDDING_DIM", "64")
+    store = VectorStore(path=str(tmp_path), mode="embedded")
+    chunks = ["cats purr softly", "rockets need fuel"]
+    embeddings = await store.create_embeddings(chunks, "hashing")
+    await store.store_embeddings("doc-1", chunks, embeddings, "hashing")
+
+    assert store.collection.count() == 0
+    results = await store.search("rockets fuel", n_results=1, provider="hashing")
+    assert results[0]["metadata"] == {"document_id": "doc-1", "chunk_index": 1}
+
+    await store.delete_document("doc-1")
+    assert await store.list_document_ids() == {}
+
+
+@pytest.mark.parametrize("mode", ["int8", "pq"])
+def test_quantized_collection_search_delete_and_reopen(tmp_path, mode):
+    """Test quantized search re-scores to the exact neighbour and survives a reopen"""
+    rng = np.random.default_rng(7)
+    vectors = rng.standard_normal((400, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"doc-{i // 100}_{i % 100}" for i in range(400)]
+    metadatas = [{"document_id": f"doc-{i // 100}", "chunk_index": i % 100} for i in range(400)]
+
+    collection = QuantizedCollection(str(tmp_path), "documents", mode, train_size=300)
+    collection.add(ids=ids, embeddings=vectors.tolist(), documents=ids, metadatas=metadatas)
+    assert collection.quantizer is not None
+    assert collection.memory_bytes() < vectors.nbytes / 3
+
+    result = collection.query(query_embeddings=[vectors[123].tolist()], n_results=3)
+    assert result["ids"][0][0] == "doc-1_23"
+    assert result["metadatas"][0][0] == {"document_id": "doc-1", "chunk_index": 23}
+
+    collection.delete(where={"document_id": {"$in": ["doc-1"]}})
+    reopened = QuantizedCollection(str(tmp_path), "documents", mode)
+    assert reopened.count() == 300
+    result = reopened.query(query_embeddings=[vectors[123].tolist()], n_results=3)
+    assert all(not row_id.startswith("doc-1_") for row_id in result["ids"][0])
+
+
+def test_quantized_collection_failed_add_keeps_offsets(tmp_path):
+    """Test an add that fails before its commit leaves no bytes that shift later rows"""
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((6, 16)).astype(np.float32)
+    collection = QuantizedCollection(str(tmp_path), "documents", "int8", train_size=100)
+    collection.add(ids=["a"], embeddings=vectors[:1].tolist(), documents=["a"], metadatas=[{"document_id": "d"}])
+    with pytest.raises(Exception):
+        # The duplicate id fails the insert after the vectors were appended
+        collection.add(ids=["b", "b"], embeddings=vectors[1:3].tolist(), documents=["b", "b"], metadatas=[{}, {}])
+    collection.add(ids=["c"], embeddings=vectors[3:4].tolist(), documents=["c"], metadatas=[{"document_id": "d"}])
+    assert collection.query(query_embeddings=[vectors[3].tolist()], n_results=1)["ids"][0] == ["c"]
+
+    # Bytes left by a crash between the file write and the commit are cut on open
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(vectors[4:6].tobytes())
+    reopened = QuantizedCollection(str(tmp_path), "documents", "int8")
+    reopened.add(ids=["e"], embeddings=vectors[5:6].tolist(), documents=["e"], metadatas=[{}])
+    assert reopened.query(query_embeddings=[vectors[5].tolist()], n_results=1)["ids"][0] == ["e"]
+    assert os.path.getsize(tmp_path / "vectors.f32") == 3 * 16 * 4
+    reopened.delete(ids=["e"])
+    assert reopened.count() == 2
+
+
+def test_quantized_collection_readds_deleted_ids(tmp_path):
+    """Test ids deleted from a quantized collection can be stored again"""
+    rng = np.random.default_rng(5)
+    vectors = rng.standard_normal((3, 16)).astype(np.float32)
+    ids = [f"doc_{i}" for i in range(3)]
+    metadatas = [{"document_id": "doc", "chunk_index": i} for i in range(3)]
+    collection = QuantizedCollection(str(tmp_path), "documents", "int8", train_size=100)
+    collection.add(ids=ids, embeddings=vectors.tolist(), documents=ids, metadatas=metadatas)
+    collection.delete(where={"document_id": "doc"})
+    assert collection.count() == 0
+
+    collection.add(ids=ids, embeddings=vectors.tolist(), documents=ids, metadatas=metadatas)
+    assert collection.count() == 3
+    assert collection.query(query_embeddings=[vectors[1].tolist()], n_results=1)["ids"][0] == ["doc_1"]
+    reopened = QuantizedCollection(str(tmp_path), "documents", "int8")
+    assert reopened.count() == 3
+    assert reopened.get()["ids"] == ids
+
+
+async def test_vector_store_quantized_delete_then_store(tmp_path, monkeypatch):
+    """Test a document deleted from a quantized store is searchable after it is stored again"""
+    monkeypatch.setenv("HASHING_EMBEDDING_DIM", "64")
+    monkeypatch.setenv("VECTOR_QUANTIZATION", "int8")
+    store = VectorStore(path=str(tmp_path), mode="embedded")
+    assert isinstance(store.collection_for("hashing"), QuantizedCollection)
+    chunks = ["cats purr softly", "rockets need fuel"]
+    embeddings = await store.create_embeddings(chunks, "hashing")
+    await store.store_embeddings("doc-1", chunks, embeddings, "hashing")
+    await store.delete_document("doc-1")
+    await store.store_embeddings("doc-1", chunks, embeddings, "hashing")
+
+    assert await store.list_document_ids() == {"doc-1": 2}
+    results = await store.search("rockets fuel", n_results=1, provider="hashing")
+    assert results[0]["metadata"] == {"document_id": "doc-1", "chunk_index": 1}
+
+
+def test_vector_store_quantization_config(tmp_path):
+    """Test VECTOR_QUANTIZATION selects collections and is rejected in server mode"""
+    assert parse_quantization("int8") == {"*": "int8"}
+    assert parse_quantization("documents=pq, documents__local=int8") == {"documents": "pq", "documents__local": "int8"}
+    with pytest.raises(ValueError):
+        parse_quantization("documents=fp4")
+    with pytest.raises(ValueError):
+        VectorStore(mode="server", quantization="int8")
+
+    store = VectorStore(path=str(tmp_path), mode="embedded", quantization="documents__hashing=int8")
+    assert isinstance(store.collection_for("hashing"), QuantizedCollection)
+    assert not isinstance(store.collection, QuantizedCollection)
+
+
+def _node(node_id, node_type, config=None):
+    return {"node_id": node_id, "node_type": node_type, "config": config or {}}
+
+
+def _edge(source, target):
+    return {"source_node_id": source, "target_node_id": target}
+
+
+def test_analyzer_compiles_linear_plan():
+    """Test a RAG workflow compiles into an ordered plan"""
+    nodes = [_node("out", "output"), _node("llm", "llmEngine"), _node("kb", "knowledgeBase"), _node("q", "userQuery")]
+    edges = [_edge("q", "kb"), _edge("kb", "llm"), _edge("llm", "out")]
+    analysis = analyze_workflow(nodes, edges)
+    assert analysis.is_valid
+    assert [step.node_id for step in analysis.steps] == ["q", "kb", "llm", "out"]
+    assert analysis.digest == analyze_workflow(list(reversed(nodes)), edges).digest
+
+
+def test_analyzer_rejects_cycles_and_dangling_edges():
+    """Test cycles, dangling edges and incompatible connections are errors"""
+    nodes = [_node("q", "userQuery"), _node("kb", "knowledgeBase"), _node("llm", "llmEngine"), _node("out", "output")]
+    edges = [_edge("q", "kb"), _edge("kb", "llm"), _edge("llm", "kb"), _edge("llm", "ghost")]
+    analysis = analyze_workflow(nodes, edges)
+    assert not analysis.is_valid
+    assert any("cycle" in error for error in analysis.errors)
+    assert any("missing component" in error for error in analysis.errors)
+    assert any("llmEngine component cannot connect" in error for error in analysis.errors)
+
+
+def test_analyzer_checks_config():
+    """Test config values are type and range checked"""
+    nodes = [
+        _node("q", "userQuery"),
+        _node("llm", "llmEngine", {"temperature": 5, "model": "unknown-model"}),
+        _node("out", "output")
+    ]
+    analysis = analyze_workflow(nodes, [_edge("q", "llm"), _edge("llm", "out")])
+    assert not analysis.is_valid
+    assert len(analysis.errors) == 2
+
+
+async def test_chat_recorder_write_behind(tmp_path):
+    """Test buffered rows are visible before the flush and persisted after it"""
+    wal_path = str(tmp_path / "chat.wal")
+    recorder = ChatRecorder(flush_interval_ms=60_000, wal_path=wal_path)
+    await recorder.start()
+    workflow_id = uuid4()
+    try:
+        row = await recorder.record_message(workflow_id=workflow_id, user_id=uuid4(), message="hi", role="user")
+        assert [r["id"] for r in recorder.pending_messages(workflow_id)] == [row["id"]]
+        assert os.path.getsize(wal_path) > 0
+        
+        assert await recorder.flush()
+        assert recorder.pending_messages(workflow_id) == []
+        assert os.path.getsize(wal_path) == 0
+        db = SessionLocal()
+        try:
+            assert db.get(ChatHistory, row["id"]).message == "hi"
+        finally:
+            db.close()
+    finally:
+        await recorder.stop()
+
+
+async def test_chat_recorder_replays_wal(tmp_path):
+    """Test rows left in the WAL by a crashed process are inserted on start"""
+    wal_path = tmp_path / "chat.wal"
+    message_id = uuid4()
+    wal_path.write_text(json.dumps({"table": "chat_history", "row": {
+        "id": str(message_id),
+        "workflow_id": str(uuid4()),
+        "user_id": str(uuid4()),
+        "message": "recovered",
+        "role": "user",
+        "created_at": "2024-01-01T00:00:00"
+    }}) + "\n")
+    
+    recorder = ChatRecorder(wal_path=str(wal_path))
+    await recorder.start()
+    await recorder.stop()
+    
+    db = SessionLocal()
+    try:
+        assert db.get(ChatHistory, message_id).message == "recovered"
+    finally:
+        db.close()
+    assert wal_path.read_text() == ""
+
+
+async def test_chat_recorder_bounded_while_database_is_down():
+    """Test a full buffer refuses rows while flushes fail and the flusher outlives other errors"""
+    from sqlalchemy.exc import OperationalError
+    
+    def database_down():
+        raise OperationalError("connect", {}, Exception("connection refused"))
+    
+    recorder = ChatRecorder(max_pending=2, flush_interval_ms=10, session_factory=database_down)
+    await recorder.start()
+    workflow_id = uuid4()
+    try:
+        rows = [
+            await recorder.record_message(workflow_id=workflow_id, user_id=uuid4(), message=f"hi {i}", role="user")
+            for i in range(2)
+        ]
+        with pytest.raises(RuntimeError):
+            await recorder.record_message(workflow_id=workflow_id, user_id=uuid4(), message="hi 2", role="user")
+        assert len(recorder.pending_messages(workflow_id)) == 2
+        
+        def broken_truncate():
+            raise OSError("disk full")
+        
+        recorder.session_factory = SessionLocal
+        recorder._truncate_wal = broken_truncate
+        await asyncio.sleep(0.2)
+        assert recorder.running
+        assert recorder.pending_messages(workflow_id) == []
+        db = SessionLocal()
+        try:
+            assert all(db.get(ChatHistory, row["id"]) is not None for row in rows)
+        finally:
+            db.close()
+    finally:
+        recorder.__dict__.pop("_truncate_wal", None)
+        await recorder.stop()
+
+
+async def test_stage_pipeline_runs_independent_stages_concurrently():
+    """Test stages overlap, receive dependency results and can be cancelled"""
+    events = []
+    
+    async def slow(name, value):
+        events.append(f"start:{name}")
+        await asyncio.sleep(0.05)
+        events.append(f"end:{name}")
+        return value
+    
+    pipeline = StagePipeline()
+    pipeline.add("load", lambda: slow("load", 1))
+    pipeline.add("embed", lambda: slow("embed", 2))
+    pipeline.add("search", lambda embed: slow("search", embed * 10), after=["embed"])
+    pipeline.add("never", lambda: asyncio.sleep(10))
+    
+    assert await pipeline.result("search") == 20
+    assert events[:2] == ["start:load", "start:embed"]
+    pipeline.cancel()
+    await asyncio.sleep(0)
+    assert pipeline.task("never").cancelled()
+
+
+async def test_orphan_collector_dry_run_and_delete(tmp_path):
+    """Test chunks and files without a Document row are reported, then deleted"""
+    store = VectorStore(path=str(tmp_path / "chroma"), mode="embedded")
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    (upload_dir / "orphan.pdf").write_bytes(b"%PDF")
+    orphan_id = str(uuid4())
+    await store.store_embeddings(orphan_id, ["a", "b"], [[0.1, 0.2], [0.2, 0.1]])
+    
+    collector = OrphanCollector(store, upload_dir=str(upload_dir), batch_delay_ms=0, min_file_age_s=0)
+    report = await collector.collect(dry_run=True)
+    assert report["orphan_chunks"] == 2
+    assert report["orphan_files"] == 1
+    assert store.collection.count() == 2
+    
+    report = await collector.collect(dry_run=False)
+    assert report["deleted_chunks"] == 2
+    assert report["deleted_files"] == 1
+    assert store.collection.count() == 0
+    assert not (upload_dir / "orphan.pdf").exists()
+
+
+async def test_orphan_collector_spares_documents_processed_during_scan(tmp_path):
+    """Test chunks of a document whose row is committed during the index scan are kept"""
+    from sqlalchemy.orm import sessionmaker
+    from database import Base, Document, create_db_engine
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'gc.sqlite'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    store = VectorStore(path=str(tmp_path / "chroma"), mode="embedded")
+    document_id, orphan_id = uuid4(), str(uuid4())
+    await store.store_embeddings(str(document_id), ["new"], [[0.1, 0.2]])
+    await store.store_embeddings(orphan_id, ["old"], [[0.2, 0.1]])
+    list_document_ids = store.list_document_ids
+
+    async def listing_then_commit(*args, **kwargs):
+        indexed = await list_document_ids(*args, **kwargs)
+        db = factory()
+        db.add(Document(id=document_id, user_id=uuid4(), filename="new.pdf", file_path=str(tmp_path / "new.pdf")))
+        db.commit()
+        db.close()
+        return indexed
+
+    store.list_document_ids = listing_then_commit
+    collector = OrphanCollector(store, upload_dir=str(tmp_path / "uploads"), batch_delay_ms=0, session_factory=factory)
+    report = await collector.collect(dry_run=False)
+    assert report["deleted_chunks"] == 1
+    assert store.collection.get(where={"document_id": str(document_id)})["ids"]
+    engine.dispose()
+
+
+async def test_ingestion_survives_failed_cleanup_and_fails_on_dead_embedders(tmp_path, monkeypatch):
+    """Test a failing chunk cleanup is reported per document and dead embedders fail the job"""
+    import fitz
+    from sqlalchemy.orm import sessionmaker
+    from database import Base, create_db_engine
+    from services import ingestion
+    from services.document_processor import DocumentProcessor
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'ingest.sqlite'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    saved = []
+    for i in range(6):
+        path = str(tmp_path / f"doc{i}.pdf")
+        pdf = fitz.open()
+        pdf.new_page().insert_text((72, 72), f"Document number {i}")
+        pdf.save(path)
+        saved.append({"filename": f"doc{i}.pdf", "file_path": path, "file_size": 1, "mime_type": "application/pdf"})
+
+    class BrokenStore:
+        async def create_embeddings(self, texts, provider=None):
+            raise RuntimeError("embedding service down")
+
+        async def delete_document(self, document_id, version=None):
+            raise RuntimeError("vector store down")
+
+    ingestor = ingestion.BatchIngestor(BrokenStore(), DocumentProcessor(), upload_dir=str(tmp_path),
+                                       extract_workers=2, embed_concurrency=1, session_factory=factory)
+    registered = ingestor.register(saved, None, uuid4())
+    job_id = registered["job"]["id"]
+    await asyncio.wait_for(ingestor.run(job_id, registered["documents"]), timeout=60)
+    job = ingestor.get_job(job_id)
+    assert job["status"] == "completed" and job["failed_documents"] == 6
+
+    async def broken_progress(self, document, error):
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr(ingestion._Progress, "failed", broken_progress)
+    registered = ingestor.register(saved, None, uuid4())
+    job_id = registered["job"]["id"]
+    await asyncio.wait_for(ingestor.run(job_id, registered["documents"]), timeout=60)
+    assert ingestor.get_job(job_id)["status"] == "failed"
+    engine.dispose()
+
+
+async def test_reindexer_builds_switches_and_drops_old_version(tmp_path, monkeypatch):
+    """Test a reindex rebuilds from the upload, switches reads and drops the old index"""
+    import fitz
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from database import Base, Document, IndexVersion
+    from services.document_processor import DocumentProcessor
+    from services.reindexer import Reindexer, active_collection_name
+
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "hashing")
+    engine = create_engine(f"sqlite:///{tmp_path / 'reindex.sqlite'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+
+    pdf_path = str(tmp_path / "notes.pdf")
+    pdf = fitz.open()
+    pdf.new_page().insert_text((72, 72), "Rockets need fuel. Cats purr softly. " * 4)
+    pdf.save(pdf_path)
+    db = factory()
+    document = Document(user_id=uuid4(), filename="notes.pdf", file_path=pdf_path, processed=True, embedding_count=1)
+    db.add(document)
+    db.commit()
+    document_id = str(document.id)
+    db.close()
+
+    store = VectorStore(
+        path=str(tmp_path / "chroma"),
+        mode="embedded",
+        version_loader=lambda: active_collection_name(factory)
+    )
+    old_chunks = ["stale chunk"]
+    await store.store_embeddings(document_id, old_chunks, await store.create_embeddings(old_chunks))
+
+    reindexer = Reindexer(store, DocumentProcessor(), drop_delay_s=0, session_factory=factory)
+    version = reindexer.create_version(chunk_size=40, chunk_overlap=0)
+    assert version["documents"] == {"pending": 1, "done": 0, "failed": 0}
+    with pytest.raises(ValueError):
+        reindexer.create_version()
+
+    summary = await reindexer.run(version["id"])
+    assert summary["status"] == "active" and summary["finished_at"]
+    assert summary["documents"]["done"] == 1
+    assert store.collection_name == active_collection_name(factory) == "documents_v1"
+    assert "documents__hashing" not in [c.name for c in store.client.list_collections()]
+
+    results = await store.search("rockets fuel", n_results=1)
+    assert results[0]["metadata"]["document_id"] == document_id
+    assert results[0]["text"] != "stale chunk"
+    db = factory()
+    assert db.get(Document, document.id).embedding_count > 1
+    assert db.query(IndexVersion).count() == 1
+    db.close()
+
+
+async def test_retrieval_cache_invalidates_on_corpus_change(tmp_path):
+    """Test repeated lookups are served from the cache until a committed bump"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from database import Base
+    from services.retrieval_cache import RetrievalCache, bump_corpus_version, retrieval_key
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.sqlite'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    cache = RetrievalCache(max_entries=2, version_ttl_s=60, session_factory=factory)
+    searches = []
+
+    async def search():
+        searches.append(1)
+        await asyncio.sleep(0.01)
+        return [{"text": f"result {len(searches)}"}]
+
+    key = retrieval_key("wf", "What is  FUEL?", 5, None, "documents")
+    assert key == retrieval_key("wf", "what is fuel?", 5, None, "documents")
+    first, second = await asyncio.gather(cache.fetch(key, search), cache.fetch(key, search))
+    assert first == second and len(searches) == 1
+    assert cache.peek(key) == first
+
+    # A rolled back bump changes nothing, a committed one is seen at once despite the TTL
+    db = factory()
+    bump_corpus_version(db)
+    db.rollback()
+    assert cache.peek(key) == first
+    bump_corpus_version(db)
+    db.commit()
+    db.close()
+    assert cache.peek(key) is None
+    assert (await cache.fetch(key, search))[0]["text"] == "result 2"
+
+    # Least recently used entries are evicted
+    await cache.fetch(retrieval_key("wf", "a", 5, None, "documents"), search)
+    await cache.fetch(retrieval_key("wf", "b", 5, None, "documents"), search)
+    assert cache.peek(key) is None and cache.hits == 1
+
+
+async def test_loop_monitor_measures_lag_and_reports_blocking_site():
+    """Test a blocking call shows up as lag, overload and a blocking call site"""
+    import time
+    from services.loop_monitor import LoopMonitor
+
+    monitor = LoopMonitor(interval_ms=10, lag_threshold_ms=50, llm_threshold=0, debug=True, block_report_ms=20)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        assert monitor.overload_reason() is None
+        time.sleep(0.2)  # blocks the loop
+        await asyncio.sleep(0.03)
+        assert monitor.lag_ms > 100
+        assert "lag" in monitor.overload_reason()
+        sites = monitor.slowest_call_sites()
+        assert sites and sites[0]["site"].startswith("tests/test_services.py")
+        assert "sleep" in sites[0]["leaf"] or sites[0]["leaf"] == sites[0]["site"]
+    finally:
+        await monitor.stop()
+    assert not monitor.running
+
+
+async def test_profiler_collapsed_stacks_and_request_allocations():
+    """Test a timed profile samples running code and request profiles record allocations"""
+    from services.profiler import Profiler
+
+    import time
+
+    profiler = Profiler(interval_ms=2, keep=1)
+
+    def busy_work():
+        deadline = time.monotonic() + 0.15
+        while time.monotonic() < deadline:
+            sum(range(1000))
+
+    worker = asyncio.create_task(asyncio.to_thread(busy_work))
+    result = await profiler.profile(0.1)
+    await worker
+    assert result["samples"] > 0
+    assert any("busy_work (tests/test_services.py" in line for line in result["collapsed"].splitlines())
+    with pytest.raises(ValueError):
+        await profiler.profile(0)
+
+    async with profiler.profile_request(["alloc"], "GET", "/x") as record:
+        blob = [bytearray(1024) for _ in range(500)]
+    assert record["allocations"] and record["allocations"][0]["size_diff_kib"] > 400
+    assert "collapsed" not in record and len(blob) == 500
+    assert profiler.request_profiles()[0]["id"] == record["id"]
+
+
+async def test_write_queue_group_commits_and_isolates_failures(tmp_path):
+    """Test queued writes share a transaction and a failing job only fails itself"""
+    from sqlalchemy import text
+    from sqlalchemy.orm import sessionmaker
+    from database import Base, Workflow, create_db_engine
+    from services.db_writer import WriteQueue
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'writes.sqlite'}", sqlite_profile="production")
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    factory = sessionmaker(bind=engine)
+    writer = WriteQueue(enabled=True, max_batch=50, session_factory=factory)
+    writer.start()
+
+    def add(name, db):
+        db.add(Workflow(user_id=uuid4(), name=name))
+        return name
+
+    def fail(db):
+        db.add(Workflow(user_id=uuid4(), name="rolled back"))
+        raise ValueError("bad job")
+
+    from functools import partial
+    jobs = [writer.submit(partial(add, f"wf-{i}")) for i in range(10)] + [writer.submit(fail)]
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    await writer.stop()
+    assert results[:10] == [f"wf-{i}" for i in range(10)]
+    assert isinstance(results[10], ValueError)
+    db = factory()
+    assert db.query(Workflow).count() == 10
+    db.close()
+    engine.dispose()
+
+
+async def test_sharded_vector_store_merges_and_meets_deadline(tmp_path, monkeypatch):
+    """Test scatter-gather returns the global top-k and partial results when a shard is slow"""
+    from services.retrieval_cache import RetrievalCache
+    from services.vector_shards import ShardedVectorStore, parse_shards
+
+    monkeypatch.setenv("HASHING_EMBEDDING_DIM", "64")
+    shards = [VectorStore(path=str(tmp_path / str(i)), mode="embedded") for i in range(3)]
+    sharded = ShardedVectorStore(shards, deadline_ms=300)
+    single = VectorStore(path=str(tmp_path / "single"), mode="embedded")
+    topics = ["cats purr softly", "rockets need fuel", "bread needs yeast", "rivers reach the sea"]
+    for i in range(12):
+        chunks = [f"{topics[(i + j) % 4]} note {i}-{j}" for j in range(3)]
+        embeddings = await single.create_embeddings(chunks, "hashing")
+        await single.store_embeddings(f"doc-{i}", chunks, embeddings, "hashing")
+        await sharded.store_embeddings(f"doc-{i}", chunks, embeddings, "hashing")
+    assert all(shard.collection_for("hashing").count() > 0 for shard in shards)
+
+    # Same ranked distances as one store holding everything (ties may come back in either order)
+    ranked = await single.query(await single.embed_query("rockets fuel", "hashing"), 36, "hashing")
+    distance = {item["text"]: d for d, item in ranked}
+    results = await sharded.search("rockets fuel", n_results=5, provider="hashing")
+    assert [distance[r["text"]] for r in results] == pytest.approx([d for d, _ in ranked[:5]])
+    assert not results.partial
+
+    slow = shards[1].query
+
+    async def stalled(*args, **kwargs):
+        await asyncio.sleep(5)
+        return await slow(*args, **kwargs)
+
+    shards[1].query = stalled
+    cache = RetrievalCache(max_entries=10)
+    started = time.perf_counter()
+    results = await cache.fetch(("wf", "rockets"), lambda: sharded.search("rockets fuel", n_results=5, provider="hashing"))
+    assert time.perf_counter() - started < 2
+    assert 0 < len(results) <= 5 and sharded.partial_searches == 1
+    assert sharded.stats()["shards"][1]["missed"] == 1
+    # Partial results are not served from the cache
+    assert cache.peek(("wf", "rockets")) is None
+
+    await sharded.delete_documents([f"doc-{i}" for i in range(12)])
+    assert await sharded.list_document_ids() == {}
+    assert parse_shards("http://10.0.0.2:8101, ./shards/1") == [
+        {"mode": "server", "host": "10.0.0.2", "port": "8101"},
+        {"mode": "embedded", "path": "./shards/1"},
+    ]
+
+
+async def test_sharded_vector_store_routes_by_workflow(tmp_path, monkeypatch):
+    """Test VECTOR_SHARD_BY=workflow keeps a workflow on one shard and searches only its documents"""
+    from services.vector_shards import ShardedVectorStore
+
+    monkeypatch.setenv("HASHING_EMBEDDING_DIM", "64")
+    shards = [VectorStore(path=str(tmp_path / str(i)), mode="embedded") for i in range(2)]
+    sharded = ShardedVectorStore(shards, strategy="workflow", deadline_ms=0)
+    for workflow_id in ("wf-a", "wf-b"):
+        for i in range(3):
+            chunks = [f"{workflow_id} rockets need fuel {i}"]
+            embeddings = await sharded.create_embeddings(chunks, "hashing")
+            await sharded.store_embeddings(f"{workflow_id}-doc-{i}", chunks, embeddings, "hashing", workflow_id=workflow_id)
+
+    home = shards[sharded.shard_for("ignored", "wf-a")]
+    assert home.collection_for("hashing").count() >= 3
+    results = await sharded.search("rockets fuel", n_results=10, provider="hashing", workflow_id="wf-a")
+    assert len(results) == 3
+    assert {r["metadata"]["workflow_id"] for r in results} == {"wf-a"}
+    assert len(await sharded.search("rockets fuel", n_results=10, provider="hashing")) == 6
+
+
+async def test_batch_evaluator_batches_embeddings(tmp_path, monkeypatch):
+    """Test a batch embeds its distinct queries in batches and shares retrievals of duplicates"""
+    from types import SimpleNamespace
+    from services.batch_eval import BatchEvaluator, parse_queries
+    from services.retrieval_cache import RetrievalCache
+    from services.workflow_executor import WorkflowExecutor
+
+    monkeypatch.setenv("HASHING_EMBEDDING_DIM", "64")
+    store = VectorStore(path=str(tmp_path), mode="embedded")
+    chunks = ["cats purr softly", "rockets need fuel"]
+    await store.store_embeddings("doc-1", chunks, await store.create_embeddings(chunks, "hashing"), "hashing")
+    embedded, searches = [], []
+    create_embeddings, query = store.create_embeddings, store.query
+
+    async def counting_embeddings(texts, provider=None):
+        embedded.append(len(texts))
+        return await create_embeddings(texts, provider)
+
+    async def counting_query(*args, **kwargs):
+        searches.append(1)
+        return await query(*args, **kwargs)
+
+    store.create_embeddings, store.query = counting_embeddings, counting_query
+    nodes = [_node("q", "userQuery"), _node("kb", "knowledgeBase", {"embeddingProvider": "hashing"}), _node("out", "output")]
+    analysis = analyze_workflow(nodes, [_edge("q", "kb"), _edge("kb", "out")])
+    executor = WorkflowExecutor(vector_store=store, retrieval_cache=RetrievalCache(max_entries=100))
+    evaluator = BatchEvaluator(executor, concurrency=4, embed_batch=4)
+
+    lines = [f"question {i % 6}" for i in range(12)] + ['{"query": "rockets fuel", "id": "r1"}']
+    queries = parse_queries(lines)
+    records = [r async for r in evaluator.run(SimpleNamespace(id=uuid4()), analysis.steps, queries)]
+    summary = records.pop()
+    assert summary["summary"] and summary["queries"] == 13 and summary["errors"] == 0
+    assert sorted(r["index"] for r in records) == list(range(13))
+    assert embedded == [4, 3]
+    assert len(searches) == 7
+    rockets = next(r for r in records if r.get("id") == "r1")
+    assert rockets["sources"][0] == "doc-1:1" and "kb" in rockets["node_ms"]
+    with pytest.raises(ValueError, match="Line 2"):
+        parse_queries(["ok", '{"id": 1}'])
+
+
+def test_prompt_prefix_is_stable_across_retrievals():
+    """Test static parts form a byte-identical prefix and retrieved context goes last"""
+    history = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+    first = build_messages("What is RAG?", "You are helpful.\r\n", ["chunk b", "chunk a", "chunk b"], history)
+    second = build_messages("Another question", "You are helpful.", ["chunk c"], history)
+
+    assert json.dumps(first[:-1]).encode() == json.dumps(second[:-1]).encode()
+    assert first[0] == {"role": "system", "content": "You are helpful."}
+    assert first[-1] == {"role": "user", "content": "Context:\nchunk b\n\nchunk a\n\nQuestion:\nWhat is RAG?"}
+    assert build_messages("Plain", None, None) == [{"role": "user", "content": "Plain"}]
+
+
+def test_usage_counts_reads_cached_tokens():
+    """Test cached prompt tokens are read from typed and untyped usage blocks"""
+    typed = SimpleNamespace(total_tokens=120, prompt_tokens=100,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+    untyped = {"total_tokens": 30, "prompt_tokens": 20, "prompt_tokens_details": {"cached_tokens": 0}}
+
+    assert usage_counts(typed) == {"tokens_used": 120, "prompt_tokens": 100, "cached_tokens": 64}
+    assert usage_counts(untyped) == {"tokens_used": 30, "prompt_tokens": 20, "cached_tokens": 0}
+    assert usage_counts(SimpleNamespace(total_tokens=5, prompt_tokens=3))["cached_tokens"] == 0
+
+
+async def test_warmup_preloads_busiest_workflows(tmp_path, monkeypatch):
+    """Test warm-up compiles the busiest workflows' plans and caches their top questions"""
+    from datetime import datetime, timedelta
+    from sqlalchemy.orm import sessionmaker
+    from database import Base, Workflow, WorkflowEdge, WorkflowNode, create_db_engine
+    from services.retrieval_cache import RetrievalCache
+    from services.warmup import WarmUp
+    from services.workflow_analyzer import PlanCache
+    from services.workflow_executor import WorkflowExecutor
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'warmup.sqlite'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    workflows = []
+    for name in ("busy", "quiet", "stale"):
+        workflow = Workflow(user_id=uuid4(), name=name)
+        workflow.nodes = [
+            WorkflowNode(node_id=node_id, node_type=node_type, position_x=0, position_y=0, config=config)
+            for node_id, node_type, config in [
+                ("q", "userQuery", {}), ("kb", "knowledgeBase", {"embeddingProvider": "hashing"}), ("out", "output", {})
+            ]
+        ]
+        workflow.edges = [
+            WorkflowEdge(edge_id="e1", source_node_id="q", target_node_id="kb"),
+            WorkflowEdge(edge_id="e2", source_node_id="kb", target_node_id="out"),
+        ]
+        db.add(workflow)
+        workflows.append(workflow)
+    db.flush()
+    busy, quiet, stale = workflows
+    old = datetime.utcnow() - timedelta(days=30)
+    rows = [(busy, "rockets fuel", None)] * 3 + [(busy, "cats", None)] * 2 + [(busy, "rare", None)]
+    rows += [(quiet, "hello", None)] * 2 + [(stale, "old question", old)] * 9
+    for workflow, message, created_at in rows:
+        db.add(ChatHistory(workflow_id=workflow.id, user_id=uuid4(), message=message, role="user", created_at=created_at))
+    db.commit()
+    ids = {workflow.name: workflow.id for workflow in workflows}
+    db.close()
+
+    monkeypatch.setenv("HASHING_EMBEDDING_DIM", "64")
+    store = VectorStore(path=str(tmp_path / "chroma"), mode="embedded")
+    chunks = ["cats purr softly", "rockets need fuel"]
+    await store.store_embeddings("doc-1", chunks, await store.create_embeddings(chunks, "hashing"), "hashing")
+    plan_cache, retrieval_cache = PlanCache(), RetrievalCache(max_entries=100, session_factory=factory)
+    executor = WorkflowExecutor(vector_store=store, retrieval_cache=retrieval_cache)
+    warmup = WarmUp(plan_cache, max_workflows=2, queries=2, window_days=7, session_factory=factory)
+
+    assert [item["workflow_id"] for item in warmup.hot_workflows()] == [ids["busy"], ids["quiet"]]
+    assert warmup.hot_workflows()[0]["questions"] == ["rockets fuel", "cats"]
+    assert not warmup.ready
+    await warmup.run(lambda: executor)
+    assert warmup.ready and warmup.stats()["warmed_workflows"] == 2
+    assert plan_cache.get(ids["busy"]) is not None and plan_cache.get(ids["stale"]) is None
+    key = executor.retrieval_key(ids["busy"], "Rockets fuel", "hashing")
+    assert retrieval_cache.peek(key) is not None
+    engine.dispose()